@@ -0,0 +1,160 @@
+# aggregates the click-events stream written by app.py into per-link analytics:
+#   clicks:<id>:minute|hour|day:<period>  hashes of click counts per minute, hour and day (UTC)
+#   uniques:<id> and uniques:<id>:day:<date>  HyperLogLog estimates of unique visitors
+#   referrers:<id> and agents:<id>  sorted sets of referrer hosts and browser families
+# run one or more copies next to the web workers (they share the consumer group):
+#   python analytics_consumer.py --name worker-1
+# a batch's writes and its XACK commit in one MULTI/EXEC, so a crash either applies and acknowledges
+# the batch or leaves it pending untouched; entries left pending by a consumer that never came back
+# are claimed by the others with XAUTOCLAIM
+import argparse
+import logging
+import socket
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+
+from redis.exceptions import ResponseError
+
+from app import CLICK_BUCKETS, CLICK_STREAM, click_bucket_key, redis
+
+CONSUMER_GROUP = 'click-analytics'
+UNIQUES_DAY_TTL = 40 * 86400
+
+# checked in order, first match wins
+AGENT_FAMILIES = [
+    ('bot', ('bot', 'spider', 'crawl', 'slurp', 'preview')),
+    ('Edge', ('Edg/',)),
+    ('Opera', ('OPR/', 'Opera')),
+    ('Chrome', ('Chrome/', 'CriOS/')),
+    ('Firefox', ('Firefox/', 'FxiOS/')),
+    ('Safari', ('Safari/',)),
+    ('curl', ('curl/',)),
+]
+
+
+def agent_family(user_agent):
+    lowered = user_agent.lower()
+    for family, markers in AGENT_FAMILIES:
+        if any(marker.lower() in lowered for marker in markers):
+            return family
+    return 'other' if user_agent else 'unknown'
+
+
+def referrer_host(referrer):
+    if not referrer:
+        return 'direct'
+    return urlparse(referrer).hostname or 'unknown'
+
+
+def aggregate(events):
+    # fold a batch of events into counter increments so each key is written once per batch
+    counters, ttls, uniques, referrers, agents = {}, {}, {}, {}, {}
+    for event in events:
+        short_id = event['id']
+        when = datetime.utcfromtimestamp(int(event['ts']) / 1000.0)
+        for granularity, (_, _, ttl) in CLICK_BUCKETS.items():
+            key, field = click_bucket_key(short_id, granularity, when)
+            counters[key, field] = counters.get((key, field), 0) + 1
+            ttls[key] = ttl
+        for key in ('uniques:' + short_id, 'uniques:%s:day:%s' % (short_id, when.strftime('%Y%m%d'))):
+            uniques.setdefault(key, set()).add(event['visitor'])
+        host = referrer_host(event.get('referrer'))
+        referrers[short_id, host] = referrers.get((short_id, host), 0) + 1
+        family = agent_family(event.get('agent', ''))
+        agents[short_id, family] = agents.get((short_id, family), 0) + 1
+    return counters, ttls, uniques, referrers, agents
+
+
+def apply(events, entry_ids):
+    # the increments and the XACK of entry_ids run in one transaction, so a batch is never counted twice
+    counters, ttls, uniques, referrers, agents = aggregate(events)
+    pipe = redis.pipeline(transaction=True)
+    for (key, field), count in counters.items():
+        pipe.hincrby(key, field, count)
+    for key, ttl in ttls.items():
+        if ttl:
+            pipe.expire(key, ttl)
+    for key, visitors in uniques.items():
+        pipe.pfadd(key, *visitors)
+        if ':day:' in key:
+            pipe.expire(key, UNIQUES_DAY_TTL)
+    for (short_id, host), count in referrers.items():
+        pipe.zincrby('referrers:' + short_id, count, host)
+    for (short_id, family), count in agents.items():
+        pipe.zincrby('agents:' + short_id, count, family)
+    pipe.xack(CLICK_STREAM, CONSUMER_GROUP, *entry_ids)
+    pipe.execute()
+
+
+def ensure_group():
+    try:
+        redis.xgroup_create(CLICK_STREAM, CONSUMER_GROUP, id='0', mkstream=True)
+    except ResponseError as exc:
+        if 'BUSYGROUP' not in str(exc):
+            raise
+
+
+def claim_stale(name, min_idle_ms, batch_size):
+    # take over entries other consumers read but left unacknowledged for min_idle_ms;
+    # they join this consumer's pending list and are read back from '0'
+    start, claimed = '0-0', 0
+    while True:
+        response = redis.execute_command(
+            'XAUTOCLAIM', CLICK_STREAM, CONSUMER_GROUP, name, min_idle_ms, start, 'COUNT', batch_size, 'JUSTID'
+        )
+        start = response[0]
+        claimed += len(response[1])
+        if start == '0-0':
+            return claimed
+
+
+def consume(name, batch_size, block_ms, claim_idle_ms):
+    ensure_group()
+    # first finish what this consumer read but did not acknowledge before it stopped, then take new events
+    position = '0'
+    last_claim = 0
+    while True:
+        if position == '>' and time.time() - last_claim >= claim_idle_ms / 1000.0:
+            last_claim = time.time()
+            try:
+                if claim_stale(name, claim_idle_ms, batch_size):
+                    position = '0'
+            except Exception:
+                logging.exception('claiming stale %s entries failed', CLICK_STREAM)
+        try:
+            response = redis.xreadgroup(CONSUMER_GROUP, name, {CLICK_STREAM: position}, count=batch_size, block=block_ms)
+        except Exception:
+            logging.exception('reading %s failed', CLICK_STREAM)
+            time.sleep(1)
+            continue
+        entries = response[0][1] if response else []
+        if position == '0' and not entries:
+            position = '>'
+            continue
+        if not entries:
+            continue
+        try:
+            # entries trimmed from the stream while pending come back without fields
+            events = [fields for _, fields in entries if fields]
+            apply(events, [entry_id for entry_id, _ in entries])
+        except Exception:
+            # left pending; picked up again from '0' after a pause
+            logging.exception('aggregating %d click events failed', len(entries))
+            position = '0'
+            time.sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate shortener click events')
+    parser.add_argument('--name', default=socket.gethostname(), help='consumer name, keep it stable across restarts')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--block-ms', type=int, default=5000)
+    parser.add_argument('--claim-idle-ms', type=int, default=60000,
+                        help='claim entries another consumer has left unacknowledged this long')
+    args = parser.parse_args()
+    consume(args.name, args.batch_size, args.block_ms, args.claim_idle_ms)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,414 @@
-from flask import Flask, render_template, send_file, send_from_directory, redirect, url_for, request
+from flask import Flask, render_template, send_file, send_from_directory, redirect, url_for, request, jsonify, Response
 import redis
 from urllib.parse import urlparse   
 # import urlparse
 import string
 import os
+import atexit
+import csv
+import hashlib
+import io
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
 from werkzeug.exceptions import HTTPException, NotFound
 from math import floor
 
 app = Flask(__name__)
 app.debug = True
 
-redis = redis.Redis()
+REDIS_DB = int(os.environ.get('REDIS_DB', 0))
+redis = redis.Redis(db=REDIS_DB, decode_responses=True)
+
+# "keys": url-target:<short_id> and reverse-url:<url> strings (original layout)
+# "hash": targets bucketed into url:<id // HASH_BUCKET_SIZE> hashes and a reverse index keyed by a
+# truncated url digest, so each link costs a few bytes inside a listpack instead of two top-level keys.
+# Redis keeps a hash as a listpack only while it has at most hash-max-listpack-entries fields (128 by default)
+# and every value is at most hash-max-listpack-value bytes (64 by default); raise the latter to fit your urls
+# (e.g. 512) and the former together with HASH_BUCKET_SIZE. Use migrate_layout.py to move existing links.
+STORAGE_LAYOUT = os.environ.get('STORAGE_LAYOUT', 'keys')
+HASH_BUCKET_SIZE = int(os.environ.get('HASH_BUCKET_SIZE', 100))
+REVERSE_BUCKET_COUNT = int(os.environ.get('REVERSE_BUCKET_COUNT', 4096))  # aim for about links / 100
+
+# hot-link cache: short_id -> target kept in process so popular redirects skip Redis
+LINK_CACHE_SIZE = int(os.environ.get('LINK_CACHE_SIZE', 10000))
+LINK_CACHE_TTL = float(os.environ.get('LINK_CACHE_TTL', 300))
+# channel other processes publish short ids to when a mapping changes or is removed
+LINK_INVALIDATION_CHANNEL = 'link-invalidate'
+# clicks are counted in process and written with one pipelined INCRBY per link this often
+CLICK_FLUSH_INTERVAL = float(os.environ.get('CLICK_FLUSH_INTERVAL', 0.25))
+# every click is also appended (by the same flush) to a stream that analytics_consumer.py aggregates
+CLICK_STREAM = 'click-events'
+CLICK_STREAM_MAXLEN = int(os.environ.get('CLICK_STREAM_MAXLEN', 1000000))
+# events kept in process while Redis is unreachable; older ones are dropped beyond this
+MAX_BUFFERED_CLICK_EVENTS = int(os.environ.get('MAX_BUFFERED_CLICK_EVENTS', 100000))
+# time-bucketed counters: granularity -> (key period format, field format, seconds to keep)
+CLICK_BUCKETS = OrderedDict([
+    ('minute', ('%Y%m%d%H', '%M', 2 * 86400)),
+    ('hour', ('%Y%m%d', '%H', 90 * 86400)),
+    ('day', ('%Y%m', '%d', None)),
+])
+
+
+class LinkCache(object):
+    # bounded LRU with a per-entry TTL, shared by the worker's request threads
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, short_id):
+        with self._lock:
+            entry = self._entries.get(short_id)
+            if entry is None:
+                return None
+            target, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[short_id]
+                return None
+            self._entries.move_to_end(short_id)
+            return target
+
+    def set(self, short_id, target):
+        with self._lock:
+            self._entries[short_id] = (target, time.monotonic() + self.ttl)
+            self._entries.move_to_end(short_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, short_id):
+        with self._lock:
+            self._entries.pop(short_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ClickCounter(object):
+    # accumulates clicks per short id (and their analytics events) until the flusher thread writes them to Redis
+
+    def __init__(self):
+        self._pending = {}
+        # bounded so a Redis outage cannot grow it without limit; the oldest events fall off first
+        self._events = deque(maxlen=MAX_BUFFERED_CLICK_EVENTS)
+        self.dropped_events = 0
+        self._lock = threading.Lock()
+
+    def add(self, short_id, count=1, event=None):
+        with self._lock:
+            self._pending[short_id] = self._pending.get(short_id, 0) + count
+            if event is not None:
+                if len(self._events) == self._events.maxlen:
+                    self.dropped_events += 1
+                self._events.append(event)
+
+    def pending(self, short_id):
+        with self._lock:
+            return self._pending.get(short_id, 0)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            events, self._events = self._events, deque(maxlen=MAX_BUFFERED_CLICK_EVENTS)
+        if not pending and not events:
+            return 0
+        pipe = redis.pipeline(transaction=False)
+        for short_id, count in pending.items():
+            pipe.incrby('click-count:' + short_id, count)
+        for event in events:
+            pipe.xadd(CLICK_STREAM, event, maxlen=CLICK_STREAM_MAXLEN, approximate=True)
+        try:
+            pipe.execute()
+        except Exception:
+            # put the clicks back so the next flush retries them
+            with self._lock:
+                for short_id, count in pending.items():
+                    self._pending[short_id] = self._pending.get(short_id, 0) + count
+                # failed events go before newer ones; extending a full deque drops the oldest
+                restored = deque(events, maxlen=MAX_BUFFERED_CLICK_EVENTS)
+                restored.extend(self._events)
+                self.dropped_events += len(events) + len(self._events) - len(restored)
+                self._events = restored
+            raise
+        return len(pending)
+
+
+link_cache = LinkCache(LINK_CACHE_SIZE, LINK_CACHE_TTL)
+clicks = ClickCounter()
+
+
+def invalidate_link(short_id):
+    # call after changing or deleting url-target:<short_id> so every worker drops its copy
+    link_cache.invalidate(short_id)
+    redis.publish(LINK_INVALIDATION_CHANNEL, short_id)
+
+
+def listen_for_invalidations():
+    # explicit invalidations plus keyspace notifications for url-target keys
+    # (the latter only arrive when the server has notify-keyspace-events enabled, e.g. "K$g";
+    # a bucket hash notification does not say which link changed, so the hash layout relies on invalidate_link)
+    keyspace_pattern = '__keyspace@%d__:url-target:*' % REDIS_DB
+    while True:
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(LINK_INVALIDATION_CHANNEL)
+            if STORAGE_LAYOUT == 'keys':
+                pubsub.psubscribe(keyspace_pattern)
+            # anything may have changed while we were not subscribed
+            link_cache.clear()
+            for message in pubsub.listen():
+                if message['type'] == 'message':
+                    link_cache.invalidate(message['data'])
+                elif message['type'] == 'pmessage':
+                    link_cache.invalidate(message['channel'].split('url-target:', 1)[1])
+        except Exception:
+            logging.exception('link invalidation listener failed, reconnecting')
+            time.sleep(1)
+        finally:
+            pubsub.close()
+
+
+def flush_clicks_forever():
+    while True:
+        time.sleep(CLICK_FLUSH_INTERVAL)
+        try:
+            clicks.flush()
+        except Exception:
+            logging.exception('click flush failed')
+
+
+def flush_clicks_at_exit():
+    try:
+        clicks.flush()
+    except Exception:
+        logging.exception('final click flush failed')
+
+
+_workers_lock = threading.Lock()
+_workers_pid = None
+
+@app.before_request
+def ensure_background_workers():
+    # started lazily (once per process) so forked server workers each get their own threads
+    global _workers_pid
+    if _workers_pid == os.getpid():
+        return
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+        link_cache.clear()
+        threading.Thread(target=listen_for_invalidations, name='link-invalidation', daemon=True).start()
+        threading.Thread(target=flush_clicks_forever, name='click-flusher', daemon=True).start()
+        atexit.register(flush_clicks_at_exit)
+        _workers_pid = os.getpid()
+
+# ids are leased from last-url-id in blocks so creating links is not one INCR per link;
+# unused parts of a block are returned to url-id-free-blocks on exit and handed out again
+ID_BLOCK_SIZE = int(os.environ.get('ID_BLOCK_SIZE', 1000))
+FREE_ID_BLOCKS_KEY = 'url-id-free-blocks'
+
+
+class IdAllocator(object):
+    # hands out ids from the block this process leased, leasing a new one when it runs out
+
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self._next = self._end = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def allocate(self, count=1):
+        with self._lock:
+            if self._pid != os.getpid():
+                # a forked child must not reuse the block its parent leased
+                self._next = self._end = 0
+                self._pid = os.getpid()
+                atexit.register(self.release)
+            ids = []
+            while len(ids) < count:
+                if self._next >= self._end:
+                    self._lease(count - len(ids))
+                take = min(self._end - self._next, count - len(ids))
+                ids.extend(range(self._next, self._next + take))
+                self._next += take
+            return ids
+
+    def _lease(self, wanted):
+        block = redis.lpop(FREE_ID_BLOCKS_KEY)
+        if block is not None:
+            start, end = (int(part) for part in block.split(':'))
+        else:
+            size = max(self.block_size, wanted)
+            last = redis.incrby('last-url-id', size)
+            start, end = last - size + 1, last + 1
+        self._next, self._end = start, end
+
+    def release(self):
+        # give the unused rest of the block back so a restarted worker does not skip it
+        with self._lock:
+            if self._pid != os.getpid() or self._next >= self._end:
+                return
+            try:
+                redis.rpush(FREE_ID_BLOCKS_KEY, '%d:%d' % (self._next, self._end))
+            except Exception:
+                logging.exception('could not return id block %d:%d', self._next, self._end)
+            self._next = self._end
+
+
+id_allocator = IdAllocator(ID_BLOCK_SIZE)
+
+# most urls a single bulk request may contain
+BULK_MAX_URLS = int(os.environ.get('BULK_MAX_URLS', 10000))
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+def normalize_url(url):
+    # lower-case scheme and host and drop the default port, so the same link dedupes to one short id;
+    # returns None for anything that is not an absolute http(s) url
+    url = url.strip()
+    parts = urlparse(url)
+    if parts.scheme.lower() not in ('http', 'https') or not parts.hostname:
+        return None
+    scheme = parts.scheme.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        return None
+    netloc = parts.hostname
+    if ':' in netloc:
+        netloc = '[' + netloc + ']'
+    if port is not None and port != DEFAULT_PORTS[scheme]:
+        netloc += ':%d' % port
+    userinfo = parts.netloc.rpartition('@')[0]
+    if userinfo:
+        netloc = userinfo + '@' + netloc
+    return parts._replace(scheme=scheme, netloc=netloc).geturl()
+
+def target_location(short_id):
+    # (hash key, field) holding the target of short_id in the hash layout
+    number = b62_decode(short_id)
+    return 'url:%d' % (number // HASH_BUCKET_SIZE), str(number % HASH_BUCKET_SIZE)
+
+def reverse_location(url):
+    # (hash key, field) of the reverse index entry for url in the hash layout:
+    # the first 4 digest bytes pick the bucket, the next 6 are the field
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return 'rev:%d' % (int(digest[:8], 16) % REVERSE_BUCKET_COUNT), digest[8:20]
+
+def get_target(short_id):
+    if STORAGE_LAYOUT != 'hash':
+        return redis.get('url-target:' + short_id)
+    try:
+        key, field = target_location(short_id)
+    except ValueError:
+        return None
+    return redis.hget(key, field)
+
+def lookup_short_ids(urls):
+    # existing short id (or None) for each url
+    if not urls:
+        return []
+    if STORAGE_LAYOUT != 'hash':
+        return redis.mget(['reverse-url:' + url for url in urls])
+    pipe = redis.pipeline(transaction=False)
+    for url in urls:
+        pipe.hget(*reverse_location(url))
+    candidates = pipe.execute()
+    # a truncated digest can collide, so confirm each candidate points back at the same url
+    found = [(url, short_id) for url, short_id in zip(urls, candidates) if short_id is not None]
+    for url, short_id in found:
+        pipe.hget(*target_location(short_id))
+    confirmed = {url: short_id for (url, short_id), target in zip(found, pipe.execute()) if target == url}
+    return [confirmed.get(url) for url in urls]
+
+def store_mappings(mappings):
+    # mappings is a list of (short_id, url); both directions are written in one round trip
+    if not mappings:
+        return
+    if STORAGE_LAYOUT != 'hash':
+        keys = {}
+        for short_id, url in mappings:
+            keys['url-target:' + short_id] = url
+            keys['reverse-url:' + url] = short_id
+        redis.mset(keys)
+        return
+    buckets = {}
+    for short_id, url in mappings:
+        key, field = target_location(short_id)
+        buckets.setdefault(key, {})[field] = url
+        key, field = reverse_location(url)
+        buckets.setdefault(key, {})[field] = short_id
+    pipe = redis.pipeline(transaction=False)
+    for key, fields in buckets.items():
+        pipe.hset(key, mapping=fields)
+    pipe.execute()
+
+def shorten_many(urls):
+    # returns one dict per input url: url, short_id and status (created, existing or invalid)
+    results = []
+    for url in urls:
+        normalized = normalize_url(url)
+        if normalized is None:
+            results.append({'url': url, 'short_id': None, 'status': 'invalid'})
+        else:
+            results.append({'url': normalized, 'short_id': None, 'status': None})
+
+    unique_urls = list(OrderedDict.fromkeys(r['url'] for r in results if r['status'] is None))
+    short_ids = dict(zip(unique_urls, lookup_short_ids(unique_urls)))
+    # urls shortened before normalization are indexed under the url exactly as submitted
+    raw_urls = OrderedDict()
+    for url, result in zip(urls, results):
+        if result['status'] is None and short_ids[result['url']] is None and url != result['url']:
+            raw_urls.setdefault(url, result['url'])
+    for (url, normalized), short_id in zip(raw_urls.items(), lookup_short_ids(list(raw_urls))):
+        if short_id is not None and short_ids[normalized] is None:
+            short_ids[normalized] = short_id
+    misses =[url for url in unique_urls if short_ids[url] is None]
+    created = set(misses)
+    new_mappings = [(b62_encode(number), url) for url, number in zip(misses, id_allocator.allocate(len(misses)))]
+    store_mappings(new_mappings)
+    for short_id, url in new_mappings:
+        short_ids[url] = short_id
+
+    for result in results:
+        if result['status'] is None:
+            result['short_id'] = short_ids[result['url']]
+            # repeats of a url created in this batch report existing, like a second request would
+            result['status'] = 'created' if result['url'] in created else 'existing'
+            created.discard(result['url'])
+    return results
 
 def shorten(url):
-        short_id = redis.get('reverse-url:' + url)
-        if short_id is not None:
-            return short_id
-        url_num = redis.incr('last-url-id')
-        short_id = b62_encode(url_num)
-        redis.set('url-target:' + short_id, url)
-        redis.set('reverse-url:' + url, short_id)
-        return short_id
+        return shorten_many([url])[0]['short_id']
+
+B62_ALPHABET = string.digits + string.ascii_lowercase + string.ascii_uppercase
+B62_VALUES = {char: value for value, char in enumerate(B62_ALPHABET)}
+# every two-digit combination, so encoding takes one table lookup per 62**2
+B62_PAIRS = [high + low for high in B62_ALPHABET for low in B62_ALPHABET]
 
 def b62_encode(number):
-    base = string.digits + string.lowercase + string.uppercase
-    assert number >= 0, 'positive integer required'
-    if number == 0:
-        return '0'
-    base62 = []
-    while number != 0:
-        number, i = divmod(number, 62)
-        base62.append(base[i])
-    return ''.join(reversed(base62))
+    if number < 0:
+        raise ValueError('positive integer required')
+    if number < 62:
+        return B62_ALPHABET[number]
+    pairs = []
+    while number:
+        number, i = divmod(number, 3844)
+        pairs.append(B62_PAIRS[i])
+    return ''.join(reversed(pairs)).lstrip('0')
+
+def b62_decode(short_id):
+    number = 0
+    try:
+        for char in short_id:
+            number = number * 62 + B62_VALUES[char]
+    except KeyError:
+        raise ValueError('invalid base62 string: %r' % short_id)
+    return number
 
 @app.route('/')
 def home():
@@ -40,32 +417,125 @@ def home():
 @app.route('/shorten', methods=['POST'])
 def return_shortened():
     url_to_parse = request.form['input-url']
-    parts = urlparse.urlparse(url_to_parse)
-    if not parts.scheme in ('http', 'https'):
+    if normalize_url(url_to_parse) is None:
         error = "Please enter valid url"
-    else:
-        # with a valid url, shorten it using encode to 62
-        short_id = shorten(url_to_parse)
+        return render_template('index.html', error=error)
+    # with a valid url, shorten it using encode to 62
+    short_id = shorten(url_to_parse)
     return render_template('result.html', short_id=short_id)
 
+def read_bulk_urls():
+    # JSON [...] or {"urls": [...]}, an uploaded "file", or a plain-text body; one url per line or first CSV column
+    # returns None for a JSON body in neither form
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get('urls')
+    if isinstance(payload, list):
+        return [str(url) for url in payload]
+    if request.mimetype == 'application/json':
+        return None
+    upload = request.files.get('file')
+    text = upload.read().decode('utf-8-sig') if upload else request.get_data(as_text=True)
+    return [row[0] for row in csv.reader(io.StringIO(text)) if row and row[0].strip()]
+
+@app.route('/shorten/bulk', methods=['POST'])
+def bulk_shorten():
+    urls = read_bulk_urls()
+    if urls is None:
+        return jsonify(error='expected a JSON list of urls or {"urls": [...]}'), 400
+    if len(urls) > BULK_MAX_URLS:
+        return jsonify(error='at most %d urls per request' % BULK_MAX_URLS), 413
+    results = shorten_many(urls)
+    for result in results:
+        result['short_url'] = request.host_url + result['short_id'] if result['short_id'] else None
+    if request.args.get('format') == 'csv' or request.accept_mimetypes.best == 'text/csv':
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=['url', 'short_id', 'short_url', 'status'])
+        writer.writeheader()
+        writer.writerows(results)
+        return Response(output.getvalue(), mimetype='text/csv')
+    return jsonify(results=results)
+
+def click_event(short_id):
+    # what the analytics consumer needs from a redirect; the visitor is a hash so no ip is stored
+    user_agent = request.headers.get('User-Agent', '')
+    visitor = hashlib.sha1(('%s|%s' % (request.remote_addr, user_agent)).encode('utf-8')).hexdigest()[:16]
+    return {
+        'id': short_id,
+        'ts': '%d' % (time.time() * 1000),
+        'visitor': visitor,
+        'referrer': request.referrer or '',
+        'agent': user_agent[:256],
+    }
+
+def click_bucket_key(short_id, granularity, when):
+    # (key, field) of the counter for the minute, hour or day containing when (UTC)
+    key_format, field_format = CLICK_BUCKETS[granularity][:2]
+    return 'clicks:%s:%s:%s' % (short_id, granularity, when.strftime(key_format)), when.strftime(field_format)
+
+def link_analytics(short_id, now=None):
+    # last 60 minutes, 24 hours and 30 days of clicks, unique visitors and top referrers/agents in one round trip
+    now = now or datetime.utcnow()
+    series = [
+        ('minute', [now - timedelta(minutes=i) for i in range(59, -1, -1)]),
+        ('hour', [now - timedelta(hours=i) for i in range(23, -1, -1)]),
+        ('day', [now - timedelta(days=i) for i in range(29, -1, -1)]),
+    ]
+    bucket_keys = OrderedDict()
+    for granularity, moments in series:
+        for moment in moments:
+            bucket_keys[click_bucket_key(short_id, granularity, moment)[0]] = None
+    pipe = redis.pipeline(transaction=False)
+    for key in bucket_keys:
+        pipe.hgetall(key)
+    pipe.pfcount('uniques:%s:day:%s' % (short_id, now.strftime('%Y%m%d')))
+    pipe.pfcount('uniques:' + short_id)
+    pipe.zrevrange('referrers:' + short_id, 0, 9, withscores=True)
+    pipe.zrevrange('agents:' + short_id, 0, 9, withscores=True)
+    replies = pipe.execute()
+    buckets = dict(zip(bucket_keys, replies[:len(bucket_keys)]))
+    uniques_today, uniques_total, referrers, agents = replies[len(bucket_keys):]
+
+    analytics = {}
+    for granularity, moments in series:
+        points = []
+        for moment in moments:
+            key, field = click_bucket_key(short_id, granularity, moment)
+            points.append((field, int(buckets[key].get(field, 0))))
+        analytics[granularity] = points
+    analytics.update(
+        uniques_today=uniques_today,
+        uniques_total=uniques_total,
+        referrers=[(name, int(score)) for name, score in referrers],
+        agents=[(name, int(score)) for name, score in agents],
+    )
+    return analytics
+
 @app.route("/<short_id>")
 def expand_to_long_url(short_id):
-    link_target = redis.get('url-target:' + short_id)
+    # hot links are served from the in-process cache and counted locally,
+    # so a cached redirect makes no synchronous Redis call
+    link_target = link_cache.get(short_id)
     if link_target is None:
-        raise NotFound()
-    redis.incr('click-count:' + short_id)
+        link_target = get_target(short_id)
+        if link_target is None:
+            raise NotFound()
+        link_cache.set(short_id, link_target)
+    clicks.add(short_id, event=click_event(short_id))
     return redirect(link_target)
 
 @app.route("/<short_id>+")
 def shorten_details(short_id):
-    link_target = redis.get('url-target:' + short_id)
+    link_target = get_target(short_id)
     if link_target is None:
         raise NotFound()
-    click_count = int(redis.get('click-count:' + short_id) or 0)
+    # include clicks that this worker has not flushed yet
+    click_count = int(redis.get('click-count:' + short_id) or 0) + clicks.pending(short_id)
     return render_template('details.html', 
                         short_id=short_id, 
                         click_count=click_count,
-                        link_target=link_target)
+                        link_target=link_target,
+                        analytics=link_analytics(short_id))
 
 if __name__ == '__main__':
-    app.run()
\ No newline at end of file
+    app.run()
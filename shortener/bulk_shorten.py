@@ -0,0 +1,65 @@
+# shorten a list of urls from files or stdin without going through the web form
+#   python bulk_shorten.py urls.txt > links.csv
+#   cat urls.csv | python bulk_shorten.py --base-url https://sho.rt/ --format json
+import argparse
+import csv
+import json
+import sys
+
+from app import id_allocator, shorten_many
+
+
+def read_urls(paths):
+    # one url per line, or the first column of a CSV file
+    for path in paths or ['-']:
+        handle = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        try:
+            for row in csv.reader(handle):
+                if row and row[0].strip():
+                    yield row[0]
+        finally:
+            if handle is not sys.stdin:
+                handle.close()
+
+
+def batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shorten many urls at once')
+    parser.add_argument('paths', nargs='*', help='files with one url per line (default: stdin)')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000/', help='prefix for the short_url column')
+    parser.add_argument('--batch-size', type=int, default=5000, help='urls per MGET/MSET round')
+    parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+    args = parser.parse_args()
+
+    results = []
+    counts = {}
+    for batch in batches(read_urls(args.paths), args.batch_size):
+        for result in shorten_many(batch):
+            result['short_url'] = args.base_url + result['short_id'] if result['short_id'] else None
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+            results.append(result)
+    # hand the unused part of the leased id block back right away
+    id_allocator.release()
+
+    if args.format == 'json':
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        writer = csv.DictWriter(sys.stdout, fieldnames=['url', 'short_id', 'short_url', 'status'])
+        writer.writeheader()
+        writer.writerows(results)
+    sys.stderr.write(', '.join('%s: %d' % item for item in sorted(counts.items())) + '\n')
+
+
+if __name__ == '__main__':
+    main()
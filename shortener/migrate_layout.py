@@ -0,0 +1,124 @@
+# move links between the "keys" and "hash" storage layouts and compare their memory use
+#   python migrate_layout.py report                 # bytes per link for the layout(s) present
+#   python migrate_layout.py migrate                # copy url-target:/reverse-url: keys into the hash layout
+#   python migrate_layout.py migrate --delete-old   # ...and remove the old keys once copied
+# run migrate before starting the app with STORAGE_LAYOUT=hash; it is safe to run again
+import argparse
+import sys
+
+import app
+from app import HASH_BUCKET_SIZE, redis, target_location
+
+
+def scan_targets(batch_size):
+    # yields lists of (short_id, url) from the keys layout
+    cursor = 0
+    while True:
+        cursor, keys = redis.scan(cursor, match='url-target:*', count=batch_size)
+        if keys:
+            urls = redis.mget(keys)
+            yield [(key.split(':', 1)[1], url) for key, url in zip(keys, urls) if url is not None]
+        if cursor == 0:
+            return
+
+
+def migrate(batch_size, delete_old):
+    app.STORAGE_LAYOUT = 'hash'
+    moved = skipped = 0
+    for batch in scan_targets(batch_size):
+        mappings = []
+        for short_id, url in batch:
+            try:
+                target_location(short_id)
+            except ValueError:
+                skipped += 1
+                continue
+            mappings.append((short_id, url))
+        app.store_mappings(mappings)
+        if delete_old and mappings:
+            pipe = redis.pipeline(transaction=False)
+            for short_id, url in mappings:
+                pipe.delete('url-target:' + short_id, 'reverse-url:' + url)
+            pipe.execute()
+        moved += len(mappings)
+        sys.stderr.write('moved %d links\n' % moved)
+    return moved, skipped
+
+
+def memory_usage(keys):
+    pipe = redis.pipeline(transaction=False)
+    for key in keys:
+        pipe.execute_command('MEMORY USAGE', key)
+    return sum(size or 0 for size in pipe.execute())
+
+
+def report(sample_size):
+    lines = []
+    # keys layout: two top-level keys per link
+    sample = []
+    for batch in scan_targets(1000):
+        sample.extend(batch)
+        if len(sample) >= sample_size:
+            break
+    sample = sample[:sample_size]
+    if sample:
+        keys = []
+        for short_id, url in sample:
+            keys.extend(['url-target:' + short_id, 'reverse-url:' + url])
+        lines.append('keys layout: %.1f bytes per link (sampled %d links)' % (memory_usage(keys) / len(sample), len(sample)))
+
+    # hash layout: bucket hashes shared by many links
+    buckets = []
+    for pattern in ('url:*', 'rev:*'):
+        cursor = 0
+        found = []
+        while True:
+            cursor, keys = redis.scan(cursor, match=pattern, count=1000)
+            found.extend(keys)
+            if cursor == 0 or len(found) >= sample_size:
+                break
+        buckets.append(found[:sample_size])
+    target_buckets, reverse_buckets = buckets
+    if target_buckets:
+        pipe = redis.pipeline(transaction=False)
+        for key in target_buckets + reverse_buckets:
+            pipe.hlen(key)
+            pipe.object('encoding', key)
+        replies = pipe.execute()
+        lengths, encodings = replies[0::2], replies[1::2]
+        target_links = sum(lengths[:len(target_buckets)])
+        reverse_links = sum(lengths[len(target_buckets):])
+        per_link = memory_usage(target_buckets) / target_links
+        if reverse_links:
+            per_link += memory_usage(reverse_buckets) / reverse_links
+        lines.append('hash layout: %.1f bytes per link (sampled %d target and %d reverse buckets)' % (
+            per_link, len(target_buckets), len(reverse_buckets)))
+        counts = {}
+        for encoding in encodings:
+            counts[encoding] = counts.get(encoding, 0) + 1
+        lines.append('bucket encodings: ' + ', '.join('%s=%d' % item for item in sorted(counts.items())))
+        if any(encoding == 'hashtable' for encoding in encodings):
+            lines.append('some buckets are hashtables: raise hash-max-listpack-value (longest url) and '
+                         'hash-max-listpack-entries (>= %d)' % HASH_BUCKET_SIZE)
+    if not lines:
+        lines.append('no links found')
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shortener storage layout migration and memory report')
+    parser.add_argument('command', choices=['migrate', 'report'])
+    parser.add_argument('--batch-size', type=int, default=1000, help='keys per SCAN/MGET round')
+    parser.add_argument('--delete-old', action='store_true', help='delete url-target:/reverse-url: keys after copying')
+    parser.add_argument('--sample', type=int, default=1000, help='links or buckets sampled by report')
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        moved, skipped = migrate(args.batch_size, args.delete_old)
+        print('moved %d links, skipped %d with ids that are not base62' % (moved, skipped))
+    else:
+        print('\n'.join(report(args.sample)))
+
+
+if __name__ == '__main__':
+    main()
@@ -22,7 +22,7 @@ class url_shortener:
         return short_id
 
     def b62_encode(number):
-        base = string.digits + string.lowercase + string.uppercase
+        base = string.digits + string.ascii_lowercase + string.ascii_uppercase
         assert number >= 0, 'positive integer required'
         if number == 0:
             return '0'
@@ -0,0 +1,361 @@
+# Benchmark ของ time_attendant ที่รันแอปภายใน process (แทนสคริปต์ Locust เดิม)
+#
+# สร้างผู้ใช้จำลอง ส่ง check_in และ check_out ตามเส้นโค้งการมาถึงช่วงเช้าและเย็น
+# (ช่วง peak คร่อมเวลาเริ่มและเลิกกะ จึงมีทั้งปกติ สาย และออกก่อน)
+# แล้วบันทึก p50/p95/p99, throughput และจำนวนตามสถานะเป็น JSON เพื่อใช้เทียบกับ baseline
+#
+# ต้องใช้ PostgreSQL (แอปใช้ INSERT ... ON CONFLICT, partition และ FILTER ของ PostgreSQL)
+# และใช้ fakeredis หรือ redis-server ในเครื่อง ทั้งสองอย่างควรเป็นฐานข้อมูลสำหรับทดสอบเท่านั้น
+# เพราะ benchmark จะล้างตาราง attendance และ Redis database ที่ระบุ
+#
+# ตัวอย่าง:
+#   python benchmark.py --database-url postgresql+asyncpg://postgres@localhost/bench --users 2000 --output run.json
+#   python benchmark.py --database-url ... --baseline baseline.json
+#   python benchmark.py --database-url ... --redis-url redis://localhost:6379/15 --save-baseline baseline.json
+#
+# ตัวแปรสภาพแวดล้อมของแอป (เช่น ATTENDANCE_WRITE_BEHIND=1) ส่งต่อให้แอปตามปกติ
+# ต้องติดตั้ง httpx และ fakeredis จาก requirements-dev.txt (pip install -r requirements-dev.txt)
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import importlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional
+
+import pytz
+
+LOCAL_TIMEZONE = pytz.timezone("Asia/Bangkok")
+
+# ช่วงเวลาของแต่ละช่วง peak ตามเวลาท้องถิ่น: (เริ่ม, สิ้นสุด, จุดสูงสุด) เป็นนาทีนับจากเที่ยงคืน
+PEAKS = {
+    "check_in": (7 * 60 + 30, 9 * 60 + 30, 8 * 60 + 20),
+    "check_out": (16 * 60 + 15, 18 * 60 + 30, 16 * 60 + 45),
+}
+
+
+def generate_users(count: int, departments: int, seed: int) -> List[dict]:
+    """
+    สร้างผู้ใช้จำลองพร้อมรหัสผ่านและ hash แบบ SHA-256 (รูปแบบเดียวกับ verify_password_sha256)
+
+    Args:
+        count (int): จำนวนผู้ใช้
+        departments (int): จำนวนฝ่าย
+        seed (int): seed ของตัวสุ่ม
+
+    Returns:
+        List[dict]: ผู้ใช้ในรูปแบบ {"username", "password", "hashed_password", "department"}
+    """
+    rng = random.Random(seed)
+    users = []
+    for i in range(count):
+        password = f"pw-{rng.getrandbits(48):012x}"
+        users.append({
+            "username": f"bench{i:06d}",
+            "password": password,
+            "hashed_password": hashlib.sha256(password.encode()).hexdigest(),
+            "department": f"dept{i % departments:02d}"
+        })
+    return users
+
+
+def write_users_csv(path: str, users: List[dict]):
+    """เขียนผู้ใช้จำลองเป็น CSV รูปแบบเดียวกับไฟล์ที่แอป preload ลง Redis"""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Username", "Hashed_Password", "Department"])
+        for user in users:
+            writer.writerow([user["username"], user["hashed_password"], user["department"]])
+
+
+def arrival_schedule(count: int, duration: float, peak: str, spread: float, rng: random.Random) -> List[float]:
+    """
+    สร้างเวลาที่ request มาถึง (วินาทีนับจากเริ่ม) ตามการแจกแจงปกติที่ตัดขอบ รอบจุดสูงสุดของช่วง peak
+
+    ช่วงเวลาจริงของ peak (เช่น 07:30 - 09:30) ถูกย่อให้อยู่ใน duration วินาที
+
+    Args:
+        count (int): จำนวน request
+        duration (float): ระยะเวลาที่ใช้ replay (วินาที)
+        peak (str): ชื่อช่วง peak ใน PEAKS
+        spread (float): ส่วนเบี่ยงเบนมาตรฐานเป็นสัดส่วนของความยาวช่วง
+        rng (random.Random): ตัวสุ่ม
+
+    Returns:
+        List[float]: เวลาที่มาถึงที่เรียงแล้ว
+    """
+    start, end, top = PEAKS[peak]
+    center = (top - start) / (end - start)
+    offsets = []
+    while len(offsets) < count:
+        value = rng.gauss(center, spread)
+        if 0.0 <= value <= 1.0:
+            offsets.append(value * duration)
+    return sorted(offsets)
+
+
+def simulated_timestamp(work_date: date, peak: str, offset: float, duration: float) -> str:
+    """แปลงเวลาที่มาถึงเป็นเวลาลงเวลาจำลองในช่วง peak (ส่งเป็น UTC ตามที่ API คาดหวัง)"""
+    start, end, _ = PEAKS[peak]
+    minutes = start + (end - start) * offset / duration
+    local_time = LOCAL_TIMEZONE.localize(datetime.combine(work_date, datetime.min.time()) + timedelta(minutes=minutes))
+    return local_time.astimezone(timezone.utc).isoformat()
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """คืนค่า percentile แบบ nearest-rank จาก list ที่เรียงแล้ว"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], errors: int, wall_seconds: float, statuses: Optional[dict] = None) -> dict:
+    """สรุปผลของหนึ่งช่วง peak เป็นมิลลิวินาทีและ request ต่อวินาที พร้อมจำนวนตามสถานะการลงเวลาที่แอปตอบกลับ"""
+    values = sorted(latency * 1000 for latency in latencies)
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "p50_ms": percentile(values, 50),
+        "p95_ms": percentile(values, 95),
+        "p99_ms": percentile(values, 99),
+        "max_ms": values[-1] if values else None,
+        "mean_ms": sum(values) / len(values) if values else None,
+        "throughput_rps": len(latencies) / wall_seconds if wall_seconds else None,
+        "statuses": statuses or {},
+    }
+
+
+async def replay(client, path: str, payloads: List[dict], arrivals: List[float], max_concurrency: int) -> dict:
+    """
+    ส่ง request แบบ open-loop ตามเวลาที่มาถึง (ไม่รอ request ก่อนหน้า) จำกัดจำนวนที่ทำงานพร้อมกัน
+
+    Args:
+        client (httpx.AsyncClient): client ที่ผูกกับแอปผ่าน ASGITransport
+        path (str): endpoint
+        payloads (List[dict]): body ของแต่ละ request
+        arrivals (List[float]): เวลาที่มาถึงของแต่ละ request (วินาทีนับจากเริ่ม)
+        max_concurrency (int): จำนวน request พร้อมกันสูงสุด
+
+    Returns:
+        dict: ผลสรุปจาก summarize
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    latencies = []
+    errors = 0
+    # จำนวนตามสถานะ (ปกติ/สาย/ออกก่อน) ใช้ยืนยันว่าโหลดจำลองผ่านทุกเส้นทางการคำนวณสถานะ
+    statuses = {}
+    started = time.perf_counter()
+
+    async def send(payload: dict, arrival: float):
+        nonlocal errors
+        delay = arrival - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with semaphore:
+            sent = time.perf_counter()
+            try:
+                response = await client.post(path, json=payload)
+                ok = response.status_code == 200
+            except Exception:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - sent)
+                status = response.json().get("attendance_status", "other")
+                statuses[status] = statuses.get(status, 0) + 1
+            else:
+                errors += 1
+
+    await asyncio.gather(*(send(payload, arrival) for payload, arrival in zip(payloads, arrivals)))
+    return summarize(latencies, errors, time.perf_counter() - started, statuses)
+
+
+async def prepare_database(app_module, users: List[dict]):
+    """สร้างตาราง ล้างข้อมูลการลงเวลาเดิม และเพิ่มผู้ใช้จำลองลงตาราง users"""
+    from sqlalchemy import text
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+    await app_module.ensure_schema()
+    async with app_module.engine.begin() as conn:
+        await conn.execute(text(
+            "TRUNCATE attendance, attendance_daily_summary, attendance_monthly_summary RESTART IDENTITY"
+        ))
+        for i in range(0, len(users), 5000):
+            chunk = users[i:i + 5000]
+            await conn.execute(
+                pg_insert(app_module.User.__table__)
+                .values([
+                    {"username": u["username"], "hashed_password": u["hashed_password"], "department": u["department"]}
+                    for u in chunk
+                ])
+                .on_conflict_do_nothing(index_elements=["username"])
+            )
+
+
+async def wait_until_ready(client, timeout: float = 120.0):
+    """รอจนกว่า /ready ตอบ 200 (การเตรียมระบบของแอปเสร็จ) เพื่อไม่ให้เวลา warm-up ปนกับผลวัด"""
+    deadline = time.perf_counter() + timeout
+    while True:
+        response = await client.get("/ready")
+        if response.status_code == 200:
+            return
+        if response.json().get("detail", {}).get("status") == "failed" or time.perf_counter() > deadline:
+            raise RuntimeError(f"App did not become ready: {response.text}")
+        await asyncio.sleep(0.05)
+
+
+async def run_benchmark(args) -> dict:
+    """เตรียมสภาพแวดล้อม รันแอปภายใน process และ replay ทั้งช่วงเช้าและเย็น"""
+    import httpx
+    import redis.asyncio as aioredis
+
+    rng = random.Random(args.seed)
+    users = generate_users(args.users, args.departments, args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = os.path.join(workdir, "users.csv")
+        write_users_csv(csv_path, users)
+        # ต้องกำหนดก่อน import แอป เพราะแอปอ่านค่าเหล่านี้ตอน import
+        os.environ["USERS_CSV_PATH"] = csv_path
+        os.environ["DATABASE_URL"] = args.database_url
+        app_module = importlib.import_module("main")
+
+        if args.redis_url:
+            redis_pool = aioredis.BlockingConnectionPool.from_url(args.redis_url, max_connections=app_module.REDIS_MAX_CONNECTIONS)
+            redis_backend = "redis-server"
+        else:
+            import fakeredis
+
+            redis_pool = fakeredis.aioredis.FakeRedis().connection_pool
+            redis_backend = "fakeredis"
+        # เปลี่ยน pool ของ client เดิม เพื่อให้ Lua script ที่ลงทะเบียนไว้ใช้ Redis ชุดเดียวกัน
+        app_module.redis_pool = redis_pool
+        app_module.redis_client.connection_pool = redis_pool
+        await app_module.redis_client.flushdb()
+
+        await prepare_database(app_module, users)
+
+        work_date = app_module.local_work_date(datetime.now(timezone.utc).replace(tzinfo=None))
+        results = {}
+        async with app_module.lifespan(app_module.app):
+            transport = httpx.ASGITransport(app=app_module.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+                await wait_until_ready(client)
+                for peak, path, field in (("check_in", "/check_in/", "check_in"), ("check_out", "/check_out/", "check_out")):
+                    if peak == "check_out" and args.skip_check_out:
+                        continue
+                    arrivals = arrival_schedule(len(users), args.duration, peak, args.spread, rng)
+                    order = users[:]
+                    rng.shuffle(order)
+                    payloads = [
+                        {
+                            "username": user["username"],
+                            "password": user["password"],
+                            field: simulated_timestamp(work_date, peak, arrival, args.duration)
+                        }
+                        for user, arrival in zip(order, arrivals)
+                    ]
+                    if app_module.WRITE_BEHIND_ENABLED and peak == "check_out":
+                        await app_module.flush_attendance_queue()
+                    results[peak] = await replay(client, path, payloads, arrivals, args.concurrency)
+                    print(f"{peak}: {json.dumps(results[peak], ensure_ascii=False)}")
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "users": args.users,
+            "departments": args.departments,
+            "duration": args.duration,
+            "spread": args.spread,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "write_behind": os.getenv("ATTENDANCE_WRITE_BEHIND", "0") == "1",
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "redis": redis_backend,
+        },
+        "results": results,
+    }
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    เทียบผลกับ baseline และคืนรายการที่ถดถอยเกิน tolerance
+
+    ถือว่าถดถอยเมื่อ p95 หรือ p99 สูงขึ้น หรือ throughput ลดลง เกินสัดส่วน tolerance หรือมี error เพิ่มขึ้น
+    """
+    regressions = []
+    for peak, current in results["results"].items():
+        previous = baseline.get("results", {}).get(peak)
+        if not previous:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if previous.get(key) and current.get(key) and current[key] > previous[key] * (1 + tolerance):
+                regressions.append(f"{peak} {key}: {previous[key]:.2f} -> {current[key]:.2f}")
+        if previous.get("throughput_rps") and current.get("throughput_rps") \
+                and current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{peak} throughput_rps: {previous['throughput_rps']:.1f} -> {current['throughput_rps']:.1f}"
+            )
+        if current["errors"] > previous.get("errors", 0):
+            regressions.append(f"{peak} errors: {previous.get('errors', 0)} -> {current['errors']}")
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="In-process benchmark for the time_attendant API")
+    parser.add_argument("--database-url", default=os.getenv("BENCHMARK_DATABASE_URL"),
+                        help="scratch PostgreSQL database (postgresql+asyncpg://...), attendance tables are truncated")
+    parser.add_argument("--redis-url", default=os.getenv("BENCHMARK_REDIS_URL"),
+                        help="scratch redis-server database (flushed); fakeredis is used when omitted")
+    parser.add_argument("--users", type=int, default=1000, help="number of synthetic users")
+    parser.add_argument("--departments", type=int, default=10, help="number of synthetic departments")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to replay each peak in")
+    parser.add_argument("--spread", type=float, default=0.15, help="peak standard deviation as a fraction of the window")
+    parser.add_argument("--concurrency", type=int, default=100, help="maximum requests in flight")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--skip-check-out", action="store_true", help="replay the morning check-in peak only")
+    parser.add_argument("--output", help="write the results JSON to this path")
+    parser.add_argument("--baseline", help="compare against this results JSON and exit 1 on regression")
+    parser.add_argument("--save-baseline", help="write the results JSON as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("--database-url (or BENCHMARK_DATABASE_URL) is required")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    results = asyncio.run(run_benchmark(args))
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,28 +1,136 @@
 from dotenv import load_dotenv
-from datetime import datetime, timezone, timedelta
+import asyncio
+import csv
+from datetime import date, datetime, timezone, timedelta
 from enum import Enum
+import base64
 import hashlib
+import hmac
 import json
 import logging
-import redis
-from typing import Optional
-import pandas as pd
-from fastapi import FastAPI, Depends, HTTPException
+import redis.asyncio as aioredis
+from redis.asyncio.client import Pipeline
+from contextlib import asynccontextmanager
+from collections import OrderedDict
+from itertools import islice
+from typing import Dict, Iterable, List, Literal, NamedTuple, Optional
+from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, DateTime, ForeignKey, String, exists
+from sqlalchemy import (
+    Boolean, Column, Integer, Date, DateTime, ForeignKey, Index, Numeric, String, Time,
+    and_, case, cast, column, exists, func, literal, text, update, values
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DataError, IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.future import select
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import aliased, sessionmaker, relationship
 from sqlalchemy.orm import declarative_base
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
 import pytz
+import secrets
+import time
+from metrics import REGISTRY, phase, record_phase, server_timing_header, start_request_timing
+from shift_schedule import (
+    SECONDS_PER_DAY, STATUS_EARLY_LEAVE, STATUS_LATE, STATUS_NORMAL, STATUS_WINDOW_SECONDS, ShiftSchedule
+)
+
+try:
+    import orjson  # ตัวเลือก: serializer ที่เร็วกว่าโมดูล json มาตรฐานหลายเท่า
+except ImportError:
+    orjson = None
 
 # โหลดค่าตัวแปรจากไฟล์ .env
 load_dotenv()
 
-# Initialize Redis connection
-redis_client = redis.Redis(host='localhost', port=6379, db=1)
+def dumps_json(value) -> bytes:
+    """แปลงค่าเป็น JSON แบบกะทัดรัด (UTF-8 bytes) ด้วย orjson หากติดตั้งไว้"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+def loads_json(raw):
+    """แปลง JSON (bytes หรือ str) เป็นค่า Python ด้วย orjson หากติดตั้งไว้"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse ที่ serialize ด้วย dumps_json (orjson หากติดตั้งไว้)"""
+
+    def render(self, content) -> bytes:
+        return dumps_json(content)
+
+# Metrics สำหรับ /metrics (รูปแบบข้อความของ Prometheus)
+# TIMING_HEADER=1 เพิ่ม header Server-Timing แยกเวลาที่ใช้กับ Redis, ฐานข้อมูล และการ hash ต่อ request (สำหรับรันในเครื่อง)
+TIMING_HEADER_ENABLED = os.getenv("TIMING_HEADER", "0") == "1"
+
+http_request_duration = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ["method", "route", "status"]
+)
+http_requests_in_flight = REGISTRY.gauge("http_requests_in_flight", "HTTP requests currently being served.")
+cache_requests = REGISTRY.counter(
+    "cache_requests_total", "Cache lookups by cache layer, key family and result.", ["layer", "keyspace", "result"]
+)
+redis_command_duration = REGISTRY.histogram(
+    "redis_command_duration_seconds", "Redis round-trip time by command (PIPELINE for a whole pipeline).", ["command"]
+)
+db_pool_checkout_duration = REGISTRY.histogram(
+    "db_pool_checkout_seconds", "Time spent waiting for a database connection from the pool."
+)
+db_query_duration = REGISTRY.histogram("db_query_duration_seconds", "Database statement execution time.")
+
+def record_cache_lookup(layer: str, keyspace: str, hit: bool, count: int = 1):
+    """นับผลการค้นหาใน cache (layer: local หรือ redis, keyspace: user หรือ attendance)"""
+    if count:
+        cache_requests.inc(layer, keyspace, "hit" if hit else "miss", amount=count)
+
+# Redis client ที่จับเวลาทุกคำสั่งและทุก pipeline
+class InstrumentedPipeline(Pipeline):
+    """Pipeline ที่จับเวลาการส่งคำสั่งทั้งชุด"""
+
+    async def execute(self, raise_on_error: bool = True):
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            elapsed = time.perf_counter() - started
+            redis_command_duration.observe(elapsed, "PIPELINE")
+            record_phase("redis", elapsed)
+
+class InstrumentedRedis(aioredis.Redis):
+    """Redis client ที่บันทึกเวลาของแต่ละคำสั่งลง metrics และ Server-Timing"""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            elapsed = time.perf_counter() - started
+            redis_command_duration.observe(elapsed, str(args[0]).upper())
+            record_phase("redis", elapsed)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+# Initialize Redis connection (asyncio client พร้อม connection pool ของตัวเอง เพื่อไม่ให้ block event loop)
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_DB = int(os.getenv("REDIS_DB", "1"))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "200"))
+
+redis_pool = aioredis.BlockingConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    max_connections=REDIS_MAX_CONNECTIONS,  # จำนวน connection สูงสุดต่อ worker
+    timeout=5  # ระยะเวลารอ connection ว่างใน pool (วินาที)
+)
+redis_client = InstrumentedRedis(connection_pool=redis_pool)
 
 # ดึงค่าจากไฟล์ .env
 DATABASE_USER = os.getenv("DATABASE_USER")
@@ -30,25 +138,130 @@ DATABASE_PASSWORD = os.getenv("DATABASE_PASSWORD")
 DATABASE_HOST = os.getenv("DATABASE_HOST")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
 
-# กำหนดค่าฐานข้อมูล
-DATABASE_URL = f"postgresql+asyncpg://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}/{DATABASE_NAME}"
+# กำหนดค่าฐานข้อมูล (DATABASE_URL ใช้แทนค่าทั้งชุดได้ เช่น ฐานข้อมูลสำหรับ benchmark)
+DATABASE_URL = os.getenv("DATABASE_URL") or f"postgresql+asyncpg://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}/{DATABASE_NAME}"
 
 Base = declarative_base()
+
+# Connection pool ที่จับเวลาการรอ connection
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool ที่บันทึกเวลารอ checkout connection ลง metrics"""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            elapsed = time.perf_counter() - started
+            db_pool_checkout_duration.observe(elapsed)
+            record_phase("db_pool", elapsed)
+
+def instrument_engine(async_engine):
+    """ติดตั้ง event listener สำหรับจับเวลาการรันคำสั่ง SQL ของ engine"""
+    @event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        db_query_duration.observe(elapsed)
+        record_phase("db", elapsed)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "120"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
 engine = create_async_engine(
     DATABASE_URL, 
     echo=False, 
-    pool_size=120,  # เพิ่มจำนวน connection pool 
-    max_overflow=20,  # อนุญาตให้เพิ่ม connection ได้อีก 10 ครั้งเมื่อ pool เต็ม
-    pool_timeout=120  # ระยะเวลารอ connection ใหม่ (วินาที)
+    poolclass=InstrumentedQueuePool,
+    pool_size=DB_POOL_SIZE,  # เพิ่มจำนวน connection pool 
+    max_overflow=DB_MAX_OVERFLOW,  # อนุญาตให้เพิ่ม connection ได้อีกเมื่อ pool เต็ม
+    # ระยะเวลารอ connection ใหม่ (วินาที) ปกติ admission controller จะปฏิเสธ request ก่อนถึงเวลานี้
+    pool_timeout=DB_POOL_TIMEOUT
 )
+instrument_engine(engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AsyncSession)
 
 # ปิดการแสดงผล logging ระดับ INFO และ DEBUG สำหรับ SQLAlchemy
 logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
 
+# สถานะการเตรียมระบบตอนเริ่มทำงาน (starting -> ready หรือ failed) สำหรับ /ready
+startup_state = {"status": "starting", "detail": None, "users_preloaded": None, "warm_up_seconds": None}
+startup_complete = asyncio.Event()
+
+async def warm_up():
+    """
+    เตรียมระบบใน background: ปรับ schema และ preload ผู้ใช้ลง Redis แล้วเปลี่ยนสถานะเป็นพร้อมให้บริการ
+
+    การ preload ที่ล้มเหลวไม่ทำให้ระบบไม่พร้อม เพราะการตรวจสอบผู้ใช้ยังค้นจากฐานข้อมูลได้
+    """
+    started = time.perf_counter()
+    try:
+        await ensure_schema()
+    except Exception as exc:
+        logging.error("Schema setup failed: %s", exc)
+        startup_state.update(status="failed", detail=f"schema setup failed: {exc}")
+        return
+    if USERS_CSV_PATH:
+        try:
+            startup_state["users_preloaded"] = await preload_users_to_redis()
+        except FileNotFoundError:
+            logging.warning("User CSV %s not found, skipping the Redis preload.", USERS_CSV_PATH)
+            startup_state["detail"] = "user CSV not found, preload skipped"
+        except Exception as exc:
+            logging.error("User preload failed: %s", exc)
+            startup_state["detail"] = f"user preload failed: {exc}"
+    startup_state.update(status="ready", warm_up_seconds=round(time.perf_counter() - started, 3))
+    startup_complete.set()
+    logging.info("Warm-up finished in %.2fs", startup_state["warm_up_seconds"])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """จัดการช่วงชีวิตของแอป: เริ่มเตรียมระบบใน background ตอนเริ่ม และปิด connection pool ตอนหยุดทำงาน"""
+    # เริ่มรับ request (เช่น /health) ได้ทันที ส่วน /ready จะตอบ 200 เมื่อเตรียมระบบเสร็จ
+    warm_up_task = asyncio.create_task(warm_up())
+    flusher = asyncio.create_task(run_write_behind_flusher()) if WRITE_BEHIND_ENABLED else None
+    invalidation_listener = asyncio.create_task(run_user_cache_invalidation_listener())
+    partition_maintenance = asyncio.create_task(run_partition_maintenance())
+    summary_refresher = asyncio.create_task(run_summary_refresher())
+    event_reader = asyncio.create_task(attendance_events.run())
+    yield
+    background_tasks = (warm_up_task, invalidation_listener, partition_maintenance, summary_refresher, event_reader)
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    if flusher:
+        flusher.cancel()
+        await asyncio.gather(flusher, return_exceptions=True)
+        await flush_attendance_queue()  # เขียนรายการที่ค้างอยู่ก่อนปิดระบบ
+    await redis_pool.disconnect()
+    await engine.dispose()
+
 # สร้างแอป FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """บันทึก latency และจำนวน request ที่กำลังทำงาน และเพิ่ม header Server-Timing เมื่อเปิด TIMING_HEADER"""
+    phases = start_request_timing()
+    http_requests_in_flight.inc()
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        http_requests_in_flight.dec()
+        # ใช้ path template ของ route (เช่น /reports/employee/{username}) เพื่อไม่ให้จำนวน label เพิ่มตาม username
+        route = request.scope.get("route")
+        http_request_duration.observe(elapsed, request.method, route.path if route else "unmatched", status_code)
+    if TIMING_HEADER_ENABLED:
+        response.headers["Server-Timing"] = server_timing_header(phases, elapsed)
+    return response
 
 class AttendanceStatus(Enum):
     """คลาส Enum สำหรับสถานะการลงเวลา"""
@@ -63,6 +276,7 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, index=True)  # เพิ่ม index ตรงนี้
     hashed_password = Column(String)
+    department = Column(String, nullable=True, index=True)  # ฝ่ายหรือสาขา ใช้นับยอดคนเข้างานแยกกลุ่ม
 
     # ความสัมพันธ์กับ Attendance
     attendances = relationship("Attendance", back_populates="user")
@@ -80,11 +294,13 @@ class UserRequest(BaseModel):
     password: str
 
 class Attendance(Base):
-    """โมเดล Attendance สำหรับเก็บเวลาการเข้า-ออกงาน"""
+    """โมเดล Attendance สำหรับเก็บเวลาการเข้า-ออกงาน (แบ่ง partition รายเดือนตาม work_date)"""
     __tablename__ = "attendance"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     username = Column(String, ForeignKey("users.username"), nullable=False)
+    # วันทำงานตามเวลาท้องถิ่น (ใช้กันการลงเวลาเข้าซ้ำในวันเดียวกัน และเป็น partition key จึงต้องอยู่ใน primary key)
+    work_date = Column(Date, primary_key=True, nullable=False)
     check_in = Column(DateTime, nullable=True)
     check_out = Column(DateTime, nullable=True)
     status = Column(String, default=AttendanceStatus.NORMAL.value)
@@ -92,34 +308,350 @@ class Attendance(Base):
     # ความสัมพันธ์กับ User
     user = relationship("User", back_populates="attendances")
 
+    __table_args__ = (
+        # หนึ่งผู้ใช้ลงเวลาเข้างานได้หนึ่งครั้งต่อวัน
+        Index("uq_attendance_username_work_date", "username", "work_date", unique=True),
+        # ใช้หาแถวการลงเวลาล่าสุดของผู้ใช้ตอน check_out โดยไม่ต้อง sort ทั้งตาราง
+        Index("ix_attendance_username_id_desc", username, id.desc()),
+        # BRIN index สำหรับการค้นหาช่วงเวลา check_in (เล็กมากเพราะข้อมูลถูกเพิ่มตามลำดับเวลา)
+        Index("ix_attendance_check_in_brin", check_in, postgresql_using="brin"),
+        {"postgresql_partition_by": "RANGE (work_date)"},
+    )
+
+# ตารางสรุปรายวันต่อฝ่าย (ปรับปรุงแบบ incremental จากวันที่มีการเปลี่ยนแปลง)
+class AttendanceDailySummary(Base):
+    """โมเดลสรุปจำนวนการลงเวลาแยกตามสถานะ ต่อวันทำงานและฝ่าย"""
+    __tablename__ = "attendance_daily_summary"
+
+    work_date = Column(Date, primary_key=True)
+    department = Column(String, primary_key=True, default="")  # "" = ไม่ระบุฝ่าย
+    normal = Column(Integer, nullable=False, default=0)
+    late = Column(Integer, nullable=False, default=0)
+    early_leave = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=False, default=0)
+
+# ตารางสรุปรายเดือนต่อพนักงาน
+class AttendanceMonthlySummary(Base):
+    """โมเดลสรุปจำนวนการลงเวลาแยกตามสถานะ ต่อเดือนและพนักงาน"""
+    __tablename__ = "attendance_monthly_summary"
+
+    month = Column(Date, primary_key=True)  # วันแรกของเดือน
+    username = Column(String, primary_key=True)
+    department = Column(String, nullable=True)
+    normal = Column(Integer, nullable=False, default=0)
+    late = Column(Integer, nullable=False, default=0)
+    early_leave = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=False, default=0)
+
+# คำสั่งปรับโครงสร้างตารางเดิมให้รองรับ work_date (รันซ้ำได้โดยไม่เกิดผลข้างเคียง)
+SCHEMA_MIGRATIONS = [
+    "ALTER TABLE attendance ADD COLUMN IF NOT EXISTS work_date DATE",
+    "UPDATE attendance SET work_date = (check_in AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Bangkok')::date "
+    "WHERE work_date IS NULL AND check_in IS NOT NULL",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_attendance_username_work_date ON attendance (username, work_date)",
+    "CREATE INDEX IF NOT EXISTS ix_attendance_username_id_desc ON attendance (username, id DESC)",
+    "CREATE INDEX IF NOT EXISTS ix_attendance_check_in_brin ON attendance USING brin (check_in)",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS department VARCHAR",
+    "CREATE INDEX IF NOT EXISTS ix_users_department ON users (department)",
+]
+
+# การจัดการ partition รายเดือนของตาราง attendance
+ATTENDANCE_PARTITION_MONTHS_AHEAD = int(os.getenv("ATTENDANCE_PARTITION_MONTHS_AHEAD", "2"))  # สร้าง partition ล่วงหน้ากี่เดือน
+ATTENDANCE_RETENTION_MONTHS = int(os.getenv("ATTENDANCE_RETENTION_MONTHS", "0"))  # 0 = ไม่ย้าย partition เก่าออก
+ATTENDANCE_ARCHIVE_SCHEMA = os.getenv("ATTENDANCE_ARCHIVE_SCHEMA", "attendance_archive")
+ATTENDANCE_MIGRATE_PARTITIONS = os.getenv("ATTENDANCE_MIGRATE_PARTITIONS", "0") == "1"
+PARTITION_MAINTENANCE_INTERVAL = int(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "21600"))  # วินาที
+# check_out ค้นหาการลงเวลาเข้าย้อนหลังได้ไม่เกินกี่วัน (จำกัดให้ query แตะเฉพาะ partition ล่าสุด)
+CHECK_OUT_LOOKBACK_DAYS = int(os.getenv("CHECK_OUT_LOOKBACK_DAYS", "1"))
+
+def month_start(value: date, months: int = 0) -> date:
+    """คืนค่าวันแรกของเดือนที่ห่างจากเดือนของ value ไป months เดือน"""
+    month_index = value.year * 12 + value.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+def attendance_partition_name(month: date) -> str:
+    """คืนค่าชื่อ partition ของเดือน เช่น attendance_y2024m09"""
+    return f"attendance_y{month.year:04d}m{month.month:02d}"
+
+async def is_attendance_partitioned(conn) -> bool:
+    """ตรวจสอบว่าตาราง attendance เป็นตารางแบบ partitioned แล้วหรือไม่"""
+    result = await conn.execute(text("SELECT relkind::text FROM pg_class WHERE oid = to_regclass('attendance')"))
+    return result.scalar() == "p"
+
+async def ensure_attendance_partitions(conn, start: date, end: date) -> List[str]:
+    """
+    สร้าง partition รายเดือนที่ยังไม่มี ให้ครอบคลุมช่วงวันที่ start ถึง end
+
+    Args:
+        conn: การเชื่อมต่อฐานข้อมูลที่อยู่ใน transaction
+        start (date): วันแรกที่ต้องรองรับ
+        end (date): วันสุดท้ายที่ต้องรองรับ
+
+    Returns:
+        List[str]: ชื่อ partition ที่ครอบคลุมช่วงวันที่
+    """
+    names = []
+    month = month_start(start)
+    while month <= end:
+        next_month = month_start(month, 1)
+        name = attendance_partition_name(month)
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF attendance "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+        ))
+        names.append(name)
+        month = next_month
+    return names
+
+async def archive_old_attendance_partitions(conn, before: date) -> List[str]:
+    """
+    ถอด (DETACH) partition ที่เก่ากว่าเดือนที่กำหนดออกจากตาราง attendance แล้วย้ายไปไว้ใน schema สำหรับเก็บถาวร
+
+    ข้อมูลยังอยู่ครบและ query ได้จาก schema archive แต่ query ปกติจะไม่ต้องแตะ partition เหล่านี้อีก
+
+    Args:
+        conn: การเชื่อมต่อฐานข้อมูลที่อยู่ใน transaction
+        before (date): ถอดทุก partition ที่เดือนอยู่ก่อนวันนี้
+
+    Returns:
+        List[str]: ชื่อ partition ที่ถูกย้าย
+    """
+    result = await conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass('attendance') AND child.relkind = 'r'"
+    ))
+    cutoff = attendance_partition_name(month_start(before))
+    archived = []
+    # ชื่อ partition เรียงตามเดือนได้ด้วยการเปรียบเทียบข้อความ (attendance_yYYYYmMM)
+    for name in sorted(row[0] for row in result if row[0] < cutoff):
+        await conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ATTENDANCE_ARCHIVE_SCHEMA}"))
+        await conn.execute(text(f"ALTER TABLE attendance DETACH PARTITION {name}"))
+        await conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {ATTENDANCE_ARCHIVE_SCHEMA}"))
+        archived.append(name)
+    if archived:
+        logging.info("Archived attendance partitions: %s", ", ".join(archived))
+    return archived
+
+async def migrate_attendance_to_partitioned(conn):
+    """
+    ย้ายตาราง attendance เดิม (ไม่แบ่ง partition) ไปเป็นตารางแบบ partitioned รายเดือน
+
+    ตารางเดิมถูกเปลี่ยนชื่อเป็น attendance_legacy และเก็บไว้ให้ผู้ดูแลลบเองหลังตรวจสอบ
+    แถวที่ไม่มี work_date (ไม่มี check_in) จะไม่ถูกย้าย
+    """
+    await conn.execute(text("ALTER TABLE attendance RENAME TO attendance_legacy"))
+    await conn.execute(text("ALTER TABLE attendance_legacy RENAME CONSTRAINT attendance_pkey TO attendance_legacy_pkey"))
+    # ชื่อ index เป็นของทั้ง schema จึงต้องลบ index เดิมก่อนสร้างตารางใหม่
+    for index in Attendance.__table__.indexes:
+        await conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    await conn.run_sync(Attendance.__table__.create)
+
+    result = await conn.execute(text("SELECT min(work_date), max(work_date) FROM attendance_legacy"))
+    first_date, last_date = result.one()
+    if first_date is not None:
+        await ensure_attendance_partitions(conn, first_date, last_date)
+    await conn.execute(text(
+        "INSERT INTO attendance (id, username, work_date, check_in, check_out, status) "
+        "SELECT id, username, work_date, check_in, check_out, status FROM attendance_legacy "
+        "WHERE work_date IS NOT NULL"
+    ))
+    await conn.execute(text(
+        "SELECT setval(pg_get_serial_sequence('attendance', 'id'), "
+        "(SELECT coalesce(max(id), 0) + 1 FROM attendance_legacy), false)"
+    ))
+    logging.info("Migrated attendance to a partitioned table, the old table is kept as attendance_legacy")
+
+# เดือนที่ทราบแล้วว่ามี partition (cache ภายใน process) เพื่อไม่ต้องสั่ง DDL ทุกครั้งที่เพิ่มแถว
+attendance_partition_months = set()
+
+async def ensure_partitions_for(work_dates: Iterable[date]):
+    """
+    สร้าง partition ของเดือนที่ยังไม่มีสำหรับวันทำงานที่กำหนด ก่อน INSERT ลงตาราง attendance
+
+    partition ล่วงหน้ามีเฉพาะเดือนปัจจุบันถึง ATTENDANCE_PARTITION_MONTHS_AHEAD เดือนข้างหน้า
+    การลงเวลาย้อนหลัง (เช่น check_in ที่ระบุเวลาเอง หรือ batch ที่ส่งเหตุการณ์ค้างของเดือนก่อน)
+    จึงต้องสร้าง partition ของเดือนนั้นก่อน โดยตรวจกับ cache ภายใน process ก่อนจึงแทบไม่มีค่าใช้จ่าย
+    """
+    months = {month_start(work_date) for work_date in work_dates} - attendance_partition_months
+    if not months:
+        return
+    try:
+        async with engine.begin() as conn:
+            if await is_attendance_partitioned(conn):
+                for month in sorted(months):
+                    await ensure_attendance_partitions(conn, month, month)
+    except Exception as exc:
+        # เช่น worker อื่นสร้าง partition เดียวกันพร้อมกัน: ปล่อยให้ INSERT ตัดสินและลองใหม่ครั้งหน้า
+        logging.warning("Could not create attendance partitions for %s: %s", sorted(months), exc)
+        return
+    attendance_partition_months.update(months)
+
+async def maintain_attendance_partitions():
+    """สร้าง partition ล่วงหน้า และย้าย partition ที่เกินระยะเวลาเก็บออก (หากตั้งค่าไว้)"""
+    today = local_work_date(datetime.now(timezone.utc).replace(tzinfo=None))
+    async with engine.begin() as conn:
+        if not await is_attendance_partitioned(conn):
+            return
+        await ensure_attendance_partitions(conn, today, month_start(today, ATTENDANCE_PARTITION_MONTHS_AHEAD))
+        month = month_start(today)
+        while month <= month_start(today, ATTENDANCE_PARTITION_MONTHS_AHEAD):
+            attendance_partition_months.add(month)
+            month = month_start(month, 1)
+        if ATTENDANCE_RETENTION_MONTHS > 0:
+            await archive_old_attendance_partitions(conn, month_start(today, -ATTENDANCE_RETENTION_MONTHS))
+
+async def run_partition_maintenance():
+    """Background task ที่ดูแล partition ของตาราง attendance เป็นระยะ"""
+    while True:
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+        try:
+            await maintain_attendance_partitions()
+        except Exception as exc:
+            logging.error("Attendance partition maintenance failed: %s", exc)
+
+async def ensure_schema():
+    """
+    สร้างตารางที่ยังไม่มี ปรับตาราง attendance เดิมให้มีคอลัมน์ work_date พร้อม index และสร้าง partition ล่วงหน้า
+
+    หากตารางเดิมมีการลงเวลาเข้าซ้ำในวันเดียวกันอยู่แล้ว การสร้าง unique index จะล้มเหลว
+    และต้องล้างข้อมูลซ้ำก่อนเริ่มระบบ ตาราง attendance เดิมที่ยังไม่แบ่ง partition
+    จะถูกย้ายเมื่อกำหนด ATTENDANCE_MIGRATE_PARTITIONS=1 เท่านั้น
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        for statement in SCHEMA_MIGRATIONS:
+            await conn.execute(text(statement))
+        if not await is_attendance_partitioned(conn):
+            if ATTENDANCE_MIGRATE_PARTITIONS:
+                await migrate_attendance_to_partitioned(conn)
+            else:
+                logging.warning("Table attendance is not partitioned, set ATTENDANCE_MIGRATE_PARTITIONS=1 to migrate it.")
+    await maintain_attendance_partitions()
+
 # โมเดลสำหรับ request body
 class AttendanceRequest(BaseModel):
-    """โมเดลสำหรับ request body สำหรับการลงเวลา"""
+    """โมเดลสำหรับ request body สำหรับการลงเวลา (ใช้ password หรือ token จาก /login อย่างใดอย่างหนึ่ง)"""
     username: str
-    password: str
+    password: Optional[str] = None
+    token: Optional[str] = None
     check_in: Optional[datetime] = None
     check_out: Optional[datetime] = None
 
-# โหลดข้อมูลจาก CSV
-users_data = pd.read_csv("/Users/seal/Downloads/Unique_Usernames_and_Hashed_Passwords.csv", dtype=str)
+# ไฟล์ CSV ของผู้ใช้ที่ preload ลง Redis ตอนเริ่มระบบ (ค่าว่าง = ไม่ preload)
+USERS_CSV_PATH = os.getenv("USERS_CSV_PATH", "")
+
+# ค่าตั้งต้นสำหรับการ preload ผู้ใช้แบบ bulk
+PRELOAD_CHUNK_SIZE = int(os.getenv("PRELOAD_CHUNK_SIZE", "2000"))  # จำนวนผู้ใช้ต่อหนึ่ง MSET
+PRELOAD_INCREMENTAL = os.getenv("PRELOAD_INCREMENTAL", "0") == "1"  # เขียนเฉพาะผู้ใช้ที่ข้อมูลเปลี่ยน
+PRELOAD_DIGEST_KEY = "user:preload:digest"  # Redis hash เก็บ digest ของ payload ที่ preload ล่าสุด
+
+def payload_digest(payload: bytes) -> str:
+    """คืนค่า digest แบบสั้นของ payload สำหรับตรวจว่าข้อมูลผู้ใช้เปลี่ยนหรือไม่"""
+    return hashlib.blake2b(payload, digest_size=8).hexdigest()
 
-def preload_users_to_redis():
+def read_user_chunk(reader, chunk_size: int) -> List[dict]:
+    """อ่านแถวผู้ใช้ถัดไปจาก csv.DictReader ไม่เกิน chunk_size แถว"""
+    return list(islice(reader, chunk_size))
+
+async def preload_users_to_redis(
+    path: str = USERS_CSV_PATH,
+    chunk_size: int = PRELOAD_CHUNK_SIZE,
+    incremental: bool = PRELOAD_INCREMENTAL
+) -> int:
     """
-    ฟังก์ชันสำหรับ preload ข้อมูล Username และ Hashed_Password จาก CSV ลงใน Redis
+    ฟังก์ชันสำหรับ preload ข้อมูล Username และ Hashed_Password จาก CSV ลงใน Redis แบบ bulk
+
+    อ่านไฟล์แบบ stream ด้วยโมดูล csv ทีละ chunk (การอ่านไฟล์ทำใน thread เพื่อไม่ให้ block event loop)
+    แล้วเขียนด้วย MSET ผ่าน pipeline แทนการเรียก SET ทีละผู้ใช้ ในโหมด incremental จะเทียบ digest
+    กับรอบก่อนหน้า และเขียนเฉพาะผู้ใช้ที่ข้อมูลเปลี่ยนไป
+
+    Args:
+        path (str): ไฟล์ CSV ที่มีคอลัมน์ Username, Hashed_Password และ Department (ไม่บังคับ)
+        chunk_size (int): จำนวนผู้ใช้ต่อหนึ่ง chunk
+        incremental (bool): True หากต้องการเขียนเฉพาะผู้ใช้ที่ hash เปลี่ยนตั้งแต่การ preload ครั้งก่อน
+
+    Returns:
+        int: จำนวนผู้ใช้ที่ถูกเขียนลง Redis
     """
-    for index, row in users_data.iterrows():
-        username = row['Username']
-        hashed_password = row['Hashed_Password']
-        
-        # สร้างข้อมูลในรูปแบบ dictionary
-        user_data = {
-            "username": username,
-            "hashed_password": hashed_password
-        }
-        
-        # แปลงเป็น JSON string และเก็บลง Redis โดยใช้ username เป็น key
-        redis_client.set(f"user:{username}", json.dumps(user_data))
-        
+    # คอลัมน์ Department เป็นตัวเลือก ใช้สำหรับนับยอดคนเข้างานแยกฝ่าย
+    source_columns = {'Username': 'username', 'Hashed_Password': 'hashed_password', 'Department': 'department'}
+    processed = 0
+    written = 0
+    started = time.perf_counter()
+
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        present_columns = [name for name in source_columns if name in (reader.fieldnames or [])]
+        while True:
+            rows = await asyncio.to_thread(read_user_chunk, reader, chunk_size)
+            if not rows:
+                break
+            records = [
+                {source_columns[name]: row[name] or None for name in present_columns}
+                for row in rows
+            ]
+            written += await write_user_chunk(records, incremental)
+            processed += len(records)
+            elapsed = time.perf_counter() - started
+            logging.info(
+                "Preload progress: %d users processed, %d written (%.0f users/s)",
+                processed, written, processed / elapsed if elapsed else 0.0
+            )
+
+    elapsed = time.perf_counter() - started
+    logging.info(
+        "Preloaded %d of %d users to Redis in %.2fs (%.0f users/s)",
+        written, processed, elapsed, processed / elapsed if elapsed else 0.0
+    )
+    return written
+
+async def write_user_chunk(records: List[dict], incremental: bool) -> int:
+    """
+    เขียนผู้ใช้หนึ่ง chunk ลง Redis ด้วย pipeline เดียว (MSET ข้อมูลผู้ใช้, HSET digest และฝ่าย)
+
+    Args:
+        records (List[dict]): ผู้ใช้ในรูปแบบ {"username", "hashed_password", "department"}
+        incremental (bool): True หากต้องการเขียนเฉพาะผู้ใช้ที่ digest เปลี่ยน
+
+    Returns:
+        int: จำนวนผู้ใช้ที่ถูกเขียน
+    """
+    chunk_usernames = [record['username'] for record in records]
+    chunk_departments = [record.get('department') for record in records]
+    # รูปแบบเดียวกับ cache_user (id ยังไม่ทราบจนกว่าจะค้นจากฐานข้อมูล)
+    chunk_payloads = [
+        encode_cached_user(CachedUser(None, record['username'], record.get('hashed_password'), record.get('department')))
+        for record in records
+    ]
+    digests = [payload_digest(payload) for payload in chunk_payloads]
+
+    if incremental:
+        # ดึง digest เดิมของทั้ง chunk ในคำสั่งเดียว แล้วเก็บเฉพาะรายการที่เปลี่ยน
+        previous = await redis_client.hmget(PRELOAD_DIGEST_KEY, chunk_usernames)
+        changed = [
+            i for i, (digest, old) in enumerate(zip(digests, previous))
+            if old is None or old.decode() != digest
+        ]
+        chunk_usernames = [chunk_usernames[i] for i in changed]
+        chunk_payloads = [chunk_payloads[i] for i in changed]
+        chunk_departments = [chunk_departments[i] for i in changed]
+        digests = [digests[i] for i in changed]
+
+    if not chunk_usernames:
+        return 0
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.mset({f"user:{username}": payload for username, payload in zip(chunk_usernames, chunk_payloads)})
+    pipe.hset(PRELOAD_DIGEST_KEY, mapping=dict(zip(chunk_usernames, digests)))
+    department_mapping = {
+        username: department
+        for username, department in zip(chunk_usernames, chunk_departments)
+        if department
+    }
+    if department_mapping:
+        pipe.hset(USER_DEPARTMENTS_KEY, mapping=department_mapping)
+    await pipe.execute()
+    return len(chunk_usernames)
 
 # Dependency สำหรับสร้าง session
 async def get_db():
@@ -131,6 +663,105 @@ async def get_db():
             await session.close()  # ปิด session หลังจากใช้งานเสร็จ
 
 
+# การจำกัดจำนวน request ที่ใช้ฐานข้อมูลพร้อมกัน (admission control)
+ADMISSION_LIMIT = int(os.getenv("ADMISSION_LIMIT", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+ADMISSION_QUEUE_BUDGET_MS = float(os.getenv("ADMISSION_QUEUE_BUDGET_MS", "2000"))  # เวลารอคิวสูงสุดก่อนตอบ 503
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))  # ค่า header Retry-After (วินาที)
+
+admission_wait_duration = REGISTRY.histogram(
+    "admission_wait_seconds", "Time requests spent queued for a database admission slot."
+)
+admission_rejections = REGISTRY.counter("admission_rejected_total", "Requests shed with 503 by the admission controller.")
+
+class AdmissionController:
+    """
+    จำกัดจำนวน request ที่ใช้ฐานข้อมูลพร้อมกันไม่ให้เกินขนาด connection pool
+
+    request ที่รอคิวนานเกิน queue_budget จะถูกปฏิเสธทันทีด้วย 503 และ Retry-After
+    แทนการรอ connection จน pool_timeout แล้วล้มเหลวพร้อมกันทั้งหมด
+
+    Attributes:
+        limit (int): จำนวน request ที่ใช้ฐานข้อมูลพร้อมกันสูงสุด
+        queue_budget (float): เวลารอคิวสูงสุด (วินาที)
+        retry_after (int): ค่า header Retry-After (วินาที)
+    """
+    def __init__(self, limit: int, queue_budget: float, retry_after: int):
+        self.limit = limit
+        self.queue_budget = queue_budget
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(limit)
+        self.in_use = 0
+        self.waiting = 0
+
+    @property
+    def saturated(self) -> bool:
+        """True หากใช้ช่องครบแล้ว (request ใหม่ต้องรอคิว)"""
+        return self.in_use >= self.limit
+
+    async def acquire(self):
+        """
+        ขอช่องสำหรับใช้ฐานข้อมูล
+
+        Raises:
+            HTTPException: 503 พร้อม Retry-After หากรอคิวนานเกิน queue_budget
+        """
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            if self._semaphore.locked():
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_budget)
+            else:
+                await self._semaphore.acquire()
+        except asyncio.TimeoutError:
+            admission_rejections.inc()
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy, please retry later",
+                headers={"Retry-After": str(self.retry_after)}
+            )
+        finally:
+            self.waiting -= 1
+            admission_wait_duration.observe(time.perf_counter() - started)
+        self.in_use += 1
+
+    def release(self):
+        """คืนช่องที่ได้จาก acquire"""
+        self.in_use -= 1
+        self._semaphore.release()
+
+admission = AdmissionController(ADMISSION_LIMIT, ADMISSION_QUEUE_BUDGET_MS / 1000, ADMISSION_RETRY_AFTER)
+REGISTRY.gauge("admission_in_use", "Requests currently holding a database admission slot.", function=lambda: admission.in_use)
+REGISTRY.gauge("admission_waiting", "Requests queued for a database admission slot.", function=lambda: admission.waiting)
+
+class AdmissionTicket:
+    """ช่องของ admission controller ที่ handler ขอเมื่อจำเป็นต้องใช้ฐานข้อมูลเท่านั้น"""
+    def __init__(self, controller: AdmissionController):
+        self.controller = controller
+        self.acquired = False
+
+    async def acquire(self):
+        if not self.acquired:
+            await self.controller.acquire()
+            self.acquired = True
+
+async def admission_ticket():
+    """Dependency ที่คืนช่องของ admission controller ให้อัตโนมัติเมื่อ request จบ"""
+    ticket = AdmissionTicket(admission)
+    try:
+        yield ticket
+    finally:
+        if ticket.acquired:
+            admission.release()
+
+async def get_admitted_db():
+    """Dependency สำหรับสร้าง session หลังได้ช่องจาก admission controller"""
+    await admission.acquire()
+    try:
+        async with SessionLocal() as session:
+            yield session
+    finally:
+        admission.release()
+
 # ฟังก์ชันแปลงเวลา UTC เป็นเวลาท้องถิ่น
 def convert_utc_to_local(utc_dt):
     """ฟังก์ชันแปลงเวลา UTC เป็นเวลาท้องถิ่น"""
@@ -138,6 +769,175 @@ def convert_utc_to_local(utc_dt):
     local_dt = utc_dt.astimezone(local_tz)
     return local_dt
 
+# ฟังก์ชันแปลงเวลาที่ผู้ใช้ส่งมาเป็นเวลา UTC ที่ไม่มี timezone (รูปแบบที่ตาราง attendance เก็บ)
+def to_utc_naive(value: Optional[datetime]) -> datetime:
+    """
+    ฟังก์ชันแปลงเวลาเป็น UTC แบบ timezone-naive
+
+    เวลาที่ระบุ offset (เช่น +07:00) จะถูกแปลงเป็น UTC ก่อนตัด timezone ออก
+    เวลาที่ไม่มี timezone ถือเป็น UTC และหากไม่ระบุเวลาจะใช้เวลาปัจจุบัน
+    """
+    if value is None:
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+# ฟังก์ชันแปลงเวลา UTC ที่ไม่มี timezone (รูปแบบที่ตาราง attendance เก็บ) เป็นเวลาท้องถิ่น
+def utc_naive_to_local(utc_naive: datetime) -> datetime:
+    """ฟังก์ชันแปลงเวลา UTC ที่บันทึกแบบ timezone-naive เป็นเวลาท้องถิ่น"""
+    return convert_utc_to_local(utc_naive.replace(tzinfo=timezone.utc))
+
+# ฟังก์ชันหาวันทำงานตามเวลาท้องถิ่นจากเวลา UTC ที่ไม่มี timezone
+def local_work_date(utc_naive: datetime) -> date:
+    """ฟังก์ชันหาวันทำงาน (ตามเวลาท้องถิ่น) ของเวลา UTC ที่บันทึกแบบ timezone-naive"""
+    return utc_naive_to_local(utc_naive).date()
+
+# ฟังก์ชันหาวันทำงานของการเข้างานตามกะของพนักงาน
+def attendance_work_date(username: str, check_in_time: datetime) -> date:
+    """
+    ฟังก์ชันหาวันทำงานของเวลาเข้างาน (UTC แบบ timezone-naive) จากวันที่เริ่มกะของพนักงาน
+
+    กะข้ามคืนที่เข้างานสายหลังเที่ยงคืนยังนับเป็นวันทำงานของวันที่กะเริ่ม ไม่ใช่วันถัดไป
+    """
+    return shift_schedule.work_date(shift_schedule.shift_index(username), utc_naive_to_local(check_in_time))
+
+# ฟังก์ชันหาวันทำงานของการออกงานตามกะของพนักงาน
+def check_out_work_date(username: str, check_out_time: datetime) -> date:
+    """ฟังก์ชันหาวันทำงาน (วันที่เริ่มกะ) ของเวลาออกงาน (UTC แบบ timezone-naive)"""
+    return shift_schedule.check_out_work_date(shift_schedule.shift_index(username), utc_naive_to_local(check_out_time))
+
+# ฟังก์ชันหาเวลาหมดอายุของ key การลงเวลาของวันทำงาน
+def attendance_cache_expiry(work_date: date) -> int:
+    """
+    คืนค่า unix timestamp ที่ key การลงเวลาของวันทำงานหมดอายุ
+
+    กะข้ามคืนเลิกงานในวันถัดไป จึงเก็บ key ไว้ถึงเที่ยงคืนหลังวันถัดจากวันทำงาน
+    """
+    return local_day_end(work_date + timedelta(days=1))
+
+# ฟังก์ชันหาเวลาเที่ยงคืน (เวลาท้องถิ่น) ที่สิ้นสุดวันทำงาน
+def local_day_end(work_date: date) -> int:
+    """คืนค่า unix timestamp ของเที่ยงคืนตามเวลาท้องถิ่นหลังวันทำงาน ใช้เป็นเวลาหมดอายุของ key รายวัน"""
+    local_tz = pytz.timezone('Asia/Bangkok')
+    next_midnight = datetime.combine(work_date + timedelta(days=1), datetime.min.time())
+    return int(local_tz.localize(next_midnight).timestamp())
+
+def attendance_cache_key(kind: str, username: str, work_date: date) -> str:
+    """คืนค่า key ของ cache การลงเวลารายวัน (kind เป็น "checkin" หรือ "checkout")"""
+    return f"attendance:{kind}:{work_date.isoformat()}:{username}"
+
+def encode_attendance_cache(local_time: Optional[str], status: str) -> bytes:
+    """แปลงข้อมูลการลงเวลาที่แคชไว้เป็น JSON array [เวลาท้องถิ่น ISO, สถานะ]"""
+    return dumps_json([local_time, status])
+
+def decode_attendance_cache(raw: bytes) -> tuple:
+    """
+    แปลงค่า cache การลงเวลาเป็น (เวลาท้องถิ่น ISO, สถานะ)
+
+    รองรับทั้งรูปแบบ array ปัจจุบัน และรูปแบบ JSON object เดิม ({"check_in_time" หรือ "check_out_time", "status"})
+    """
+    value = loads_json(raw)
+    if isinstance(value, dict):
+        return value.get("check_in_time") or value.get("check_out_time"), value.get("status")
+    return value[0], value[1]
+
+# bitmap การเข้างานรายวัน: ผู้ใช้แต่ละคนได้ offset ที่คงที่ แล้ว SETBIT ลงใน key ของวันนั้น
+USER_OFFSETS_KEY = "user:offsets"  # Redis hash: username -> offset ใน bitmap
+USER_OFFSET_SEQ_KEY = "user:offset:seq"  # ตัวนับสำหรับแจก offset ใหม่
+USER_DEPARTMENTS_KEY = "user:departments"  # Redis hash: username -> ฝ่าย
+# เก็บ bitmap ต่อหลังสิ้นวันอีกช่วงหนึ่ง เพื่อให้ดูยอดของวันก่อนหน้าได้
+PRESENCE_RETENTION_SECONDS = int(os.getenv("PRESENCE_RETENTION_SECONDS", "86400"))
+
+# แจก offset (หากยังไม่มี) และตั้ง bit ใน bitmap ของวัน รวมถึง bitmap ของฝ่าย ในคำสั่งเดียว
+# คืนค่า offset ของผู้ใช้
+MARK_PRESENT_SCRIPT = """
+local offset = redis.call('HGET', KEYS[1], ARGV[1])
+if not offset then
+    offset = redis.call('INCR', KEYS[2]) - 1
+    redis.call('HSET', KEYS[1], ARGV[1], offset)
+end
+redis.call('SETBIT', KEYS[4], offset, 1)
+redis.call('EXPIREAT', KEYS[4], ARGV[2])
+local department = redis.call('HGET', KEYS[3], ARGV[1])
+if department then
+    local department_key = KEYS[4] .. ':dept:' .. department
+    redis.call('SETBIT', department_key, offset, 1)
+    redis.call('EXPIREAT', department_key, ARGV[2])
+end
+return tonumber(offset)
+"""
+mark_present_script = redis_client.register_script(MARK_PRESENT_SCRIPT)
+
+def presence_key(work_date: date, department: Optional[str] = None) -> str:
+    """คืนค่า key ของ bitmap การเข้างานของวัน (แยกฝ่ายหากระบุ)"""
+    key = f"attendance:present:{work_date.isoformat()}"
+    return f"{key}:dept:{department}" if department else key
+
+async def mark_present(pipe, username: str, work_date: date):
+    """บันทึกว่าผู้ใช้เข้างานในวันนั้น (หาก pipe เป็น pipeline จะเป็นการเพิ่มคำสั่งลงใน pipeline)"""
+    return await mark_present_script(
+        keys=[USER_OFFSETS_KEY, USER_OFFSET_SEQ_KEY, USER_DEPARTMENTS_KEY, presence_key(work_date)],
+        args=[username, local_day_end(work_date) + PRESENCE_RETENTION_SECONDS],
+        client=pipe
+    )
+
+# ชุดของวันทำงานที่มีการลงเวลาใหม่และต้องคำนวณตารางสรุปใหม่
+SUMMARY_DIRTY_KEY = "attendance:summary:dirty"
+
+def mark_summary_dirty(pipe, work_date: date):
+    """บันทึกวันทำงานที่ต้องปรับปรุงตารางสรุป (เพิ่มคำสั่ง SADD ลงใน pipeline)"""
+    pipe.sadd(SUMMARY_DIRTY_KEY, work_date.isoformat())
+
+# Redis stream ของเหตุการณ์ลงเวลาสำหรับหน้าจอติดตามแบบเรียลไทม์ (เก็บไว้ประมาณ MAXLEN รายการล่าสุด)
+ATTENDANCE_EVENTS_STREAM = "attendance:events"
+ATTENDANCE_EVENTS_MAXLEN = int(os.getenv("ATTENDANCE_EVENTS_MAXLEN", "100000"))
+
+# เพิ่มเหตุการณ์ลง stream พร้อมฝ่ายของผู้ใช้จาก hash user:departments ในคำสั่งเดียว
+PUBLISH_ATTENDANCE_EVENT_SCRIPT = """
+local department = redis.call('HGET', KEYS[2], ARGV[2]) or ''
+return redis.call(
+    'XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*',
+    'kind', ARGV[3], 'username', ARGV[2], 'department', department,
+    'work_date', ARGV[4], 'time', ARGV[5], 'status', ARGV[6]
+)
+"""
+publish_attendance_event_script = redis_client.register_script(PUBLISH_ATTENDANCE_EVENT_SCRIPT)
+
+async def publish_attendance_event(pipe, kind: str, username: str, work_date: date, local_time: str, status: str):
+    """
+    เพิ่มเหตุการณ์ check_in หรือ check_out ที่สำเร็จลง stream (หาก pipe เป็น pipeline จะเป็นการเพิ่มคำสั่งลงใน pipeline)
+
+    Args:
+        pipe: Redis client หรือ pipeline
+        kind (str): "checkin" หรือ "checkout"
+        username (str): ชื่อผู้ใช้
+        work_date (date): วันทำงาน
+        local_time (str): เวลาที่ลงเวลา (ISO ตามเวลาท้องถิ่น)
+        status (str): สถานะการลงเวลา
+    """
+    return await publish_attendance_event_script(
+        keys=[ATTENDANCE_EVENTS_STREAM, USER_DEPARTMENTS_KEY],
+        args=[ATTENDANCE_EVENTS_MAXLEN, username, kind, work_date.isoformat(), local_time, status],
+        client=pipe
+    )
+
+async def is_checked_in(username: str, work_date: date) -> bool:
+    """
+    ตรวจสอบจาก bitmap ว่าผู้ใช้ลงเวลาเข้างานในวันนั้นแล้วหรือไม่ (O(1) ไม่ต้องเรียกฐานข้อมูล)
+
+    Args:
+        username (str): ชื่อผู้ใช้
+        work_date (date): วันทำงาน
+
+    Returns:
+        bool: True หากลงเวลาเข้างานแล้ว
+    """
+    offset = await redis_client.hget(USER_OFFSETS_KEY, username)
+    if offset is None:
+        return False
+    return bool(await redis_client.getbit(presence_key(work_date), int(offset)))
+
 # ฟังก์ชันสำหรับแปลงรหัสผ่านเป็น SHA-256 hash
 def verify_password_sha256(plain_password: str, hashed_password: str) -> bool:
     """
@@ -150,61 +950,196 @@ def verify_password_sha256(plain_password: str, hashed_password: str) -> bool:
     Returns:
         bool: True หากรหัสผ่านที่แปลงแล้วตรงกับ hashed_password, False หากไม่ตรง
     """
-    hashed_input = hashlib.sha256(plain_password.encode()).hexdigest()
+    with phase("hash"):
+        hashed_input = hashlib.sha256(plain_password.encode()).hexdigest()
     return hashed_input == hashed_password
 
+# ข้อมูลผู้ใช้แบบกะทัดรัดที่เก็บใน cache ภายใน process (ไม่ต้องสร้าง ORM object)
+class CachedUser(NamedTuple):
+    """ข้อมูลผู้ใช้ที่จำเป็นสำหรับการตรวจสอบรหัสผ่าน"""
+    id: Optional[int]
+    username: str
+    hashed_password: str
+    department: Optional[str] = None
+
+def encode_cached_user(user: CachedUser) -> bytes:
+    """แปลง CachedUser เป็นค่าที่เก็บใน Redis: JSON array [id, username, hashed_password, department]"""
+    return dumps_json(list(user))
+
+def decode_cached_user(raw: bytes) -> Optional[CachedUser]:
+    """
+    แปลงข้อมูลผู้ใช้ที่เก็บใน Redis เป็น CachedUser
+
+    รองรับทั้งรูปแบบ array ปัจจุบัน และรูปแบบ JSON object เดิม (ค่าที่ยังไม่หมดอายุจากเวอร์ชันก่อน)
+
+    Args:
+        raw (bytes): ค่าจาก key user:{username}
+
+    Returns:
+        Optional[CachedUser]: ข้อมูลผู้ใช้, None หากข้อมูลเสียหาย
+    """
+    try:
+        user_data = loads_json(raw)
+        if isinstance(user_data, list):
+            return CachedUser(*user_data)
+        return CachedUser(
+            user_data.get("id"), user_data["username"], user_data["hashed_password"], user_data.get("department")
+        )
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+def cache_user(pipe, user: CachedUser):
+    """เพิ่มคำสั่งเก็บข้อมูลผู้ใช้ลง Redis (อายุ 5 นาที) และฝ่ายของผู้ใช้ลงใน pipeline"""
+    pipe.setex(f"user:{user.username}", 300, encode_cached_user(user))
+    if user.department:
+        pipe.hset(USER_DEPARTMENTS_KEY, user.username, user.department)
+
+class UserCache:
+    """
+    Cache ผู้ใช้ภายใน process แบบ LRU พร้อมอายุ (TTL) ซึ่งอยู่หน้า Redis อีกชั้นหนึ่ง
+
+    Attributes:
+        max_size (int): จำนวนผู้ใช้สูงสุดที่เก็บไว้
+        ttl (float): อายุของข้อมูลแต่ละรายการ (วินาที)
+    """
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, username: str) -> Optional[CachedUser]:
+        """คืนค่าผู้ใช้จาก cache หากยังไม่หมดอายุ, None หากไม่พบ"""
+        entry = self._entries.get(username)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            del self._entries[username]
+            return None
+        self._entries.move_to_end(username)
+        return user
+
+    def put(self, user: CachedUser):
+        """เก็บผู้ใช้ลง cache และลบรายการที่ใช้งานนานที่สุดออกเมื่อเกินขนาด"""
+        self._entries[user.username] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(user.username)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, username: str):
+        """ลบผู้ใช้ออกจาก cache"""
+        self._entries.pop(username, None)
+
+    def clear(self):
+        """ลบข้อมูลทั้งหมดใน cache"""
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_INVALIDATION_CHANNEL = "user:invalidate"  # Redis pub/sub channel สำหรับแจ้งให้ทุก worker ลบ cache ผู้ใช้
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+async def invalidate_user(username: str):
+    """
+    ลบข้อมูลผู้ใช้ออกจาก Redis และแจ้งทุก worker ผ่าน pub/sub ให้ลบออกจาก cache ภายใน process
+
+    Args:
+        username (str): ชื่อผู้ใช้ที่ข้อมูลเปลี่ยน
+    """
+    user_cache.invalidate(username)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.delete(f"user:{username}")
+    pipe.publish(USER_INVALIDATION_CHANNEL, username)
+    await pipe.execute()
+
+async def run_user_cache_invalidation_listener():
+    """Background task ที่รับข้อความจาก pub/sub แล้วลบผู้ใช้ออกจาก cache ภายใน process"""
+    while True:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(USER_INVALIDATION_CHANNEL)
+            # ล้าง cache เมื่อ (re)subscribe เพราะอาจพลาดข้อความระหว่างที่การเชื่อมต่อหลุด
+            user_cache.clear()
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    user_cache.invalidate(message["data"].decode())
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logging.error("User cache invalidation listener error: %s", exc)
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.reset()
+
 # ฟังก์ชันสำหรับตรวจสอบผู้ใช้
-async def authenticate_user(db: AsyncSession, username: str, password: str) -> Optional[User]:
+async def authenticate_user(
+    db: AsyncSession, username: str, password: str, ticket: Optional[AdmissionTicket] = None
+) -> Optional[CachedUser]:
     """
     ตรวจสอบว่าผู้ใช้และรหัสผ่านที่ให้มาตรงกับข้อมูลที่จัดเก็บในฐานข้อมูลหรือไม่
 
+    ค้นหาตามลำดับ: cache ภายใน process, Redis, และฐานข้อมูล
+
     Args:
         db (AsyncSession): เซสชันฐานข้อมูลสำหรับการเรียกข้อมูล
         username (str): ชื่อผู้ใช้ที่ต้องการตรวจสอบ
         password (str): รหัสผ่านที่ต้องการตรวจสอบ (ยังไม่ได้เข้ารหัส)
+        ticket (Optional[AdmissionTicket]): ช่องของ admission controller ที่ขอเมื่อต้องค้นจากฐานข้อมูลเท่านั้น
 
     Returns:
-        Optional[User]: คืนค่าผู้ใช้หากตรวจสอบสำเร็จ, None หากข้อมูลไม่ถูกต้อง
+        Optional[CachedUser]: คืนค่าผู้ใช้หากตรวจสอบสำเร็จ, None หากข้อมูลไม่ถูกต้อง
     """
-    # Check if the user data is already cached in Redis
-    cached_user = redis_client.get(f"user:{username}")
-    
-    if cached_user:
-        try:
+    # Check the in-process cache first (no network hop for warm users)
+    user = user_cache.get(username)
+    record_cache_lookup("local", "user", user is not None)
+
+    if user is None:
+        # Check if the user data is already cached in Redis
+        cached_user = await redis_client.get(f"user:{username}")
+        record_cache_lookup("redis", "user", cached_user is not None)
+
+        if cached_user:
             logging.info("Cache hit for user: %s", username)
-            # Deserialize JSON string to a dictionary
-            user_data = json.loads(cached_user)
-            user = User(**user_data)  # Convert the dictionary back to a User object
-        except json.JSONDecodeError:
-            logging.error("Failed to decode cached data for user: %s, invalid JSON.", username)
-            # If there's an error in decoding, remove the cached data and refetch from DB
-            redis_client.delete(f"user:{username}")
-            user = None
-    else:
-        logging.info("Cache miss for user: %s, fetching from DB.", username)
-        # Fetch the user from the database if not cached
-        result = await db.execute(select(User).where(User.username == username))
-        user = result.scalars().first()
-        
-        # If user exists, cache it in Redis for 5 minutes (300 seconds)
+            # Deserialize JSON string to a CachedUser
+            user = decode_cached_user(cached_user)
+            if user is None:
+                logging.error("Failed to decode cached data for user: %s, invalid JSON.", username)
+                # If there's an error in decoding, remove the cached data and refetch from DB
+                await redis_client.delete(f"user:{username}")
+
+        if user is None:
+            logging.info("Cache miss for user: %s, fetching from DB.", username)
+            if ticket is not None:
+                await ticket.acquire()
+            # Fetch the user from the database if not cached
+            result = await db.execute(
+                select(User.id, User.username, User.hashed_password, User.department).where(User.username == username)
+            )
+            row = result.first()
+
+            # If user exists, cache it in Redis for 5 minutes (300 seconds)
+            if row:
+                user = CachedUser(*row)
+                logging.info("Caching user: %s", username)
+                # Serialize the dictionary to JSON and store in Redis
+                pipe = redis_client.pipeline(transaction=False)
+                cache_user(pipe, user)
+                await pipe.execute()
+
         if user:
-            # Convert the user object to a dictionary (excluding internal state)
-            user_data = {
-                "id": user.id,
-                "username": user.username,
-                "hashed_password": user.hashed_password,
-            }
-            logging.info("Caching user: %s", username)
-            # Serialize the dictionary to JSON and store in Redis
-            redis_client.setex(f"user:{username}", 300, json.dumps(user_data))
-    
+            user_cache.put(user)
+
     # Verify password
     if user and verify_password_sha256(password, user.hashed_password):
         logging.info("Password verified for user: %s", username)
         return user
     else:
         logging.warning("Invalid password for user: %s", username)
-    
+
     return None
 
 # ฟังก์ชันสำหรับตรวจสอบผู้ใช้
@@ -228,120 +1163,809 @@ async def authenticate_user_(db: AsyncSession, username: str, password: str) ->
         return user
     return None
 
-# API สำหรับตรวจสอบผู้ใช้
-@app.post("/check_user/")
-async def check_user(user_request: UserRequest, db: AsyncSession = Depends(get_db)):
+# ค่าตั้งต้นของ session token แบบ HMAC (ตรวจสอบได้ด้วย CPU อย่างเดียว ไม่ต้องเรียก Redis หรือฐานข้อมูล)
+SESSION_TOKEN_SECRET = os.getenv("SESSION_TOKEN_SECRET")
+SESSION_TOKEN_TTL = int(os.getenv("SESSION_TOKEN_TTL", "900"))  # อายุของ token (วินาที)
+
+if not SESSION_TOKEN_SECRET:
+    # token ที่ออกโดย worker หนึ่งจะใช้กับ worker อื่นไม่ได้ หากไม่ได้กำหนด secret ร่วมกัน
+    logging.warning("SESSION_TOKEN_SECRET is not set, using a random per-process secret.")
+    SESSION_TOKEN_SECRET = secrets.token_hex(32)
+
+def _sign_token_payload(payload: str) -> str:
+    """คืนค่าลายเซ็น HMAC-SHA256 ของ payload ในรูปแบบ base64url"""
+    digest = hmac.new(SESSION_TOKEN_SECRET.encode(), payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+def create_session_token(username: str) -> str:
     """
-    API สำหรับตรวจสอบว่าผู้ใช้มีอยู่ในระบบหรือไม่และตรวจสอบรหัสผ่านของผู้ใช้
+    สร้าง session token อายุสั้นที่ลงลายเซ็นด้วย HMAC
 
     Args:
-        user_request (UserRequest): ข้อมูลผู้ใช้ที่ประกอบด้วย username และ password
-        db (AsyncSession): เซสชันฐานข้อมูลสำหรับการเรียกข้อมูล
+        username (str): ชื่อผู้ใช้ที่ผ่านการตรวจสอบแล้ว
 
     Returns:
-        dict: คืนค่า {"status": "User exists"} หากผู้ใช้และรหัสผ่านถูกต้อง
-        HTTPException: ส่งกลับข้อผิดพลาด 400 หากชื่อผู้ใช้หรือรหัสผ่านไม่ถูกต้อง
+        str: token ในรูปแบบ "<username base64url>.<เวลาหมดอายุ>.<ลายเซ็น>"
     """
-    user = await authenticate_user(db, user_request.username, user_request.password)
-    
-    if user:
-        return {"status": "User exists"}
-    else:
-        raise HTTPException(status_code=401, detail="Invalid username or password")
-    
-# ฟังก์ชันตรวจสอบสถานะการลงเวลา
-def calculate_attendance_status(check_in_time: datetime, check_out_time: Optional[datetime] = None):
+    encoded_username = base64.urlsafe_b64encode(username.encode()).rstrip(b"=").decode()
+    payload = f"{encoded_username}.{int(time.time()) + SESSION_TOKEN_TTL}"
+    return f"{payload}.{_sign_token_payload(payload)}"
+
+def verify_session_token(token: str) -> Optional[str]:
     """
-    ฟังก์ชันสำหรับคำนวณสถานะการลงเวลาเข้างานและออกงาน
+    ตรวจสอบลายเซ็นและเวลาหมดอายุของ session token
 
     Args:
-        check_in_time (datetime): เวลาที่พนักงานลงเวลาเข้างาน
-        check_out_time (datetime, optional): เวลาที่พนักงานลงเวลาออกงาน
+        token (str): token ที่ได้จาก /login
 
     Returns:
-        AttendanceStatus: สถานะการลงเวลา (ปกติ, สาย, ออกก่อน)
+        Optional[str]: ชื่อผู้ใช้หาก token ถูกต้องและยังไม่หมดอายุ, None หากไม่ถูกต้อง
     """
-    day_shift_start = datetime.strptime("08:30", "%H:%M").time()
-    day_shift_end = datetime.strptime("16:30", "%H:%M").time()
-    
-    status = AttendanceStatus.NORMAL
-    if check_in_time.time() > day_shift_start:
-        status = AttendanceStatus.LATE
-    if check_out_time and check_out_time.time() < day_shift_end:
-        status = AttendanceStatus.EARLY_LEAVE
-    return status
+    try:
+        encoded_username, expires_at, signature = token.split(".")
+        # เทียบเป็น bytes: compare_digest กับ str ที่มีอักขระนอก ASCII จะเกิด TypeError
+        expected = _sign_token_payload(f"{encoded_username}.{expires_at}")
+        if not hmac.compare_digest(signature.encode(), expected.encode()):
+            return None
+        if int(expires_at) < time.time():
+            return None
+        padding = "=" * (-len(encoded_username) % 4)
+        return base64.urlsafe_b64decode(encoded_username + padding).decode()
+    except ValueError:
+        return None
 
-# API สำหรับบันทึกเวลาเข้างาน
-@app.post("/check_in/")
-async def check_in(attendance_request: AttendanceRequest, db: AsyncSession = Depends(get_db)):
+async def authenticate_attendance_request(
+    db: AsyncSession, attendance_request: AttendanceRequest, ticket: Optional[AdmissionTicket] = None
+) -> Optional[str]:
     """
-    API สำหรับบันทึกเวลาเข้างาน
+    ตรวจสอบผู้ใช้ของ request การลงเวลา ด้วย token (หากมี) หรือด้วยรหัสผ่าน
 
     Args:
+        db (AsyncSession): เซสชันฐานข้อมูลสำหรับการเรียกข้อมูล
         attendance_request (AttendanceRequest): ข้อมูลการลงเวลาจากผู้ใช้
-        db (AsyncSession): Session ของฐานข้อมูล
+        ticket (Optional[AdmissionTicket]): ช่องของ admission controller ที่ขอเมื่อต้องค้นผู้ใช้จากฐานข้อมูลเท่านั้น
 
     Returns:
-        dict: ผลการบันทึกเวลาเข้างานและสถานะการลงเวลา
+        Optional[str]: ชื่อผู้ใช้หากตรวจสอบสำเร็จ, None หากรหัสผ่านไม่ถูกต้อง
+        HTTPException: ส่งกลับข้อผิดพลาด 401 หาก token ไม่ถูกต้อง หมดอายุ หรือไม่ตรงกับ username
     """
-    # ตรวจสอบว่า user มีอยู่และตรวจสอบ password
-    user = await authenticate_user(db, attendance_request.username, attendance_request.password)
-    
-    if not user:
-        raise HTTPException(status_code=404, detail="Invalid username or password")
-    
-    # ตรวจสอบการ check_in ใน Redis ก่อน
-    cached_attendance = redis_client.get(f"attendance:checkin:{attendance_request.username}")
-    if cached_attendance:
-        logging.info("Cache hit for attendance check-in: %s", attendance_request.username)
-        cached_data = json.loads(cached_attendance)
-        return {
-            "status": "already_checked_in",
-            "message": "You have already checked in today.",
-            "check_in_time": cached_data["check_in_time"]
-        }
-    
-    # ดึงข้อมูล check_in ของผู้ใช้ในวันนี้จากฐานข้อมูล
-    today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0).replace(tzinfo=None)
-    today_end = (today_start + timedelta(days=1)).replace(tzinfo=None)
+    if attendance_request.token:
+        username = verify_session_token(attendance_request.token)
+        if username is None or username != attendance_request.username:
+            raise HTTPException(status_code=401, detail="Invalid or expired token")
+        return username
+
+    if attendance_request.password is None:
+        return None
+    user = await authenticate_user(db, attendance_request.username, attendance_request.password, ticket)
+    return user.username if user else None
+
+# API สำหรับขอ session token
+@app.post("/login")
+async def login(user_request: UserRequest, db: AsyncSession = Depends(get_admitted_db)):
+    """
+    API สำหรับตรวจสอบรหัสผ่านครั้งเดียว แล้วออก session token อายุสั้นสำหรับ /check_in/ และ /check_out/
+
+    Args:
+        user_request (UserRequest): ข้อมูลผู้ใช้ที่ประกอบด้วย username และ password
+        db (AsyncSession): เซสชันฐานข้อมูลสำหรับการเรียกข้อมูล
+
+    Returns:
+        dict: access_token, token_type และ expires_in (วินาที)
+        HTTPException: ส่งกลับข้อผิดพลาด 401 หากชื่อผู้ใช้หรือรหัสผ่านไม่ถูกต้อง
+    """
+    user = await authenticate_user(db, user_request.username, user_request.password)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    return {
+        "access_token": create_session_token(user.username),
+        "token_type": "bearer",
+        "expires_in": SESSION_TOKEN_TTL
+    }
+
+# คลาสสำหรับรับข้อมูลการเปลี่ยนรหัสผ่าน
+class ChangePasswordRequest(BaseModel):
+    """
+    คลาส Pydantic สำหรับรับข้อมูลการเปลี่ยนรหัสผ่าน
+
+    Attributes:
+        username (str): ชื่อผู้ใช้
+        password (str): รหัสผ่านปัจจุบัน
+        new_password (str): รหัสผ่านใหม่
+    """
+    username: str
+    password: str
+    new_password: str
+
+# API สำหรับเปลี่ยนรหัสผ่าน
+@app.post("/change_password/")
+async def change_password(request: ChangePasswordRequest, db: AsyncSession = Depends(get_admitted_db)):
+    """
+    API สำหรับเปลี่ยนรหัสผ่านของผู้ใช้ และแจ้งทุก worker ให้ลบข้อมูลผู้ใช้ออกจาก cache
+
+    Args:
+        request (ChangePasswordRequest): ชื่อผู้ใช้ รหัสผ่านปัจจุบัน และรหัสผ่านใหม่
+        db (AsyncSession): เซสชันฐานข้อมูลสำหรับการเรียกข้อมูล
 
+    Returns:
+        dict: คืนค่า {"status": "Password changed"} หากเปลี่ยนรหัสผ่านสำเร็จ
+        HTTPException: ส่งกลับข้อผิดพลาด 401 หากชื่อผู้ใช้หรือรหัสผ่านไม่ถูกต้อง
+    """
+    user = await authenticate_user(db, request.username, request.password)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+
+    new_hashed_password = hashlib.sha256(request.new_password.encode()).hexdigest()
     result = await db.execute(
-        select(Attendance)
-        .where(Attendance.username == attendance_request.username)
-        .where(Attendance.check_in >= today_start)
-        .where(Attendance.check_in < today_end)
+        update(User).where(User.username == request.username).values(hashed_password=new_hashed_password)
     )
+    if result.rowcount == 0:
+        # ผู้ใช้ที่ preload จาก CSV อาจยังไม่มีในตาราง users
+        db.add(User(username=request.username, hashed_password=new_hashed_password))
+    await db.commit()
+    await invalidate_user(request.username)
+    return {"status": "Password changed"}
 
-    attendance = result.scalars().first()
+# API สำหรับตรวจสอบสถานะของระบบ
+@app.get("/health")
+async def health(db: AsyncSession = Depends(get_db)):
+    """
+    API สำหรับตรวจสอบว่า Redis และฐานข้อมูลพร้อมให้บริการหรือไม่
 
-    # ตรวจสอบว่าในวันเดียวกันมีการ check_in แล้วหรือไม่
-    if attendance:
+    Args:
+        db (AsyncSession): เซสชันฐานข้อมูลสำหรับการเรียกข้อมูล
+
+    Returns:
+        dict: คืนค่า {"status": "ok"} หากทั้ง Redis และฐานข้อมูลตอบสนอง
+        HTTPException: ส่งกลับข้อผิดพลาด 503 หากส่วนใดส่วนหนึ่งไม่พร้อมใช้งาน
+    """
+    try:
+        await redis_client.ping()
+        await db.execute(text("SELECT 1"))
+    except Exception as exc:
+        logging.error("Health check failed: %s", exc)
+        raise HTTPException(status_code=503, detail="Service unavailable")
+    return {"status": "ok"}
+
+# API สำหรับตรวจสอบว่าเตรียมระบบเสร็จแล้ว (ใช้เป็น readiness probe)
+@app.get("/ready")
+async def ready():
+    """
+    API สำหรับตรวจสอบว่าการเตรียมระบบตอนเริ่มทำงาน (schema และ preload ผู้ใช้) เสร็จแล้วหรือไม่
+
+    Returns:
+        dict: สถานะการเตรียมระบบ หากพร้อมให้บริการ
+        HTTPException: ส่งกลับข้อผิดพลาด 503 พร้อมสถานะ หากยังไม่พร้อมหรือเตรียมระบบไม่สำเร็จ
+    """
+    if startup_state["status"] != "ready":
+        raise HTTPException(status_code=503, detail=dict(startup_state))
+    return startup_state
+
+# API สำหรับตรวจสอบผู้ใช้
+@app.post("/check_user/")
+async def check_user(user_request: UserRequest, db: AsyncSession = Depends(get_admitted_db)):
+    """
+    API สำหรับตรวจสอบว่าผู้ใช้มีอยู่ในระบบหรือไม่และตรวจสอบรหัสผ่านของผู้ใช้
+
+    Args:
+        user_request (UserRequest): ข้อมูลผู้ใช้ที่ประกอบด้วย username และ password
+        db (AsyncSession): เซสชันฐานข้อมูลสำหรับการเรียกข้อมูล
+
+    Returns:
+        dict: คืนค่า {"status": "User exists"} หากผู้ใช้และรหัสผ่านถูกต้อง
+        HTTPException: ส่งกลับข้อผิดพลาด 400 หากชื่อผู้ใช้หรือรหัสผ่านไม่ถูกต้อง
+    """
+    user = await authenticate_user(db, user_request.username, user_request.password)
+    
+    if user:
+        return {"status": "User exists"}
+    else:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    
+# ตารางกะการทำงาน (กะรายบุคคล/กลุ่ม กะข้ามคืน และวันหยุด) โหลดครั้งเดียวตอนเริ่มระบบ
+SHIFT_SCHEDULE_FILE = os.getenv("SHIFT_SCHEDULE_FILE")
+shift_schedule = ShiftSchedule.from_file(SHIFT_SCHEDULE_FILE) if SHIFT_SCHEDULE_FILE else ShiftSchedule.default()
+
+# แปลงรหัสสถานะจาก shift_schedule เป็น AttendanceStatus
+STATUS_BY_CODE = {
+    STATUS_NORMAL: AttendanceStatus.NORMAL,
+    STATUS_LATE: AttendanceStatus.LATE,
+    STATUS_EARLY_LEAVE: AttendanceStatus.EARLY_LEAVE,
+}
+
+# ฟังก์ชันตรวจสอบสถานะการลงเวลา
+def calculate_attendance_status(
+    check_in_time: datetime,
+    check_out_time: Optional[datetime] = None,
+    username: Optional[str] = None,
+    work_date: Optional[date] = None
+):
+    """
+    ฟังก์ชันสำหรับคำนวณสถานะการลงเวลาเข้างานและออกงานตามกะของพนักงาน
+
+    เวลาเข้าและออกงานเป็น UTC แบบ timezone-naive จึงแปลงเป็นเวลาท้องถิ่นก่อนเทียบกับเวลาเริ่มและเลิกกะ
+
+    Args:
+        check_in_time (datetime): เวลาที่พนักงานลงเวลาเข้างาน (UTC แบบ timezone-naive)
+        check_out_time (datetime, optional): เวลาที่พนักงานลงเวลาออกงาน (UTC แบบ timezone-naive)
+        username (str, optional): ชื่อผู้ใช้ ใช้เลือกกะ (None ใช้กะตั้งต้น)
+        work_date (date, optional): วันทำงาน (ตามเวลาท้องถิ่น) ใช้ตรวจสอบวันหยุด
+
+    Returns:
+        AttendanceStatus: สถานะการลงเวลา (ปกติ, สาย, ออกก่อน)
+    """
+    local_check_out_time = utc_naive_to_local(check_out_time) if check_out_time is not None else None
+    return STATUS_BY_CODE[
+        shift_schedule.status_code(username, utc_naive_to_local(check_in_time), local_check_out_time, work_date)
+    ]
+
+def is_early_leave(username: str, check_out_time: datetime) -> bool:
+    """True หากเวลาออกงาน (UTC แบบ timezone-naive) อยู่ก่อนเวลาเลิกกะของพนักงานตามเวลาท้องถิ่น"""
+    return shift_schedule.is_early_leave(shift_schedule.shift_index(username), utc_naive_to_local(check_out_time))
+
+def late_status_expression(shift_start):
+    """
+    สร้าง SQL expression ที่ให้ค่า "สาย" หรือ "ปกติ" จากเวลา check_in ในแถว เทียบกับเวลาเริ่มกะ (รองรับกะข้ามคืน)
+
+    Args:
+        shift_start: เวลาเริ่มกะเป็นวินาทีนับจากเที่ยงคืน (ค่าคงที่หรือคอลัมน์)
+
+    Returns:
+        ColumnElement: expression ของสถานะ
+    """
+    # check_in เก็บเป็น UTC แบบ timezone-naive จึงแปลงเป็นเวลาท้องถิ่นก่อนตัดเอาเฉพาะเวลาของวัน
+    local_check_in = func.timezone("Asia/Bangkok", func.timezone("UTC", Attendance.check_in))
+    check_in_seconds = cast(func.extract("epoch", cast(local_check_in, Time)), Numeric)
+    offset = func.mod(check_in_seconds - cast(shift_start, Numeric) + SECONDS_PER_DAY, SECONDS_PER_DAY)
+    return case(
+        (and_(offset > 0, offset < STATUS_WINDOW_SECONDS), AttendanceStatus.LATE.value),
+        else_=AttendanceStatus.NORMAL.value
+    )
+
+def holiday_status_expression(status, check_out_times: Iterable[datetime]):
+    """
+    ครอบ expression ของสถานะให้เป็น "ปกติ" เมื่อวันทำงานของแถวเป็นวันหยุด
+
+    ตรวจเฉพาะวันของ check_out และวันก่อนหน้า (สำหรับกะข้ามคืน) เพื่อให้รายการวันหยุดใน SQL สั้น
+
+    Args:
+        status: expression ของสถานะเดิม
+        check_out_times (Iterable[datetime]): เวลาออกงานที่เกี่ยวข้อง
+
+    Returns:
+        ColumnElement: expression ของสถานะที่คำนึงถึงวันหยุดแล้ว
+    """
+    candidates = set()
+    for check_out_time in check_out_times:
+        check_out_date = local_work_date(check_out_time)
+        candidates.update((check_out_date - timedelta(days=1), check_out_date))
+    holidays = sorted(d for d in candidates if shift_schedule.is_holiday(d))
+    if not holidays:
+        return status
+    return case((Attendance.work_date.in_(holidays), AttendanceStatus.NORMAL.value), else_=status)
+
+def check_out_status_expression(username: str, check_out_time: datetime):
+    """
+    สร้าง SQL expression ของสถานะตอน check_out เพื่อคำนวณใน UPDATE เดียวกัน
+
+    การออกก่อนเวลาตัดสินใน Python จากเวลา check_out ส่วนการมาสายตัดสินใน SQL
+    จากเวลา check_in ที่อยู่ในแถว โดยเทียบกับเวลาเริ่มกะของพนักงาน
+
+    Args:
+        username (str): ชื่อผู้ใช้
+        check_out_time (datetime): เวลาออกงาน (UTC แบบ timezone-naive)
+
+    Returns:
+        ColumnElement: expression ที่ให้ค่าสถานะการลงเวลา
+    """
+    if is_early_leave(username, check_out_time):
+        status = literal(AttendanceStatus.EARLY_LEAVE.value)
+    else:
+        status = late_status_expression(shift_schedule.start_seconds[shift_schedule.shift_index(username)])
+    return holiday_status_expression(status, [check_out_time])
+
+# โหมด write-behind: ตอบรับ check_in ทันทีหลังบันทึกลง Redis แล้วค่อยเขียนลงฐานข้อมูลเป็นชุด
+WRITE_BEHIND_ENABLED = os.getenv("ATTENDANCE_WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("WRITE_BEHIND_FLUSH_MS", "200"))  # flush ทุก N มิลลิวินาที
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))  # หรือเมื่อสะสมครบ M แถว
+WRITE_BEHIND_QUEUE_KEY = "attendance:pending"  # Redis list ที่ใช้เป็นคิวถาวร (อยู่รอดแม้ worker restart)
+# batch ที่ดึงออกจากคิวจะถูกย้ายไปไว้ใน list ของ batch นั้นและลบทิ้งหลัง commit เท่านั้น
+# หาก worker หยุดทำงานกลางทาง batch จะถูกคืนเข้าหัวคิวเมื่อ lease หมดอายุ
+WRITE_BEHIND_PROCESSING_PREFIX = "attendance:pending:processing:"
+WRITE_BEHIND_LEASES_KEY = "attendance:pending:leases"  # ZSET: batch id -> เวลาหมดอายุของ lease
+WRITE_BEHIND_LEASE_SECONDS = int(os.getenv("WRITE_BEHIND_LEASE_SECONDS", "60"))
+# รายการที่เขียนลงฐานข้อมูลไม่ได้ (เช่น ผู้ใช้ไม่มีในตาราง users) พร้อมข้อความผิดพลาด เพื่อตรวจสอบภายหลัง
+WRITE_BEHIND_DEAD_LETTER_KEY = "attendance:pending:dead"
+
+# สถิติของคิว write-behind
+write_behind_stats = {
+    "flushes": 0,
+    "failed_flushes": 0,
+    "rows_flushed": 0,
+    "dead_lettered": 0,
+    "last_flush_ms": 0.0,
+    "max_flush_ms": 0.0,
+}
+write_behind_wakeup = asyncio.Event()
+write_behind_pending = 0  # จำนวนรายการที่ worker นี้ enqueue ตั้งแต่ flush ครั้งล่าสุด
+
+# จอง check_in ของวันนี้ (SET NX) และต่อคิวในคำสั่งเดียวแบบ atomic
+# คืนค่า nil หากจองสำเร็จ หรือคืนค่า payload เดิมหากผู้ใช้ลงเวลาแล้ว
+ENQUEUE_CHECK_IN_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EXAT', ARGV[2]) then
+    redis.call('RPUSH', KEYS[2], ARGV[3])
+    return false
+end
+return redis.call('GET', KEYS[1])
+"""
+enqueue_check_in_script = redis_client.register_script(ENQUEUE_CHECK_IN_SCRIPT)
+
+async def enqueue_check_in(username: str, check_in_time: datetime, work_date: date, status: AttendanceStatus) -> Optional[dict]:
+    """
+    บันทึก check_in ลง Redis และคิว write-behind โดยยังไม่เขียนลงฐานข้อมูล
+
+    Args:
+        username (str): ชื่อผู้ใช้
+        check_in_time (datetime): เวลา check_in (UTC แบบ timezone-naive)
+        work_date (date): วันทำงานตามเวลาท้องถิ่น
+        status (AttendanceStatus): สถานะการลงเวลา
+
+    Returns:
+        Optional[dict]: None หากต่อคิวสำเร็จ หรือข้อมูล check_in เดิมจาก cache หากผู้ใช้ลงเวลาแล้ว
+    """
+    global write_behind_pending
+    attendance_data = encode_attendance_cache(utc_naive_to_local(check_in_time).isoformat(), status.value)
+    event = {
+        "username": username,
+        "work_date": work_date.isoformat(),
+        "check_in": check_in_time.isoformat(),
+        "status": status.value
+    }
+    existing = await enqueue_check_in_script(
+        keys=[attendance_cache_key("checkin", username, work_date), WRITE_BEHIND_QUEUE_KEY],
+        args=[attendance_data, attendance_cache_expiry(work_date), dumps_json(event)]
+    )
+    if existing:
+        check_in_time_text, status_value = decode_attendance_cache(existing)
+        return {"check_in_time": check_in_time_text, "status": status_value}
+    pipe = redis_client.pipeline(transaction=False)
+    await mark_present(pipe, username, work_date)
+    await publish_attendance_event(
+        pipe, "checkin", username, work_date, utc_naive_to_local(check_in_time).isoformat(), status.value
+    )
+    await pipe.execute()
+
+    write_behind_pending += 1
+    if write_behind_pending >= WRITE_BEHIND_BATCH_SIZE:
+        write_behind_wakeup.set()  # สะสมครบ batch แล้ว ให้ flush ทันทีไม่ต้องรอรอบเวลา
+    return None
+
+# ย้ายรายการจากหัวคิวไปยัง list ของ batch (LMOVE ทีละรายการ) และจด lease ของ batch ในคำสั่งเดียวแบบ atomic
+CLAIM_WRITE_BEHIND_BATCH_SCRIPT = """
+local moved = {}
+for i = 1, tonumber(ARGV[1]) do
+    local raw = redis.call('LMOVE', KEYS[1], KEYS[2], 'LEFT', 'RIGHT')
+    if not raw then
+        break
+    end
+    moved[#moved + 1] = raw
+end
+if #moved > 0 then
+    redis.call('ZADD', KEYS[3], ARGV[2], ARGV[3])
+end
+return moved
+"""
+claim_write_behind_batch_script = redis_client.register_script(CLAIM_WRITE_BEHIND_BATCH_SCRIPT)
+
+# คืนรายการของ batch กลับไปหัวคิวตามลำดับเดิม และลบ lease
+REQUEUE_WRITE_BEHIND_BATCH_SCRIPT = """
+local count = 0
+while redis.call('LMOVE', KEYS[2], KEYS[1], 'RIGHT', 'LEFT') do
+    count = count + 1
+end
+redis.call('ZREM', KEYS[3], ARGV[1])
+return count
+"""
+requeue_write_behind_batch_script = redis_client.register_script(REQUEUE_WRITE_BEHIND_BATCH_SCRIPT)
+
+async def requeue_write_behind_batch(batch_id: str) -> int:
+    """คืนรายการของ batch ที่ยังไม่ได้ ack กลับไปหัวคิว write-behind"""
+    return await requeue_write_behind_batch_script(
+        keys=[WRITE_BEHIND_QUEUE_KEY, WRITE_BEHIND_PROCESSING_PREFIX + batch_id, WRITE_BEHIND_LEASES_KEY],
+        args=[batch_id]
+    )
+
+async def requeue_expired_write_behind_batches() -> int:
+    """คืน batch ที่ lease หมดอายุแล้ว (worker ที่ดึงไปหยุดทำงานก่อน ack) กลับไปหัวคิว"""
+    expired = await redis_client.zrangebyscore(WRITE_BEHIND_LEASES_KEY, "-inf", time.time())
+    requeued = 0
+    for batch_id in expired:
+        batch_id = batch_id.decode() if isinstance(batch_id, bytes) else batch_id
+        requeued += await requeue_write_behind_batch(batch_id)
+    if requeued:
+        logging.warning("Requeued %d write-behind events from expired batches", requeued)
+    return requeued
+
+def write_behind_row(raw) -> dict:
+    """แปลงรายการในคิว write-behind เป็นแถวของตาราง attendance"""
+    event = loads_json(raw)
+    return {
+        "username": event["username"],
+        "work_date": date.fromisoformat(event["work_date"]),
+        "check_in": datetime.fromisoformat(event["check_in"]),
+        "status": event["status"]
+    }
+
+async def insert_write_behind_rows(entries: List[tuple]) -> tuple:
+    """
+    เขียน check_in ลงตาราง attendance ด้วย multi-row INSERT คำสั่งเดียว
+
+    หากมีแถวที่ฐานข้อมูลปฏิเสธ (เช่น ผู้ใช้ไม่มีในตาราง users หรือไม่มี partition ของวันทำงาน)
+    จะแบ่งครึ่ง batch แล้วลองใหม่ จนแยกแถวที่เขียนไม่ได้ออกมา แถวอื่นใน batch จึงยังถูกบันทึก
+
+    Args:
+        entries (List[tuple]): (รายการดิบจากคิว, แถว)
+
+    Returns:
+        tuple: (แถวที่เขียนสำเร็จ, [(รายการดิบ, ข้อความผิดพลาด)])
+    """
+    rows = [row for _, row in entries]
+    try:
+        async with SessionLocal() as db:
+            await db.execute(
+                pg_insert(Attendance)
+                .values(rows)
+                .on_conflict_do_nothing(index_elements=["username", "work_date"])
+            )
+            await db.commit()
+        return rows, []
+    except (IntegrityError, DataError) as exc:
+        if len(entries) == 1:
+            return [], [(entries[0][0], str(exc.orig))]
+    middle = len(entries) // 2
+    written, rejected = await insert_write_behind_rows(entries[:middle])
+    more_written, more_rejected = await insert_write_behind_rows(entries[middle:])
+    return written + more_written, rejected + more_rejected
+
+async def flush_attendance_queue() -> int:
+    """
+    ดึงรายการจากคิว write-behind ทีละ batch แล้วเขียนลงตาราง attendance ด้วย multi-row INSERT คำสั่งเดียวต่อ batch
+
+    batch ถูกย้ายไปไว้ใน list ของ batch ก่อน (ไม่ลบออกจาก Redis) และลบทิ้งหลัง commit เท่านั้น
+    รายการที่ฐานข้อมูลปฏิเสธจะถูกย้ายไปที่ WRITE_BEHIND_DEAD_LETTER_KEY เพื่อไม่ให้ค้างหัวคิว
+    หากเขียนไม่สำเร็จด้วยสาเหตุอื่น (เช่น ฐานข้อมูลล่ม) batch จะถูกคืนกลับไปไว้หัวคิวเพื่อลองใหม่รอบถัดไป
+
+    Returns:
+        int: จำนวนแถวที่ flush สำเร็จ
+    """
+    global write_behind_pending
+    write_behind_pending = 0
+    await requeue_expired_write_behind_batches()
+    flushed = 0
+    while True:
+        batch_id = secrets.token_hex(8)
+        processing_key = WRITE_BEHIND_PROCESSING_PREFIX + batch_id
+        raw_events = await claim_write_behind_batch_script(
+            keys=[WRITE_BEHIND_QUEUE_KEY, processing_key, WRITE_BEHIND_LEASES_KEY],
+            args=[WRITE_BEHIND_BATCH_SIZE, time.time() + WRITE_BEHIND_LEASE_SECONDS, batch_id]
+        )
+        if not raw_events:
+            break
+
+        started = time.perf_counter()
+        entries, rejected = [], []
+        for raw in raw_events:
+            try:
+                entries.append((raw, write_behind_row(raw)))
+            except (ValueError, KeyError, TypeError) as exc:
+                rejected.append((raw, f"invalid event: {exc!r}"))
+        try:
+            await ensure_partitions_for(row["work_date"] for _, row in entries)
+            rows, rejected_rows = await insert_write_behind_rows(entries) if entries else ([], [])
+        except Exception as exc:
+            logging.error("Write-behind flush of %d rows failed: %s", len(raw_events), exc)
+            write_behind_stats["failed_flushes"] += 1
+            await requeue_write_behind_batch(batch_id)
+            break
+        rejected += rejected_rows
+
+        # ack: ลบ batch หลัง commit แล้ว พร้อมย้ายรายการที่เขียนไม่ได้ไป dead-letter
+        pipe = redis_client.pipeline(transaction=True)
+        if rejected:
+            pipe.rpush(
+                WRITE_BEHIND_DEAD_LETTER_KEY,
+                *(dumps_json({"event": raw.decode(errors="replace"), "error": error}) for raw, error in rejected)
+            )
+        if rows:
+            pipe.sadd(SUMMARY_DIRTY_KEY, *{row["work_date"].isoformat() for row in rows})
+        pipe.delete(processing_key)
+        pipe.zrem(WRITE_BEHIND_LEASES_KEY, batch_id)
+        await pipe.execute()
+
+        for raw, error in rejected:
+            logging.error("Write-behind event moved to %s: %s (%s)", WRITE_BEHIND_DEAD_LETTER_KEY, raw, error)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        write_behind_stats["flushes"] += 1
+        write_behind_stats["rows_flushed"] += len(rows)
+        write_behind_stats["dead_lettered"] += len(rejected)
+        write_behind_stats["last_flush_ms"] = elapsed_ms
+        write_behind_stats["max_flush_ms"] = max(write_behind_stats["max_flush_ms"], elapsed_ms)
+        flushed += len(rows)
+
+        if len(raw_events) < WRITE_BEHIND_BATCH_SIZE:
+            break
+    return flushed
+
+async def persist_pending_check_ins(db: AsyncSession, keys: Iterable[tuple]) -> int:
+    """
+    เขียน check_in ที่อาจยังค้างในคิว write-behind ของผู้ใช้และวันทำงานที่ระบุลงฐานข้อมูลทันที (ใน transaction ของ db)
+
+    ใช้ข้อมูลจาก cache check_in รายวัน จึงไม่ต้อง flush ทั้งคิว เมื่อ flusher เขียนรายการเดียวกันภายหลังจะถูกข้ามด้วย ON CONFLICT
+
+    Args:
+        db (AsyncSession): เซสชันฐานข้อมูล
+        keys (Iterable[tuple]): (ชื่อผู้ใช้, วันทำงาน)
+
+    Returns:
+        int: จำนวน check_in ที่พบใน cache และส่งเขียนลงฐานข้อมูล
+    """
+    keys = list(keys)
+    cached = await redis_client.mget([attendance_cache_key("checkin", username, work_date) for username, work_date in keys])
+    rows = []
+    for (username, work_date), raw in zip(keys, cached):
+        if raw is None:
+            continue
+        local_time, status_value = decode_attendance_cache(raw)
+        if not local_time:
+            continue
+        check_in_time = datetime.fromisoformat(local_time).astimezone(timezone.utc).replace(tzinfo=None)
+        rows.append({"username": username, "work_date": work_date, "check_in": check_in_time, "status": status_value})
+    if not rows:
+        return 0
+    await ensure_partitions_for(row["work_date"] for row in rows)
+    try:
+        async with db.begin_nested():
+            await db.execute(
+                pg_insert(Attendance)
+                .values(rows)
+                .on_conflict_do_nothing(index_elements=["username", "work_date"])
+            )
+    except (IntegrityError, DataError) as exc:
+        # ปล่อยให้ flusher ย้ายรายการที่เขียนไม่ได้ไป dead-letter
+        logging.warning("Could not persist pending check-ins for %s: %s", [username for username, _ in keys], exc.orig)
+        return 0
+    return len(rows)
+
+async def run_write_behind_flusher():
+    """Background task ที่ flush คิว write-behind ทุก WRITE_BEHIND_FLUSH_MS หรือทันทีเมื่อสะสมครบ batch"""
+    while True:
+        try:
+            await asyncio.wait_for(write_behind_wakeup.wait(), timeout=WRITE_BEHIND_FLUSH_MS / 1000)
+        except asyncio.TimeoutError:
+            pass
+        write_behind_wakeup.clear()
+        try:
+            await flush_attendance_queue()
+        except Exception as exc:
+            logging.error("Write-behind flusher error: %s", exc)
+
+# API สำหรับดูสถิติของคิว write-behind
+@app.get("/metrics/write_behind")
+async def write_behind_metrics():
+    """
+    API สำหรับดูความยาวคิวและเวลาที่ใช้ flush ของโหมด write-behind
+
+    Returns:
+        dict: สถานะการเปิดใช้งาน ความยาวคิวปัจจุบัน และสถิติการ flush ของ worker นี้
+    """
+    return {
+        "enabled": WRITE_BEHIND_ENABLED,
+        "queue_depth": await redis_client.llen(WRITE_BEHIND_QUEUE_KEY),
+        "dead_letter_depth": await redis_client.llen(WRITE_BEHIND_DEAD_LETTER_KEY),
+        **write_behind_stats
+    }
+
+# Metrics ของ write-behind และ connection pool (อ่านค่าตอน render)
+REGISTRY.counter("write_behind_flushes_total", "Write-behind batches flushed by this worker.",
+                 function=lambda: write_behind_stats["flushes"])
+REGISTRY.counter("write_behind_rows_flushed_total", "Write-behind rows flushed by this worker.",
+                 function=lambda: write_behind_stats["rows_flushed"])
+REGISTRY.counter("write_behind_failed_flushes_total", "Write-behind flushes that failed and were requeued.",
+                 function=lambda: write_behind_stats["failed_flushes"])
+REGISTRY.counter("write_behind_dead_lettered_total", "Write-behind rows the database rejected, moved to dead-letter.",
+                 function=lambda: write_behind_stats["dead_lettered"])
+write_behind_queue_depth = REGISTRY.gauge("write_behind_queue_depth", "Rows waiting in the write-behind queue.")
+REGISTRY.gauge("db_pool_checked_out", "Database connections currently checked out.",
+               function=lambda: engine.pool.checkedout())
+REGISTRY.gauge("user_cache_entries", "Users held in the in-process cache.", function=lambda: len(user_cache))
+
+# API สำหรับ metrics รูปแบบ Prometheus
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    API สำหรับ Prometheus: latency ต่อ endpoint, cache hit/miss, เวลารอ connection pool, request ที่กำลังทำงาน และคิว write-behind
+
+    Returns:
+        PlainTextResponse: metrics ในรูปแบบ text exposition format 0.0.4
+    """
+    write_behind_queue_depth.set(await redis_client.llen(WRITE_BEHIND_QUEUE_KEY))
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+async def authenticate_from_cache(attendance_request: AttendanceRequest) -> Optional[str]:
+    """
+    ตรวจสอบผู้ใช้ของ request การลงเวลาโดยไม่แตะฐานข้อมูล (token, cache ภายใน process หรือ Redis)
+
+    Returns:
+        Optional[str]: ชื่อผู้ใช้หากตรวจสอบสำเร็จ, None หากตรวจสอบไม่ได้หรือไม่ถูกต้อง
+    """
+    if attendance_request.token:
+        username = verify_session_token(attendance_request.token)
+        return username if username == attendance_request.username else None
+    if attendance_request.password is None:
+        return None
+    user = user_cache.get(attendance_request.username)
+    if user is None:
+        raw = await redis_client.get(f"user:{attendance_request.username}")
+        user = decode_cached_user(raw) if raw else None
+    if user and verify_password_sha256(attendance_request.password, user.hashed_password):
+        return user.username
+    return None
+
+async def cached_attendance_answer(kind: str, attendance_request: AttendanceRequest) -> Optional[dict]:
+    """
+    สร้างคำตอบ already_checked_in / already_checked_out จาก Redis อย่างเดียว (ใช้เมื่อฐานข้อมูลรับงานเต็ม)
+
+    Args:
+        kind (str): "checkin" หรือ "checkout"
+        attendance_request (AttendanceRequest): ข้อมูลการลงเวลาจากผู้ใช้
+
+    Returns:
+        Optional[dict]: คำตอบเดียวกับที่ endpoint ตอบเมื่อพบใน cache, None หากต้องใช้ฐานข้อมูล
+    """
+    username = await authenticate_from_cache(attendance_request)
+    if not username:
+        return None
+    if kind == "checkin":
+        work_date = attendance_work_date(username, to_utc_naive(attendance_request.check_in))
+    else:
+        work_date = check_out_work_date(username, to_utc_naive(attendance_request.check_out))
+
+    cached_attendance = await redis_client.get(attendance_cache_key(kind, username, work_date))
+    record_cache_lookup("redis", "attendance", cached_attendance is not None)
+    if cached_attendance:
+        cached_time, _ = decode_attendance_cache(cached_attendance)
+        if kind == "checkin":
+            return {
+                "status": "already_checked_in",
+                "message": "You have already checked in today.",
+                "check_in_time": cached_time
+            }
+        return {
+            "status": "already_checked_out",
+            "message": "You have already checked out today.",
+            "check_out_time": cached_time
+        }
+    # ไม่มี cache ของผู้ใช้ แต่ bitmap การเข้างานของวันยังยืนยันได้ว่าเข้างานแล้ว (ไม่มีเวลาเข้างานให้)
+    if kind == "checkin" and await is_checked_in(username, work_date):
         return {
             "status": "already_checked_in",
             "message": "You have already checked in today.",
-            "check_in_time": attendance.check_in.isoformat()  # แสดงเวลาที่เช็คอินแล้ว
+            "check_in_time": None
         }
+    return None
+
+# API สำหรับบันทึกเวลาเข้างาน
+@app.post("/check_in/")
+async def check_in(
+    attendance_request: AttendanceRequest,
+    db: AsyncSession = Depends(get_db),
+    ticket: AdmissionTicket = Depends(admission_ticket)
+):
+    """
+    API สำหรับบันทึกเวลาเข้างาน
+
+    Args:
+        attendance_request (AttendanceRequest): ข้อมูลการลงเวลาจากผู้ใช้
+        db (AsyncSession): Session ของฐานข้อมูล
+        ticket (AdmissionTicket): ช่องของ admission controller (ขอก่อนใช้ฐานข้อมูล)
+
+    Returns:
+        dict: ผลการบันทึกเวลาเข้างานและสถานะการลงเวลา
+    """
+    # เมื่อฐานข้อมูลรับงานเต็ม ลองตอบ "เข้างานแล้ว" จาก Redis ก่อนเข้าคิว
+    if admission.saturated:
+        cached_answer = await cached_attendance_answer("checkin", attendance_request)
+        if cached_answer:
+            return cached_answer
 
+    # ตรวจสอบว่า user มีอยู่และตรวจสอบ password หรือ token (ขอช่องฐานข้อมูลเมื่อผู้ใช้ไม่อยู่ใน cache เท่านั้น)
+    username = await authenticate_attendance_request(db, attendance_request, ticket)
+    
+    if not username:
+        raise HTTPException(status_code=404, detail="Invalid username or password")
+    
     # บันทึกเวลา check_in
-    check_in_time = (attendance_request.check_in or datetime.now(timezone.utc)).replace(tzinfo=None)
+    check_in_time = to_utc_naive(attendance_request.check_in)
+    work_date = attendance_work_date(username, check_in_time)
 
-    status = calculate_attendance_status(check_in_time)
+    # ตรวจสอบการ check_in ของวันทำงานนี้ใน Redis ก่อน
+    cached_attendance = await redis_client.get(attendance_cache_key("checkin", username, work_date))
+    record_cache_lookup("redis", "attendance", cached_attendance is not None)
+    if cached_attendance:
+        logging.info("Cache hit for attendance check-in: %s", attendance_request.username)
+        cached_check_in_time, _ = decode_attendance_cache(cached_attendance)
+        return {
+            "status": "already_checked_in",
+            "message": "You have already checked in today.",
+            "check_in_time": cached_check_in_time
+        }
+
+    status = calculate_attendance_status(check_in_time, username=username, work_date=work_date)
 
-    new_attendance = Attendance(username=str(user.username), check_in=check_in_time, status=status.value)
+    if WRITE_BEHIND_ENABLED:
+        existing = await enqueue_check_in(username, check_in_time, work_date, status)
+        if existing:
+            return {
+                "status": "already_checked_in",
+                "message": "You have already checked in today.",
+                "check_in_time": existing["check_in_time"]
+            }
+        return {
+            "status": "Check-in successful",
+            "check_in": utc_naive_to_local(check_in_time).isoformat(),
+            "attendance_status": status.value
+        }
 
-    db.add(new_attendance)
+    # INSERT ... ON CONFLICT DO NOTHING RETURNING คำสั่งเดียว แทน SELECT + INSERT + REFRESH
+    # unique index (username, work_date) ทำให้ request ที่ซ้ำกันพร้อมกันไม่สามารถสร้างแถวซ้ำได้
+    await ticket.acquire()
+    await ensure_partitions_for([work_date])
+    result = await db.execute(
+        pg_insert(Attendance)
+        .values(username=username, work_date=work_date, check_in=check_in_time, status=status.value)
+        .on_conflict_do_nothing(index_elements=["username", "work_date"])
+        .returning(Attendance.check_in)
+    )
+    inserted_check_in = result.scalar_one_or_none()
     await db.commit()
-    await db.refresh(new_attendance)
-    
+
+    # ตรวจสอบว่าในวันเดียวกันมีการ check_in แล้วหรือไม่
+    if inserted_check_in is None:
+        result = await db.execute(
+            select(Attendance.check_in, Attendance.status)
+            .where(Attendance.username == username)
+            .where(Attendance.work_date == work_date)
+        )
+        existing = result.one()
+        existing_check_in_time = utc_naive_to_local(existing.check_in).isoformat()
+
+        # cache หมดอายุหรือถูกลบไปแล้ว เติม cache และ bitmap กลับเหมือนตอน check_in สำเร็จ
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.set(
+            attendance_cache_key("checkin", username, work_date),
+            encode_attendance_cache(existing_check_in_time, existing.status),
+            exat=attendance_cache_expiry(work_date)
+        )
+        await mark_present(pipe, username, work_date)
+        await pipe.execute()
+        return {
+            "status": "already_checked_in",
+            "message": "You have already checked in today.",
+            "check_in_time": existing_check_in_time  # แสดงเวลาที่เช็คอินแล้ว (เวลาท้องถิ่น)
+        }
+
     # แปลงเวลาเป็นเวลาท้องถิ่นก่อนส่งกลับ
-    local_check_in_time = convert_utc_to_local(new_attendance.check_in)
+    local_check_in_time = utc_naive_to_local(inserted_check_in)
 
     # แคชข้อมูล check_in ใน Redis
-    attendance_data = {
-        "check_in_time": local_check_in_time.isoformat(),
-        "status": status.value
-    }
-    redis_client.setex(f"attendance:checkin:{attendance_request.username}", 86400, json.dumps(attendance_data))  # แคชเป็นเวลา 1 วัน
+    attendance_data = encode_attendance_cache(local_check_in_time.isoformat(), status.value)
+    # แคชถึงเที่ยงคืนตามเวลาท้องถิ่น และบันทึกลง bitmap การเข้างานของวัน
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.set(attendance_cache_key("checkin", username, work_date), attendance_data, exat=attendance_cache_expiry(work_date))
+    await mark_present(pipe, username, work_date)
+    mark_summary_dirty(pipe, work_date)
+    await publish_attendance_event(pipe, "checkin", username, work_date, local_check_in_time.isoformat(), status.value)
+    await pipe.execute()
     
     return {
         "status": "Check-in successful",
@@ -351,88 +1975,949 @@ async def check_in(attendance_request: AttendanceRequest, db: AsyncSession = Dep
 
 # API สำหรับบันทึกเวลาออกงาน
 @app.post("/check_out/")
-async def check_out(attendance_request: AttendanceRequest, db: AsyncSession = Depends(get_db)):
+async def check_out(
+    attendance_request: AttendanceRequest,
+    db: AsyncSession = Depends(get_db),
+    ticket: AdmissionTicket = Depends(admission_ticket)
+):
     """
     API สำหรับบันทึกเวลาออกงาน (สามารถทำซ้ำได้ โดยจะอัปเดตเวลาล่าสุด)
 
     Args:
         attendance_request (AttendanceRequest): ข้อมูลการลงเวลาจากผู้ใช้
         db (AsyncSession): Session ของฐานข้อมูล
+        ticket (AdmissionTicket): ช่องของ admission controller (ขอก่อนใช้ฐานข้อมูล)
 
     Returns:
         dict: ผลการบันทึกเวลาออกงานและสถานะการลงเวลา
     """
+    # เมื่อฐานข้อมูลรับงานเต็ม ลองตอบ "ออกงานแล้ว" จาก Redis ก่อนเข้าคิว
+    if admission.saturated:
+        cached_answer = await cached_attendance_answer("checkout", attendance_request)
+        if cached_answer:
+            return cached_answer
 
-    # ตรวจสอบว่า user มีอยู่และตรวจสอบ password
-    user = await authenticate_user(db, attendance_request.username, attendance_request.password)
+    # ตรวจสอบว่า user มีอยู่และตรวจสอบ password หรือ token (ขอช่องฐานข้อมูลเมื่อผู้ใช้ไม่อยู่ใน cache เท่านั้น)
+    username = await authenticate_attendance_request(db, attendance_request, ticket)
     
-    if not user:
+    if not username:
         raise HTTPException(status_code=404, detail="Invalid username or password")
     
-    # ตรวจสอบการ check_out ใน Redis ก่อน
-    cached_attendance = redis_client.get(f"attendance:checkout:{attendance_request.username}")
+    # แปลง check_out_time เป็น timezone-naive ก่อนบันทึกลงฐานข้อมูล
+    check_out_time = to_utc_naive(attendance_request.check_out)
+    check_out_date = check_out_work_date(username, check_out_time)
+
+    # ตรวจสอบการ check_out ของวันนี้ใน Redis ก่อน
+    cached_attendance = await redis_client.get(attendance_cache_key("checkout", username, check_out_date))
+    record_cache_lookup("redis", "attendance", cached_attendance is not None)
     if cached_attendance:
         logging.info("Cache hit for attendance check-out: %s", attendance_request.username)
-        cached_data = json.loads(cached_attendance)
+        cached_check_out_time, _ = decode_attendance_cache(cached_attendance)
         return {
             "status": "already_checked_out",
             "message": "You have already checked out today.",
-            "check_out_time": cached_data["check_out_time"]
+            "check_out_time": cached_check_out_time
         }
 
-    # ดึงข้อมูลการ check_in ล่าสุดของผู้ใช้จากฐานข้อมูล
-    result = await db.execute(
-        select(Attendance)
+    # แถวการลงเวลาล่าสุดของผู้ใช้ (ใช้ index (username, id DESC))
+    # เงื่อนไข work_date ทำให้ PostgreSQL ตัด partition เก่าออกจากการค้นหา
+    earliest_work_date = check_out_date - timedelta(days=CHECK_OUT_LOOKBACK_DAYS)
+    latest_attendance_id = (
+        select(Attendance.id)
         .where(Attendance.username == attendance_request.username)
+        .where(Attendance.work_date >= earliest_work_date)
         .order_by(Attendance.id.desc())
-        .limit(1)  # ดึงข้อมูลเพียงรายการเดียว
+        .limit(1)
+        .scalar_subquery()
     )
-    attendance = result.scalars().first()
-    
-    # ตรวจสอบว่ามีการ check_in ก่อนหน้านี้หรือไม่
-    if not attendance:
-        raise HTTPException(status_code=404, detail="Check-in not found")
 
-    # แปลง check_out_time เป็น timezone-naive ก่อนบันทึกลงฐานข้อมูล
-    check_out_time = (attendance_request.check_out or datetime.now(timezone.utc)).replace(tzinfo=None)
+    # คำนวณสถานะใน SQL ตามกะของพนักงาน
+    status_expr = check_out_status_expression(username, check_out_time)
 
-    # แปลง attendance.check_in ให้เป็น timezone-naive
-    check_in_time_naive = attendance.check_in.replace(tzinfo=None)
+    # UPDATE ... RETURNING คำสั่งเดียว พร้อมตรวจสอบว่า check_out อยู่หลัง check_in ในเงื่อนไข WHERE
+    check_out_statement = (
+        update(Attendance)
+        .where(Attendance.id == latest_attendance_id)
+        .where(Attendance.work_date >= earliest_work_date)
+        .where(Attendance.check_in < check_out_time)
+        .values(check_out=check_out_time, status=status_expr)
+        .returning(Attendance.check_out, Attendance.status, Attendance.work_date)
+    )
+    await ticket.acquire()
+    result = await db.execute(check_out_statement)
+    updated = result.first()
 
-    # ตรวจสอบสถานะการลงเวลา
-    status = calculate_attendance_status(attendance.check_in, check_out_time)
+    if updated is None and WRITE_BEHIND_ENABLED:
+        # check_in ของผู้ใช้อาจยังค้างอยู่ในคิว write-behind: เขียนเฉพาะรายการของผู้ใช้นี้แล้วลองอีกครั้ง
+        pending = [(username, check_out_date), (username, check_out_date - timedelta(days=1))]
+        if await persist_pending_check_ins(db, pending):
+            result = await db.execute(check_out_statement)
+            updated = result.first()
 
-    # ตรวจสอบว่า check_out_time น้อยกว่า check_in_time หรือไม่
-    if check_out_time <= check_in_time_naive:
+    if updated is None:
+        # ไม่มีแถวถูกอัปเดต: ตรวจว่าเพราะยังไม่เคย check_in หรือเพราะเวลา check_out ไม่ถูกต้อง
+        await db.rollback()
+        result = await db.execute(select(latest_attendance_id))
+        if result.scalar_one_or_none() is None:
+            raise HTTPException(status_code=404, detail="Check-in not found")
         raise HTTPException(status_code=422, detail="Check-out time must be after check-in time")
 
-
-    # อัปเดตข้อมูล check_out และสถานะ
-    attendance.check_out = check_out_time
-    attendance.status = status.value
-
     await db.commit()
-    await db.refresh(attendance)
+    checked_out_at, status_value, attendance_work_date = updated
 
     # แปลงเวลาจาก UTC เป็นเวลาท้องถิ่นก่อนส่งกลับ
-    local_check_out_time = convert_utc_to_local(attendance.check_out)
+    local_check_out_time = utc_naive_to_local(checked_out_at)
 
     # แคชข้อมูล check_out ใน Redis
-    attendance_data = {
-        "check_out_time": local_check_out_time.isoformat(),
-        "status": status.value
-    }
-    redis_client.setex(f"attendance:checkout:{attendance_request.username}", 86400, json.dumps(attendance_data))  # แคชเป็นเวลา 1 วัน
+    attendance_data = encode_attendance_cache(local_check_out_time.isoformat(), status_value)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.set(
+        attendance_cache_key("checkout", username, check_out_date), attendance_data,
+        exat=attendance_cache_expiry(check_out_date)  # แคชถึงเที่ยงคืนหลังวันที่กะข้ามคืนเลิก
+    )
+    mark_summary_dirty(pipe, attendance_work_date)
+    await publish_attendance_event(
+        pipe, "checkout", username, attendance_work_date, local_check_out_time.isoformat(), status_value
+    )
+    await pipe.execute()
 
     return {
         "status": "Check-out successful",
         "check_out": local_check_out_time.isoformat(),  # ส่งกลับในรูปแบบ ISO พร้อมเวลาท้องถิ่น
-        "attendance_status": status.value
+        "attendance_status": status_value
+    }
+
+
+# จำนวนเหตุการณ์สูงสุดต่อหนึ่ง batch
+BATCH_MAX_EVENTS = int(os.getenv("BATCH_MAX_EVENTS", "5000"))
+
+# โมเดลของเหตุการณ์การลงเวลาหนึ่งรายการใน batch
+class AttendanceEvent(BaseModel):
+    """
+    เหตุการณ์การลงเวลาหนึ่งรายการจากเครื่องอ่านบัตรหรือ kiosk
+
+    Attributes:
+        username (str): ชื่อผู้ใช้
+        password (str, optional): รหัสผ่าน (ใช้อย่างใดอย่างหนึ่งกับ token)
+        token (str, optional): session token จาก /login
+        action (str): "check_in" หรือ "check_out"
+        timestamp (datetime, optional): เวลาที่เกิดเหตุการณ์ (ไม่ระบุจะใช้เวลาปัจจุบัน)
+    """
+    username: str
+    password: Optional[str] = None
+    token: Optional[str] = None
+    action: Literal["check_in", "check_out"]
+    timestamp: Optional[datetime] = None
+
+class AttendanceBatchRequest(BaseModel):
+    """โมเดลสำหรับ request body ของการลงเวลาแบบ batch"""
+    events: List[AttendanceEvent]
+
+async def load_users(db: AsyncSession, usernames: Iterable[str]) -> Dict[str, CachedUser]:
+    """
+    ดึงข้อมูลผู้ใช้หลายคนพร้อมกัน: cache ภายใน process, MGET จาก Redis หนึ่งครั้ง และ SELECT ... IN หนึ่งครั้ง
+
+    Args:
+        db (AsyncSession): เซสชันฐานข้อมูลสำหรับการเรียกข้อมูล
+        usernames (Iterable[str]): รายชื่อผู้ใช้
+
+    Returns:
+        Dict[str, CachedUser]: ข้อมูลผู้ใช้ที่พบ โดยใช้ username เป็น key
+    """
+    users = {}
+    missing = []
+    for username in set(usernames):
+        user = user_cache.get(username)
+        if user:
+            users[username] = user
+        else:
+            missing.append(username)
+    record_cache_lookup("local", "user", True, len(users))
+    record_cache_lookup("local", "user", False, len(missing))
+
+    if missing:
+        cached = await redis_client.mget([f"user:{username}" for username in missing])
+        still_missing = []
+        for username, raw in zip(missing, cached):
+            user = decode_cached_user(raw) if raw else None
+            if user:
+                users[username] = user
+                user_cache.put(user)
+            else:
+                still_missing.append(username)
+        record_cache_lookup("redis", "user", True, len(missing) - len(still_missing))
+        record_cache_lookup("redis", "user", False, len(still_missing))
+
+        if still_missing:
+            result = await db.execute(
+                select(User.id, User.username, User.hashed_password, User.department)
+                .where(User.username.in_(still_missing))
+            )
+            pipe = redis_client.pipeline(transaction=False)
+            for row in result:
+                user = CachedUser(*row)
+                users[user.username] = user
+                user_cache.put(user)
+                cache_user(pipe, user)
+            await pipe.execute()
+    return users
+
+async def insert_check_ins(db: AsyncSession, rows: List[dict]) -> tuple:
+    """
+    เพิ่ม check_in หลายแถวด้วย INSERT ... ON CONFLICT DO NOTHING RETURNING คำสั่งเดียว (ใน savepoint)
+
+    หากฐานข้อมูลปฏิเสธบางแถว (เช่น ไม่มี partition ของวันทำงาน) จะเพิ่มทีละแถวใน savepoint ของแต่ละแถว
+    แถวอื่นจึงยังบันทึกได้ และรายงานข้อผิดพลาดเป็นรายแถว
+
+    Args:
+        db (AsyncSession): เซสชันฐานข้อมูล
+        rows (List[dict]): แถวของตาราง attendance
+
+    Returns:
+        tuple: ({(username, work_date): แถวที่เพิ่มแล้ว}, {(username, work_date): ข้อความผิดพลาด})
+    """
+    def insert_statement(statement_rows):
+        return (
+            pg_insert(Attendance)
+            .values(statement_rows)
+            .on_conflict_do_nothing(index_elements=["username", "work_date"])
+            .returning(Attendance.username, Attendance.work_date, Attendance.check_in, Attendance.status)
+        )
+
+    try:
+        async with db.begin_nested():
+            result = await db.execute(insert_statement(rows))
+            return {(row.username, row.work_date): row for row in result}, {}
+    except (IntegrityError, DataError):
+        pass
+
+    inserted, failed = {}, {}
+    for row in rows:
+        try:
+            async with db.begin_nested():
+                result = await db.execute(insert_statement([row]))
+                inserted.update({(item.username, item.work_date): item for item in result})
+        except (IntegrityError, DataError) as exc:
+            failed[(row["username"], row["work_date"])] = str(exc.orig)
+    return inserted, failed
+
+# API สำหรับบันทึกเวลาเข้า-ออกงานแบบ batch
+@app.post("/attendance/batch")
+async def attendance_batch(batch_request: AttendanceBatchRequest, db: AsyncSession = Depends(get_admitted_db)):
+    """
+    API สำหรับบันทึกเวลาเข้า-ออกงานหลายรายการในครั้งเดียว สำหรับเครื่องอ่านบัตรที่ส่งเหตุการณ์ค้างย้อนหลัง
+
+    ตรวจสอบผู้ใช้ด้วยการดึงข้อมูลแบบ batch, ตัดเหตุการณ์ซ้ำของผู้ใช้ในวันเดียวกัน
+    (check_in ใช้เวลาแรกสุด, check_out ใช้เวลาล่าสุด), บันทึก check_in ด้วย INSERT หลายแถวคำสั่งเดียว
+    และ check_out ด้วย UPDATE ... FROM (VALUES ...) คำสั่งเดียว
+    เหตุการณ์ที่บันทึกไม่ได้ (เช่น ผู้ใช้ไม่มีในตาราง users) จะรายงานเป็นรายเหตุการณ์โดยไม่กระทบเหตุการณ์อื่น
+
+    Args:
+        batch_request (AttendanceBatchRequest): รายการเหตุการณ์การลงเวลา
+        db (AsyncSession): Session ของฐานข้อมูล
+
+    Returns:
+        dict: ผลลัพธ์ของแต่ละเหตุการณ์ตามลำดับที่ส่งมา และสรุปจำนวนตามสถานะ
+        HTTPException: ส่งกลับข้อผิดพลาด 413 หากจำนวนเหตุการณ์เกิน BATCH_MAX_EVENTS
+    """
+    events = batch_request.events
+    if len(events) > BATCH_MAX_EVENTS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_EVENTS} events")
+
+    results = [
+        {"index": i, "username": event.username, "action": event.action}
+        for i, event in enumerate(events)
+    ]
+
+    # ตรวจสอบผู้ใช้: token ตรวจด้วย CPU, รหัสผ่านตรวจกับข้อมูลที่ดึงมาในครั้งเดียว
+    users = await load_users(db, [event.username for event in events if not event.token])
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    first_check_ins = {}  # (username, work_date) -> index ของ check_in ที่เร็วที่สุด
+    last_check_outs = {}  # (username, work_date) -> index ของ check_out ที่ช้าที่สุด
+    timestamps = {}
+    for i, event in enumerate(events):
+        if event.token:
+            authenticated = verify_session_token(event.token) == event.username
+        else:
+            user = users.get(event.username)
+            authenticated = bool(
+                user and event.password is not None and verify_password_sha256(event.password, user.hashed_password)
+            )
+        if not authenticated:
+            results[i]["status"] = "invalid_credentials"
+            continue
+
+        timestamp = to_utc_naive(event.timestamp) if event.timestamp else now
+        timestamps[i] = timestamp
+        if event.action == "check_in":
+            key = (event.username, attendance_work_date(event.username, timestamp))
+        else:
+            key = (event.username, check_out_work_date(event.username, timestamp))
+        if event.action == "check_in":
+            previous = first_check_ins.get(key)
+            if previous is None or timestamp < timestamps[previous]:
+                if previous is not None:
+                    results[previous]["status"] = "duplicate_in_batch"
+                first_check_ins[key] = i
+            else:
+                results[i]["status"] = "duplicate_in_batch"
+        else:
+            previous = last_check_outs.get(key)
+            if previous is None or timestamp > timestamps[previous]:
+                if previous is not None:
+                    results[previous]["status"] = "duplicate_in_batch"
+                last_check_outs[key] = i
+            else:
+                results[i]["status"] = "duplicate_in_batch"
+
+    cache_pipe = redis_client.pipeline(transaction=False)
+
+    # check_in ทั้งหมดด้วย INSERT หลายแถวคำสั่งเดียว
+    # ผู้ใช้ที่ผ่านการตรวจสอบจาก cache หรือ token อาจไม่มีในตาราง users จึงตรวจก่อนด้วย SELECT เดียว
+    if first_check_ins:
+        result = await db.execute(
+            select(User.username).where(User.username.in_({username for username, _ in first_check_ins}))
+        )
+        known_usernames = set(result.scalars())
+        rows = []
+        for (username, work_date), i in first_check_ins.items():
+            if username not in known_usernames:
+                results[i].update(status="check_in_failed", detail="User not found")
+                continue
+            status = calculate_attendance_status(timestamps[i], username=username, work_date=work_date)
+            rows.append({"username": username, "work_date": work_date, "check_in": timestamps[i], "status": status.value})
+        await ensure_partitions_for(row["work_date"] for row in rows)
+        inserted, failed = await insert_check_ins(db, rows) if rows else ({}, {})
+        for key, i in first_check_ins.items():
+            if key in failed:
+                results[i].update(status="check_in_failed", detail=failed[key])
+                continue
+            row = inserted.get(key)
+            if row is None:
+                if "status" not in results[i]:
+                    results[i]["status"] = "already_checked_in"
+                continue
+            local_check_in_time = utc_naive_to_local(row.check_in).isoformat()
+            results[i].update(status="Check-in successful", check_in=local_check_in_time, attendance_status=row.status)
+            cache_pipe.set(
+                attendance_cache_key("checkin", row.username, row.work_date),
+                encode_attendance_cache(local_check_in_time, row.status),
+                exat=attendance_cache_expiry(row.work_date)
+            )
+            await mark_present(cache_pipe, row.username, row.work_date)
+            mark_summary_dirty(cache_pipe, row.work_date)
+            await publish_attendance_event(
+                cache_pipe, "checkin", row.username, row.work_date, local_check_in_time, row.status
+            )
+
+    # check_out ทั้งหมดด้วย UPDATE ... FROM (VALUES ...) คำสั่งเดียว
+    if last_check_outs:
+        if WRITE_BEHIND_ENABLED:
+            # check_in ของผู้ใช้เหล่านี้อาจยังค้างอยู่ในคิว write-behind
+            await persist_pending_check_ins(db, [
+                (username, work_date - timedelta(days=days))
+                for username, work_date in last_check_outs for days in (0, 1)
+            ])
+        check_outs = values(
+            column("username", String),
+            column("work_date", Date),
+            column("check_out", DateTime),
+            column("early_leave", Boolean),
+            column("shift_start", Numeric),
+            name="check_outs"
+        ).data([
+            (
+                username,
+                work_date,
+                timestamps[i],
+                is_early_leave(username, timestamps[i]),
+                shift_schedule.start_seconds[shift_schedule.shift_index(username)]
+            )
+            for (username, work_date), i in last_check_outs.items()
+        ])
+        earliest_work_date = min(work_date for _, work_date in last_check_outs) - timedelta(days=CHECK_OUT_LOOKBACK_DAYS)
+        # แถวเป้าหมายของแต่ละ check_out: การลงเวลาเข้าล่าสุดของผู้ใช้ที่อยู่ก่อนเวลาออก และไม่เกินวันทำงานของ check_out
+        # (check_out ของหลายวันในชุดเดียวกันจึงไม่ไปตกที่แถวของวันหลังสุดทั้งหมด)
+        latest = aliased(Attendance)
+        target_id = (
+            select(latest.id)
+            .where(latest.username == check_outs.c.username)
+            .where(latest.work_date <= check_outs.c.work_date)
+            .where(latest.work_date >= check_outs.c.work_date - CHECK_OUT_LOOKBACK_DAYS)
+            .where(latest.work_date >= earliest_work_date)
+            .where(latest.check_in < check_outs.c.check_out)
+            .order_by(latest.id.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        targets = select(check_outs, target_id.label("attendance_id")).subquery()
+        # หาก check_out หลายรายการได้แถวเป้าหมายเดียวกัน ใช้รายการที่ช้าที่สุด ผลลัพธ์ของ UPDATE จึงแน่นอน
+        chosen = (
+            select(targets)
+            .where(targets.c.attendance_id.is_not(None))
+            .distinct(targets.c.attendance_id)
+            .order_by(targets.c.attendance_id, targets.c.check_out.desc())
+            .subquery()
+        )
+        status_expr = holiday_status_expression(
+            case(
+                (chosen.c.early_leave, AttendanceStatus.EARLY_LEAVE.value),
+                else_=late_status_expression(chosen.c.shift_start)
+            ),
+            (timestamps[i] for i in last_check_outs.values())
+        )
+        result = await db.execute(
+            update(Attendance)
+            .where(Attendance.id == chosen.c.attendance_id)
+            .where(Attendance.work_date >= earliest_work_date)
+            .values(check_out=chosen.c.check_out, status=status_expr)
+            .returning(Attendance.username, Attendance.check_out, Attendance.status, Attendance.work_date)
+        )
+        updated = {}
+        for row in result:
+            updated[(row.username, row.check_out)] = row
+        for (username, _), i in last_check_outs.items():
+            row = updated.get((username, timestamps[i]))
+            if row is None:
+                results[i].update(
+                    status="check_out_failed",
+                    detail="Check-in not found, check-out before check-in, or a later check-out in the batch "
+                           "matched the same check-in"
+                )
+                continue
+            local_check_out_time = utc_naive_to_local(row.check_out).isoformat()
+            results[i].update(status="Check-out successful", check_out=local_check_out_time, attendance_status=row.status)
+            check_out_date = check_out_work_date(row.username, row.check_out)
+            cache_pipe.set(
+                attendance_cache_key("checkout", row.username, check_out_date),
+                encode_attendance_cache(local_check_out_time, row.status),
+                exat=attendance_cache_expiry(check_out_date)
+            )
+            mark_summary_dirty(cache_pipe, row.work_date)
+            await publish_attendance_event(
+                cache_pipe, "checkout", row.username, row.work_date, local_check_out_time, row.status
+            )
+
+    await db.commit()
+    await cache_pipe.execute()
+
+    summary = {}
+    for result_item in results:
+        summary[result_item["status"]] = summary.get(result_item["status"], 0) + 1
+    return {"results": results, "summary": summary}
+
+
+# API สำหรับนับจำนวนคนที่เข้างานแล้ว
+@app.get("/attendance/headcount")
+async def attendance_headcount(work_date: Optional[date] = None, department: Optional[str] = None):
+    """
+    API สำหรับนับจำนวนคนที่ลงเวลาเข้างานแล้วในวันทำงาน ด้วย BITCOUNT บน bitmap รายวัน (ไม่ต้อง scan ฐานข้อมูล)
+
+    Args:
+        work_date (date, optional): วันทำงาน (ไม่ระบุจะใช้วันนี้ตามเวลาท้องถิ่น)
+        department (str, optional): ฝ่ายที่ต้องการนับ (ไม่ระบุจะนับทั้งหมด)
+
+    Returns:
+        dict: วันทำงาน ฝ่าย และจำนวนคนที่เข้างาน
+    """
+    work_date = work_date or local_work_date(datetime.now(timezone.utc).replace(tzinfo=None))
+    headcount = await redis_client.bitcount(presence_key(work_date, department))
+    return {"work_date": work_date.isoformat(), "department": department, "headcount": headcount}
+
+# API สำหรับตรวจสอบว่าผู้ใช้เข้างานแล้วหรือไม่
+@app.get("/attendance/presence/{username}")
+async def attendance_presence(username: str, work_date: Optional[date] = None):
+    """
+    API สำหรับตรวจสอบว่าผู้ใช้ลงเวลาเข้างานในวันทำงานแล้วหรือไม่ ด้วย GETBIT (O(1))
+
+    Args:
+        username (str): ชื่อผู้ใช้
+        work_date (date, optional): วันทำงาน (ไม่ระบุจะใช้วันนี้ตามเวลาท้องถิ่น)
+
+    Returns:
+        dict: ชื่อผู้ใช้ วันทำงาน และสถานะการเข้างาน
+    """
+    work_date = work_date or local_work_date(datetime.now(timezone.utc).replace(tzinfo=None))
+    return {
+        "username": username,
+        "work_date": work_date.isoformat(),
+        "checked_in": await is_checked_in(username, work_date)
+    }
+
+
+# การกระจายเหตุการณ์ลงเวลาไปยังหน้าจอติดตาม (Server-Sent Events)
+EVENT_STREAM_COALESCE_MS = int(os.getenv("EVENT_STREAM_COALESCE_MS", "250"))  # รวมเหตุการณ์ในช่วงนี้เป็นข้อความเดียว
+EVENT_STREAM_HEARTBEAT = float(os.getenv("EVENT_STREAM_HEARTBEAT", "15"))  # ส่ง keep-alive เมื่อไม่มีเหตุการณ์ (วินาที)
+EVENT_STREAM_RETRY_MS = int(os.getenv("EVENT_STREAM_RETRY_MS", "3000"))  # เวลาที่ browser รอก่อนเชื่อมต่อใหม่
+EVENT_STREAM_CLIENT_BUFFER = int(os.getenv("EVENT_STREAM_CLIENT_BUFFER", "10000"))  # เหตุการณ์ค้างส่งสูงสุดต่อ client
+EVENT_STREAM_REPLAY_LIMIT = int(os.getenv("EVENT_STREAM_REPLAY_LIMIT", "10000"))  # เหตุการณ์ย้อนหลังสูงสุดตอนเชื่อมต่อใหม่
+EVENT_STREAM_READ_COUNT = 500  # จำนวนเหตุการณ์ต่อหนึ่ง XREAD/XRANGE
+EVENT_STREAM_BLOCK_MS = 5000
+
+def stream_id_key(stream_id: str) -> tuple:
+    """แปลง ID ของ Redis stream ("ms-seq") เป็น tuple สำหรับเปรียบเทียบลำดับ (ValueError หากรูปแบบไม่ถูกต้อง)"""
+    milliseconds, sequence = stream_id.split("-")
+    return int(milliseconds), int(sequence)
+
+def decode_stream_event(entry_id: bytes, fields: dict) -> dict:
+    """แปลงรายการจาก stream เป็น dict ของเหตุการณ์"""
+    event = {key.decode(): value.decode() for key, value in fields.items()}
+    event["id"] = entry_id.decode()
+    return event
+
+class AttendanceEventSubscription:
+    """
+    การติดตามเหตุการณ์ของ client หนึ่งราย
+
+    เหตุการณ์ที่รอส่งถูกรวม (coalesce) ตาม (ผู้ใช้, ประเภท) โดยเก็บเฉพาะเหตุการณ์ล่าสุด
+    จำนวนที่ค้างจึงไม่เกินจำนวนผู้ใช้ แม้ client จะอ่านช้า
+    """
+
+    def __init__(self, department: Optional[str], limit: int):
+        self.department = department
+        self.limit = limit
+        self.pending: "OrderedDict[tuple, dict]" = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.overflowed = False
+
+    def push(self, event: dict):
+        """เพิ่มเหตุการณ์ที่ผ่านตัวกรองฝ่าย (แทนที่เหตุการณ์เก่ากว่าของผู้ใช้และประเภทเดียวกัน)"""
+        if self.department is not None and event["department"] != self.department:
+            return
+        key = (event["username"], event["kind"])
+        previous = self.pending.get(key)
+        if previous is not None:
+            if stream_id_key(previous["id"]) >= stream_id_key(event["id"]):
+                return
+            del self.pending[key]
+        self.pending[key] = event
+        if len(self.pending) > self.limit:
+            self.overflowed = True
+        self.wakeup.set()
+
+    def drain(self) -> List[dict]:
+        """คืนค่าและล้างเหตุการณ์ที่รอส่ง"""
+        events = list(self.pending.values())
+        self.pending.clear()
+        self.wakeup.clear()
+        return events
+
+class AttendanceEventBroadcaster:
+    """
+    อ่าน stream ของเหตุการณ์ด้วย XREAD เพียงหนึ่งการเชื่อมต่อต่อ worker แล้วกระจายให้ทุก client ใน process
+
+    จะอ่าน stream เฉพาะเมื่อมี client ติดตามอยู่ และเริ่มจากเหตุการณ์ใหม่ทุกครั้งที่กลับมามี client
+    (client ที่ต้องการเหตุการณ์ที่พลาดไปจะอ่านย้อนหลังเองด้วย Last-Event-ID)
+    """
+
+    def __init__(self, client_buffer: int):
+        self.client_buffer = client_buffer
+        self._subscriptions = set()
+        self._has_subscriptions = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self, department: Optional[str] = None) -> AttendanceEventSubscription:
+        subscription = AttendanceEventSubscription(department, self.client_buffer)
+        self._subscriptions.add(subscription)
+        self._has_subscriptions.set()
+        return subscription
+
+    def unsubscribe(self, subscription: AttendanceEventSubscription):
+        self._subscriptions.discard(subscription)
+        if not self._subscriptions:
+            self._has_subscriptions.clear()
+
+    async def run(self):
+        """Background task ที่อ่าน stream แล้วส่งเหตุการณ์ให้ทุก subscription"""
+        last_id = "$"
+        while True:
+            if not self._subscriptions:
+                last_id = "$"
+                await self._has_subscriptions.wait()
+            try:
+                response = await redis_client.xread(
+                    {ATTENDANCE_EVENTS_STREAM: last_id}, count=EVENT_STREAM_READ_COUNT, block=EVENT_STREAM_BLOCK_MS
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logging.error("Attendance event reader error: %s", exc)
+                await asyncio.sleep(1)
+                continue
+            for _, entries in response or ():
+                for entry_id, fields in entries:
+                    last_id = entry_id.decode()
+                    event = decode_stream_event(entry_id, fields)
+                    for subscription in list(self._subscriptions):
+                        subscription.push(event)
+
+attendance_events = AttendanceEventBroadcaster(EVENT_STREAM_CLIENT_BUFFER)
+REGISTRY.gauge("attendance_event_subscribers", "Dashboard clients subscribed to attendance events.",
+               function=lambda: len(attendance_events))
+event_stream_overflows = REGISTRY.counter(
+    "attendance_event_overflows_total", "Event stream clients disconnected because they fell too far behind."
+)
+
+async def replay_attendance_events(subscription: AttendanceEventSubscription, last_event_id: str) -> bool:
+    """
+    อ่านเหตุการณ์หลัง last_event_id จาก stream เข้าสู่ subscription
+
+    Returns:
+        bool: False หากเหตุการณ์บางส่วนหายไปแล้ว (ถูกตัดออกจาก stream หรือเกิน EVENT_STREAM_REPLAY_LIMIT)
+    """
+    oldest = await redis_client.xrange(ATTENDANCE_EVENTS_STREAM, "-", "+", count=1)
+    complete = not oldest or stream_id_key(oldest[0][0].decode()) <= stream_id_key(last_event_id)
+    replayed = 0
+    start = f"({last_event_id}"
+    while replayed < EVENT_STREAM_REPLAY_LIMIT:
+        entries = await redis_client.xrange(ATTENDANCE_EVENTS_STREAM, start, "+", count=EVENT_STREAM_READ_COUNT)
+        for entry_id, fields in entries:
+            subscription.push(decode_stream_event(entry_id, fields))
+        replayed += len(entries)
+        if len(entries) < EVENT_STREAM_READ_COUNT:
+            return complete
+        start = f"({entries[-1][0].decode()}"
+    return False
+
+def format_sse(event: str, data: bytes, event_id: Optional[str] = None) -> bytes:
+    """สร้างข้อความหนึ่งข้อความตามรูปแบบ Server-Sent Events"""
+    message = b"id: %s\n" % event_id.encode() if event_id else b""
+    return message + b"event: %s\ndata: %s\n\n" % (event.encode(), data)
+
+async def attendance_event_source(subscription: AttendanceEventSubscription, replay_complete: bool):
+    """สร้างข้อความ SSE จาก subscription: รวมเหตุการณ์ทุก EVENT_STREAM_COALESCE_MS และส่ง keep-alive เมื่อว่าง"""
+    try:
+        yield b"retry: %d\n\n" % EVENT_STREAM_RETRY_MS
+        if not replay_complete:
+            # แจ้งให้หน้าจอโหลดข้อมูลทั้งหมดใหม่ (เช่นจาก /attendance/headcount) เพราะเหตุการณ์บางส่วนหายไป
+            yield format_sse("reset", b"{}")
+        while True:
+            if not subscription.pending:
+                try:
+                    await asyncio.wait_for(subscription.wakeup.wait(), timeout=EVENT_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                await asyncio.sleep(EVENT_STREAM_COALESCE_MS / 1000)
+            if subscription.overflowed:
+                # client อ่านไม่ทัน: ปิดการเชื่อมต่อให้ browser เชื่อมต่อใหม่และอ่านย้อนหลังด้วย Last-Event-ID
+                event_stream_overflows.inc()
+                break
+            events = subscription.drain()
+            if events:
+                last_id = max(events, key=lambda event: stream_id_key(event["id"]))["id"]
+                yield format_sse("attendance", dumps_json(events), last_id)
+    finally:
+        attendance_events.unsubscribe(subscription)
+
+# API สำหรับติดตามเหตุการณ์ลงเวลาแบบเรียลไทม์
+@app.get("/attendance/events")
+async def attendance_event_stream(request: Request, department: Optional[str] = None, last_event_id: Optional[str] = None):
+    """
+    API แบบ Server-Sent Events สำหรับหน้าจอติดตามการลงเวลา แทนการ poll ฐานข้อมูล
+
+    แต่ละข้อความ (event: attendance) เป็น JSON array ของเหตุการณ์ที่รวมไว้ในช่วง EVENT_STREAM_COALESCE_MS
+    โดยเก็บเฉพาะเหตุการณ์ล่าสุดของแต่ละผู้ใช้และประเภท และมี id สำหรับเชื่อมต่อใหม่ต่อจากเดิม
+
+    Args:
+        request (Request): ใช้อ่าน header Last-Event-ID ที่ browser ส่งมาเมื่อเชื่อมต่อใหม่
+        department (str, optional): รับเฉพาะเหตุการณ์ของฝ่ายนี้
+        last_event_id (str, optional): ID ของเหตุการณ์ล่าสุดที่ได้รับ (ใช้แทน header ได้)
+
+    Returns:
+        StreamingResponse: stream แบบ text/event-stream
+    """
+    last_event_id = request.headers.get("last-event-id") or last_event_id
+    if last_event_id:
+        try:
+            stream_id_key(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+
+    # ติดตามก่อนอ่านย้อนหลัง เพื่อไม่พลาดเหตุการณ์ที่เกิดระหว่างนั้น (เหตุการณ์ซ้ำจะถูกรวมด้วย ID)
+    subscription = attendance_events.subscribe(department)
+    try:
+        replay_complete = await replay_attendance_events(subscription, last_event_id) if last_event_id else True
+    except Exception:
+        attendance_events.unsubscribe(subscription)
+        raise
+    return StreamingResponse(
+        attendance_event_source(subscription, replay_complete),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# การปรับปรุงตารางสรุปสำหรับรายงาน
+SUMMARY_REFRESH_INTERVAL = float(os.getenv("SUMMARY_REFRESH_INTERVAL", "30"))  # วินาที
+SUMMARY_REFRESH_BATCH = int(os.getenv("SUMMARY_REFRESH_BATCH", "31"))  # จำนวนวันทำงานต่อรอบ
+# วันทำงานล่าสุดที่ตรวจหาข้อมูลที่ยังไม่มีในตารางสรุปแล้ว (high-water mark) และ lock กันหลาย worker ตรวจพร้อมกัน
+SUMMARY_BACKFILL_MARK_KEY = "attendance:summary:backfilled_through"
+SUMMARY_BACKFILL_LOCK_KEY = "attendance:summary:backfill_lock"
+SUMMARY_BACKFILL_LOOKBACK_DAYS = int(os.getenv("SUMMARY_BACKFILL_LOOKBACK_DAYS", "7"))  # ตรวจย้อนหลังจาก mark กี่วัน
+
+def status_count_columns(status_column) -> list:
+    """คืนค่า aggregate นับจำนวนแถวแยกตามสถานะ (normal, late, early_leave, total)"""
+    return [
+        func.count().filter(status_column == AttendanceStatus.NORMAL.value),
+        func.count().filter(status_column == AttendanceStatus.LATE.value),
+        func.count().filter(status_column == AttendanceStatus.EARLY_LEAVE.value),
+        func.count(),
+    ]
+
+def upsert_summary(table, select_statement, key_columns: List[str]):
+    """สร้างคำสั่ง INSERT ... SELECT ... ON CONFLICT DO UPDATE สำหรับตารางสรุป"""
+    columns = [c.name for c in table.__table__.columns]
+    statement = pg_insert(table).from_select(columns, select_statement)
+    return statement.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={name: statement.excluded[name] for name in columns if name not in key_columns}
+    )
+
+async def refresh_attendance_summaries(work_dates: Iterable[date]):
+    """
+    คำนวณตารางสรุปใหม่เฉพาะวันทำงานที่กำหนด (delta refresh)
+
+    สรุปรายวันคำนวณใหม่ทั้งวัน ส่วนสรุปรายเดือนคำนวณใหม่เฉพาะพนักงานที่มีการลงเวลาในวันเหล่านั้น
+    ทุกคำสั่งกรองด้วย work_date จึงแตะเฉพาะ partition ของเดือนที่เกี่ยวข้อง
+
+    Args:
+        work_dates (Iterable[date]): วันทำงานที่ต้องปรับปรุง
+    """
+    work_dates = sorted(set(work_dates))
+    department = func.coalesce(User.department, "")
+    async with engine.begin() as conn:
+        # ลบแถวเดิมของวันก่อน เพื่อให้ฝ่ายที่ไม่มีการลงเวลาแล้วหายไปจากสรุป
+        await conn.execute(
+            AttendanceDailySummary.__table__.delete().where(AttendanceDailySummary.work_date.in_(work_dates))
+        )
+        await conn.execute(upsert_summary(
+            AttendanceDailySummary,
+            select(Attendance.work_date, department, *status_count_columns(Attendance.status))
+            .join(User, User.username == Attendance.username)
+            .where(Attendance.work_date.in_(work_dates))
+            .group_by(Attendance.work_date, department),
+            ["work_date", "department"]
+        ))
+
+        months = {}
+        for work_date in work_dates:
+            months.setdefault(month_start(work_date), []).append(work_date)
+        for month, dates_in_month in months.items():
+            touched_users = select(Attendance.username).where(Attendance.work_date.in_(dates_in_month))
+            await conn.execute(upsert_summary(
+                AttendanceMonthlySummary,
+                select(
+                    literal(month, Date), Attendance.username, func.max(User.department),
+                    *status_count_columns(Attendance.status)
+                )
+                .join(User, User.username == Attendance.username)
+                .where(Attendance.work_date >= month, Attendance.work_date < month_start(month, 1))
+                .where(Attendance.username.in_(touched_users))
+                .group_by(Attendance.username),
+                ["month", "username"]
+            ))
+
+async def refresh_dirty_summaries() -> int:
+    """
+    ดึงวันทำงานที่มีการเปลี่ยนแปลงจาก Redis (SPOP) แล้วปรับปรุงตารางสรุป
+
+    หากปรับปรุงไม่สำเร็จ วันทำงานจะถูกคืนกลับเข้าชุดเพื่อลองใหม่รอบถัดไป
+
+    Returns:
+        int: จำนวนวันทำงานที่ปรับปรุงสำเร็จ
+    """
+    refreshed = 0
+    while True:
+        raw_dates = await redis_client.spop(SUMMARY_DIRTY_KEY, SUMMARY_REFRESH_BATCH)
+        if not raw_dates:
+            break
+        try:
+            await refresh_attendance_summaries(date.fromisoformat(raw.decode()) for raw in raw_dates)
+        except Exception as exc:
+            logging.error("Summary refresh of %d work dates failed: %s", len(raw_dates), exc)
+            await redis_client.sadd(SUMMARY_DIRTY_KEY, *raw_dates)
+            break
+        refreshed += len(raw_dates)
+        if len(raw_dates) < SUMMARY_REFRESH_BATCH:
+            break
+    return refreshed
+
+async def mark_unsummarized_dates_dirty():
+    """
+    ทำเครื่องหมายวันทำงานที่มีข้อมูลการลงเวลาแต่ยังไม่มีในตารางสรุป
+
+    ตรวจทั้งตารางเฉพาะครั้งแรกหลังเพิ่มตารางสรุป (ยังไม่มี high-water mark ใน Redis)
+    ครั้งต่อไปตรวจเฉพาะวันทำงานตั้งแต่ mark ย้อนไป SUMMARY_BACKFILL_LOOKBACK_DAYS วัน
+    (เงื่อนไข work_date ทำให้แตะเฉพาะ partition ล่าสุด) เพราะการลงเวลาทุกเส้นทางทำเครื่องหมายวันที่เปลี่ยนไว้แล้ว
+    ใช้ lock ใน Redis ให้ตรวจเพียง worker เดียวเมื่อหลาย worker เริ่มพร้อมกัน
+    """
+    if not await redis_client.set(SUMMARY_BACKFILL_LOCK_KEY, "1", nx=True, ex=600):
+        return
+    try:
+        today = local_work_date(to_utc_naive(None))
+        query = (
+            select(Attendance.work_date).distinct()
+            .where(~exists().where(AttendanceDailySummary.work_date == Attendance.work_date))
+        )
+        raw_mark = await redis_client.get(SUMMARY_BACKFILL_MARK_KEY)
+        if raw_mark:
+            since = date.fromisoformat(raw_mark.decode()) - timedelta(days=SUMMARY_BACKFILL_LOOKBACK_DAYS)
+            query = query.where(Attendance.work_date >= since)
+        async with SessionLocal() as db:
+            result = await db.execute(query)
+            work_dates = [row[0].isoformat() for row in result]
+        if work_dates:
+            await redis_client.sadd(SUMMARY_DIRTY_KEY, *work_dates)
+            logging.info("Queued %d work dates for summary backfill", len(work_dates))
+        await redis_client.set(SUMMARY_BACKFILL_MARK_KEY, today.isoformat())
+    finally:
+        await redis_client.delete(SUMMARY_BACKFILL_LOCK_KEY)
+
+async def run_summary_refresher():
+    """Background task ที่ปรับปรุงตารางสรุปจากวันทำงานที่เปลี่ยนแปลงทุก SUMMARY_REFRESH_INTERVAL วินาที"""
+    await startup_complete.wait()  # รอให้ตารางสรุปถูกสร้างก่อน
+    try:
+        await mark_unsummarized_dates_dirty()
+    except Exception as exc:
+        logging.error("Summary backfill scan failed: %s", exc)
+    while True:
+        try:
+            await refresh_dirty_summaries()
+        except Exception as exc:
+            logging.error("Summary refresher error: %s", exc)
+        await asyncio.sleep(SUMMARY_REFRESH_INTERVAL)
+
+def parse_report_month(month: Optional[str]) -> date:
+    """แปลงพารามิเตอร์เดือนรูปแบบ YYYY-MM เป็นวันแรกของเดือน (ไม่ระบุจะใช้เดือนปัจจุบันตามเวลาท้องถิ่น)"""
+    if month is None:
+        return month_start(local_work_date(datetime.now(timezone.utc).replace(tzinfo=None)))
+    try:
+        return datetime.strptime(month, "%Y-%m").date()
+    except ValueError:
+        raise HTTPException(status_code=422, detail="month must be in YYYY-MM format")
+
+def summary_counts(row) -> dict:
+    """แปลงแถวสรุปเป็น dict จำนวนการลงเวลาแยกตามสถานะ (None = ไม่มีข้อมูล)"""
+    if row is None:
+        return dict.fromkeys([status.value for status in AttendanceStatus] + ["total"], 0)
+    return {
+        AttendanceStatus.NORMAL.value: row.normal or 0,
+        AttendanceStatus.LATE.value: row.late or 0,
+        AttendanceStatus.EARLY_LEAVE.value: row.early_leave or 0,
+        "total": row.total or 0
+    }
+
+# API รายงานสรุปรายพนักงาน
+@app.get("/reports/employee/{username}")
+async def employee_report(username: str, month: Optional[str] = None, db: AsyncSession = Depends(get_admitted_db)):
+    """
+    API สำหรับดูสรุปการลงเวลารายเดือนของพนักงาน (อ่านจากตารางสรุป ไม่ scan ตาราง attendance)
+
+    Args:
+        username (str): ชื่อผู้ใช้
+        month (str, optional): เดือนรูปแบบ YYYY-MM (ไม่ระบุจะใช้เดือนปัจจุบัน)
+
+    Returns:
+        dict: ชื่อผู้ใช้ เดือน ฝ่าย และจำนวนการลงเวลาแยกตามสถานะ
+    """
+    month_date = parse_report_month(month)
+    result = await db.execute(
+        select(AttendanceMonthlySummary)
+        .where(AttendanceMonthlySummary.month == month_date, AttendanceMonthlySummary.username == username)
+    )
+    summary = result.scalar_one_or_none()
+    return {
+        "username": username,
+        "month": month_date.strftime("%Y-%m"),
+        "department": summary.department if summary else None,
+        "counts": summary_counts(summary)
+    }
+
+# API รายงานสรุปรายฝ่าย
+@app.get("/reports/department")
+async def department_report(month: Optional[str] = None, department: Optional[str] = None, db: AsyncSession = Depends(get_admitted_db)):
+    """
+    API สำหรับดูสรุปการลงเวลารายเดือนแยกตามฝ่าย (รวมจากตารางสรุปรายวัน)
+
+    Args:
+        month (str, optional): เดือนรูปแบบ YYYY-MM (ไม่ระบุจะใช้เดือนปัจจุบัน)
+        department (str, optional): ฝ่ายที่ต้องการ (ไม่ระบุจะแสดงทุกฝ่าย)
+
+    Returns:
+        dict: เดือน และจำนวนการลงเวลาแยกตามสถานะของแต่ละฝ่าย
+    """
+    month_date = parse_report_month(month)
+    statement = (
+        select(
+            AttendanceDailySummary.department,
+            func.sum(AttendanceDailySummary.normal).label("normal"),
+            func.sum(AttendanceDailySummary.late).label("late"),
+            func.sum(AttendanceDailySummary.early_leave).label("early_leave"),
+            func.sum(AttendanceDailySummary.total).label("total")
+        )
+        .where(AttendanceDailySummary.work_date >= month_date)
+        .where(AttendanceDailySummary.work_date < month_start(month_date, 1))
+        .group_by(AttendanceDailySummary.department)
+        .order_by(AttendanceDailySummary.department)
+    )
+    if department is not None:
+        statement = statement.where(AttendanceDailySummary.department == department)
+    result = await db.execute(statement)
+    return {
+        "month": month_date.strftime("%Y-%m"),
+        "departments": [
+            {"department": row.department or None, "counts": summary_counts(row)} for row in result
+        ]
+    }
+
+# API รายงานสรุปรายวัน
+@app.get("/reports/daily")
+async def daily_report(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    department: Optional[str] = None,
+    db: AsyncSession = Depends(get_admitted_db)
+):
+    """
+    API สำหรับดูสรุปการลงเวลารายวัน (รวมทุกฝ่าย หรือเฉพาะฝ่ายที่ระบุ)
+
+    Args:
+        start_date (date, optional): วันแรก (ไม่ระบุจะใช้วันแรกของเดือนปัจจุบัน)
+        end_date (date, optional): วันสุดท้าย (ไม่ระบุจะใช้วันนี้)
+        department (str, optional): ฝ่ายที่ต้องการ (ไม่ระบุจะรวมทุกฝ่าย)
+
+    Returns:
+        dict: ช่วงวันที่ และจำนวนการลงเวลาแยกตามสถานะของแต่ละวัน
+    """
+    end_date = end_date or local_work_date(datetime.now(timezone.utc).replace(tzinfo=None))
+    start_date = start_date or month_start(end_date)
+    statement = (
+        select(
+            AttendanceDailySummary.work_date,
+            func.sum(AttendanceDailySummary.normal).label("normal"),
+            func.sum(AttendanceDailySummary.late).label("late"),
+            func.sum(AttendanceDailySummary.early_leave).label("early_leave"),
+            func.sum(AttendanceDailySummary.total).label("total")
+        )
+        .where(AttendanceDailySummary.work_date.between(start_date, end_date))
+        .group_by(AttendanceDailySummary.work_date)
+        .order_by(AttendanceDailySummary.work_date)
+    )
+    if department is not None:
+        statement = statement.where(AttendanceDailySummary.department == department)
+    result = await db.execute(statement)
+    return {
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "department": department,
+        "days": [{"work_date": row.work_date.isoformat(), "counts": summary_counts(row)} for row in result]
     }
 
 
 if __name__ == "__main__":
     import uvicorn
-    preload_users_to_redis()
-    print("Preloaded all users to Redis")
+    # การ preload ผู้ใช้ลง Redis ย้ายไปทำใน lifespan ของแอปแล้ว
     uvicorn.run(app, host="127.0.0.1", port=2000)
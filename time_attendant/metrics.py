@@ -0,0 +1,201 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# ช่วงของ histogram ตั้งต้น (วินาที) ครอบคลุมตั้งแต่ cache hit ไปจนถึงการรอ connection pool
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames: Tuple[str, ...], labelvalues: Tuple[str, ...], extra: str = "") -> str:
+    """สร้างส่วน {label="value"} ของบรรทัด metric ตามรูปแบบข้อความของ Prometheus"""
+    pairs = [
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(labelnames, labelvalues)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """แปลงค่าตัวเลขเป็นข้อความ (จำนวนเต็มไม่แสดงทศนิยม)"""
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    """
+    คลาสพื้นฐานของ metric ที่มี label
+
+    ค่าแต่ละชุด label เก็บใน dict โดยใช้ tuple ของค่า label เป็น key
+    การอัปเดตทำใน event loop เดียวจึงไม่ต้องใช้ lock
+    หากกำหนด function (เฉพาะ metric ที่ไม่มี label) ค่าจะถูกอ่านจาก function ตอน render
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), function: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def _key(self, labelvalues: Tuple[str, ...]) -> Tuple[str, ...]:
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(value) for value in labelvalues)
+
+    def samples(self) -> List[str]:
+        """คืนค่าบรรทัดตัวอย่างของ metric นี้"""
+        if self.function is not None:
+            self._values[()] = self.function()
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+    def render(self) -> List[str]:
+        """คืนค่าบรรทัด HELP, TYPE และตัวอย่างทั้งหมดของ metric นี้"""
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+
+class Counter(Metric):
+    """ตัวนับที่เพิ่มขึ้นอย่างเดียว"""
+    kind = "counter"
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        """เพิ่มค่าตัวนับของชุด label ที่กำหนด"""
+        key = self._key(labelvalues)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """ค่าที่เพิ่มหรือลดได้"""
+    kind = "gauge"
+
+    def set(self, value: float, *labelvalues: str):
+        """กำหนดค่าของชุด label ที่กำหนด"""
+        self._values[self._key(labelvalues)] = value
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        """เพิ่มค่าของชุด label ที่กำหนด"""
+        key = self._key(labelvalues)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labelvalues: str, amount: float = 1):
+        """ลดค่าของชุด label ที่กำหนด"""
+        self.inc(*labelvalues, amount=-amount)
+
+
+class Histogram(Metric):
+    """การกระจายของค่าที่สังเกตได้ (เช่น latency) แบ่งตามช่วง bucket"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [จำนวนต่อ bucket (ไม่สะสม) ..., จำนวนที่เกิน bucket สุดท้าย, ผลรวม]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labelvalues: str):
+        """บันทึกค่าที่สังเกตได้หนึ่งค่า"""
+        key = self._key(labelvalues)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues: str):
+        """context manager สำหรับจับเวลาบล็อกโค้ดแล้วบันทึกเป็นวินาที"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % _format_value(bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """ทะเบียนของ metric ทั้งหมด สำหรับ render เป็นข้อความรูปแบบ Prometheus"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """ลงทะเบียน metric (ชื่อต้องไม่ซ้ำ)"""
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = (), function: Optional[Callable[[], float]] = None) -> Counter:
+        return self.register(Counter(name, documentation, labelnames, function))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = (), function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """คืนค่าข้อความของ metric ทั้งหมด (text exposition format 0.0.4)"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# ทะเบียนตั้งต้นของโปรเซส
+REGISTRY = Registry()
+
+# เวลาที่ใช้ในแต่ละส่วนของ request ปัจจุบัน (ชื่อส่วน -> วินาที) สำหรับ header Server-Timing
+# เก็บเป็น dict ที่แก้ไขได้ เพื่อให้ task และ greenlet ที่สืบทอด context เดียวกันเขียนลง dict เดียวกัน
+_request_phases: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_phases", default=None)
+
+
+def start_request_timing() -> Dict[str, float]:
+    """เริ่มเก็บเวลาแยกตามส่วนสำหรับ request ปัจจุบัน"""
+    phases: Dict[str, float] = {}
+    _request_phases.set(phases)
+    return phases
+
+
+def record_phase(name: str, seconds: float):
+    """บวกเวลาที่ใช้ในส่วนที่กำหนดเข้ากับ request ปัจจุบัน (ไม่ทำอะไรหากไม่ได้เริ่มเก็บเวลา)"""
+    phases = _request_phases.get()
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name: str):
+    """context manager สำหรับจับเวลาบล็อกโค้ดเป็นส่วนหนึ่งของ request ปัจจุบัน"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - started)
+
+
+def server_timing_header(phases: Dict[str, float], total: float) -> str:
+    """สร้างค่า header Server-Timing (หน่วยมิลลิวินาที) จากเวลาของแต่ละส่วน"""
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in phases.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
@@ -0,0 +1,266 @@
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+import json
+from typing import Dict, Iterable, List, Optional
+
+# รหัสสถานะการลงเวลา (ใช้แทน Enum เพื่อให้คำนวณแบบ vectorized ได้)
+STATUS_NORMAL = 0
+STATUS_LATE = 1
+STATUS_EARLY_LEAVE = 2
+
+SECONDS_PER_DAY = 86400
+# ช่วงเวลาหลังเริ่มกะที่นับว่า "สาย" และช่วงก่อนเลิกกะที่นับว่า "ออกก่อน" (ครึ่งวัน)
+# ทำให้กะข้ามคืนเทียบเวลาได้ด้วยการหารเอาเศษ 86400 เพียงครั้งเดียว
+STATUS_WINDOW_SECONDS = SECONDS_PER_DAY // 2
+
+
+def seconds_of_day(value: datetime) -> float:
+    """คืนค่าจำนวนวินาทีนับจากเที่ยงคืนของเวลาที่กำหนด"""
+    return value.hour * 3600 + value.minute * 60 + value.second + value.microsecond / 1_000_000
+
+
+def parse_time(value: str) -> time:
+    """แปลงข้อความรูปแบบ HH:MM เป็น time"""
+    return datetime.strptime(value, "%H:%M").time()
+
+
+@dataclass(frozen=True)
+class Shift:
+    """
+    กะการทำงานหนึ่งกะ
+
+    Attributes:
+        name (str): ชื่อกะ
+        start (time): เวลาเริ่มกะ
+        end (time): เวลาเลิกกะ (หากน้อยกว่าหรือเท่ากับเวลาเริ่ม ถือเป็นกะข้ามคืน)
+    """
+    name: str
+    start: time
+    end: time
+
+    @property
+    def overnight(self) -> bool:
+        """True หากกะนี้เลิกงานในวันถัดไป"""
+        return self.end <= self.start
+
+
+class ShiftSchedule:
+    """
+    ทะเบียนกะการทำงานที่คอมไพล์ไว้ล่วงหน้า สำหรับคำนวณสถานะการลงเวลาแบบ O(1) ต่อเหตุการณ์
+
+    กะของพนักงานหาได้ตามลำดับ: กะที่กำหนดรายบุคคล, กะของกลุ่ม (เช่น ฝ่ายหรือสาขา), และกะตั้งต้น
+    เวลาเริ่มและเลิกกะถูกแปลงเป็นจำนวนวินาทีนับจากเที่ยงคืนเก็บไว้ใน list ที่อ้างอิงด้วย index
+    จึงไม่ต้อง parse เวลาซ้ำทุกครั้งที่คำนวณสถานะ
+
+    เวลากะเป็นเวลาท้องถิ่น เวลาเข้าและออกงานที่ส่งให้เมธอดต่าง ๆ จึงต้องแปลงเป็นเวลาท้องถิ่นก่อน
+    (เช่น เวลา UTC ที่ตาราง attendance เก็บ)
+    """
+
+    def __init__(
+        self,
+        shifts: Iterable[Shift],
+        default_shift: str,
+        group_shifts: Optional[Dict[str, str]] = None,
+        employee_groups: Optional[Dict[str, str]] = None,
+        employee_shifts: Optional[Dict[str, str]] = None,
+        holidays: Iterable[date] = ()
+    ):
+        self.shifts: List[Shift] = list(shifts)
+        self._shift_index = {shift.name: i for i, shift in enumerate(self.shifts)}
+        self.default_index = self._shift_index[default_shift]
+
+        self.start_seconds = [seconds_of_day(shift.start) for shift in self.shifts]
+        self.end_seconds = [seconds_of_day(shift.end) for shift in self.shifts]
+
+        # รวมกะของกลุ่มและกะรายบุคคลเป็น dict เดียว username -> index ของกะ
+        group_index = {group: self._shift_index[name] for group, name in (group_shifts or {}).items()}
+        self._employee_index = {
+            username: group_index[group] for username, group in (employee_groups or {}).items()
+        }
+        self._employee_index.update(
+            {username: self._shift_index[name] for username, name in (employee_shifts or {}).items()}
+        )
+        self.holidays = frozenset(holidays)
+
+    @classmethod
+    def default(cls) -> "ShiftSchedule":
+        """ตารางกะตั้งต้น: กะกลางวัน 08:30 - 16:30 สำหรับพนักงานทุกคน"""
+        return cls([Shift("day", time(8, 30), time(16, 30))], default_shift="day")
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ShiftSchedule":
+        """
+        สร้างตารางกะจาก dict
+
+        Args:
+            data (dict): ข้อมูลในรูปแบบ
+                {
+                    "shifts": {"day": {"start": "08:30", "end": "16:30"}, "night": {"start": "22:00", "end": "06:00"}},
+                    "default_shift": "day",
+                    "groups": {"security": "night"},
+                    "employee_groups": {"EMP001": "security"},
+                    "employee_shifts": {"EMP002": "night"},
+                    "holidays": ["2024-12-31"]
+                }
+
+        Returns:
+            ShiftSchedule: ตารางกะที่คอมไพล์แล้ว
+        """
+        shifts = [
+            Shift(name, parse_time(spec["start"]), parse_time(spec["end"]))
+            for name, spec in data["shifts"].items()
+        ]
+        return cls(
+            shifts,
+            default_shift=data.get("default_shift", shifts[0].name),
+            group_shifts=data.get("groups"),
+            employee_groups=data.get("employee_groups"),
+            employee_shifts=data.get("employee_shifts"),
+            holidays=[date.fromisoformat(value) for value in data.get("holidays", [])]
+        )
+
+    @classmethod
+    def from_file(cls, path: str) -> "ShiftSchedule":
+        """โหลดตารางกะจากไฟล์ JSON (รูปแบบเดียวกับ from_dict)"""
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def shift_index(self, username: Optional[str]) -> int:
+        """คืนค่า index ของกะที่ใช้กับพนักงาน"""
+        return self._employee_index.get(username, self.default_index)
+
+    def shift_for(self, username: Optional[str]) -> Shift:
+        """คืนค่ากะที่ใช้กับพนักงาน"""
+        return self.shifts[self.shift_index(username)]
+
+    def is_holiday(self, work_date: Optional[date]) -> bool:
+        """True หากวันที่กำหนดเป็นวันหยุด"""
+        return work_date in self.holidays
+
+    def is_late(self, shift_index: int, check_in_time: datetime) -> bool:
+        """True หากเวลาเข้างาน (เวลาท้องถิ่น) อยู่หลังเวลาเริ่มกะ (ภายในครึ่งวันหลังเริ่มกะ)"""
+        offset = (seconds_of_day(check_in_time) - self.start_seconds[shift_index]) % SECONDS_PER_DAY
+        return 0 < offset < STATUS_WINDOW_SECONDS
+
+    def is_early_leave(self, shift_index: int, check_out_time: datetime) -> bool:
+        """True หากเวลาออกงาน (เวลาท้องถิ่น) อยู่ก่อนเวลาเลิกกะ (ภายในครึ่งวันก่อนเลิกกะ)"""
+        offset = (self.end_seconds[shift_index] - seconds_of_day(check_out_time)) % SECONDS_PER_DAY
+        return 0 < offset < STATUS_WINDOW_SECONDS
+
+    def shift_start_time(self, shift_index: int, check_in_time: datetime) -> datetime:
+        """
+        เวลาเริ่มของกะที่ check_in นี้เป็นของ (เวลาท้องถิ่น)
+
+        ใช้หน้าต่างเดียวกับ is_late: เข้างานภายในครึ่งวันหลังเริ่มกะนับเป็นกะที่เริ่มไปแล้ว
+        นอกนั้นนับเป็นกะถัดไปที่ยังไม่เริ่ม (มาก่อนเวลา)
+        """
+        offset = (seconds_of_day(check_in_time) - self.start_seconds[shift_index]) % SECONDS_PER_DAY
+        if offset < STATUS_WINDOW_SECONDS:
+            return check_in_time - timedelta(seconds=offset)
+        return check_in_time + timedelta(seconds=SECONDS_PER_DAY - offset)
+
+    def work_date(self, shift_index: int, check_in_time: datetime) -> date:
+        """
+        วันทำงานของ check_in (เวลาท้องถิ่น) คือวันที่กะเริ่ม ไม่ใช่วันที่ตามปฏิทินของเวลาเข้างาน
+        เช่น กะ 22:00 ที่เข้างานสายเวลา 00:10 ยังนับเป็นวันทำงานของวันก่อนหน้า
+        """
+        return self.shift_start_time(shift_index, check_in_time).date()
+
+    def check_out_work_date(self, shift_index: int, check_out_time: datetime) -> date:
+        """
+        วันทำงานของ check_out (เวลาท้องถิ่น): วันที่เริ่มกะที่เลิกใกล้เวลาออกงานที่สุด
+
+        ออกก่อนเลิกกะไม่เกินครึ่งวันนับเป็นกะที่ยังไม่เลิก (หน้าต่างเดียวกับ is_early_leave)
+        นอกนั้นนับเป็นกะที่เลิกไปแล้ว (ทำงานเกินเวลา)
+        """
+        end = self.end_seconds[shift_index]
+        offset = (end - seconds_of_day(check_out_time)) % SECONDS_PER_DAY
+        if offset < STATUS_WINDOW_SECONDS:
+            shift_end = check_out_time + timedelta(seconds=offset)
+        else:
+            shift_end = check_out_time - timedelta(seconds=SECONDS_PER_DAY - offset)
+        duration = (end - self.start_seconds[shift_index]) % SECONDS_PER_DAY or SECONDS_PER_DAY
+        return (shift_end - timedelta(seconds=duration)).date()
+
+    def status_code(
+        self,
+        username: Optional[str],
+        check_in_time: datetime,
+        check_out_time: Optional[datetime] = None,
+        work_date: Optional[date] = None
+    ) -> int:
+        """
+        คำนวณรหัสสถานะการลงเวลาของเหตุการณ์เดียว
+
+        Args:
+            username (str, optional): ชื่อผู้ใช้ (None ใช้กะตั้งต้น)
+            check_in_time (datetime): เวลาเข้างาน (เวลาท้องถิ่น)
+            check_out_time (datetime, optional): เวลาออกงาน (เวลาท้องถิ่น)
+            work_date (date, optional): วันทำงานตามเวลาท้องถิ่น ใช้ตรวจสอบวันหยุด
+
+        Returns:
+            int: STATUS_NORMAL, STATUS_LATE หรือ STATUS_EARLY_LEAVE
+        """
+        if self.is_holiday(work_date):
+            return STATUS_NORMAL
+        index = self.shift_index(username)
+        if check_out_time is not None and self.is_early_leave(index, check_out_time):
+            return STATUS_EARLY_LEAVE
+        if self.is_late(index, check_in_time):
+            return STATUS_LATE
+        return STATUS_NORMAL
+
+    def shift_indices(self, usernames: Iterable[str]):
+        """คืนค่า numpy array ของ index กะสำหรับรายชื่อพนักงาน"""
+        import numpy as np
+
+        return np.fromiter((self.shift_index(username) for username in usernames), dtype=np.int32)
+
+    def work_dates(self, shift_indices, check_in_times):
+        """
+        คำนวณวันทำงานแบบ vectorized (กฎเดียวกับ work_date)
+
+        Args:
+            shift_indices (np.ndarray): index ของกะต่อเหตุการณ์
+            check_in_times (np.ndarray): เวลาเข้างานตามเวลาท้องถิ่น (datetime64)
+
+        Returns:
+            np.ndarray: วันทำงาน (datetime64[D])
+        """
+        import numpy as np
+
+        seconds = (check_in_times - check_in_times.astype("datetime64[D]")) / np.timedelta64(1, "s")
+        offset = np.mod(seconds - np.asarray(self.start_seconds)[shift_indices], SECONDS_PER_DAY)
+        shift = np.where(offset < STATUS_WINDOW_SECONDS, -offset, SECONDS_PER_DAY - offset)
+        shift_starts = check_in_times + (shift * 1_000_000).astype("timedelta64[us]")
+        return shift_starts.astype("datetime64[D]")
+
+    def status_codes(self, shift_indices, check_in_seconds, check_out_seconds=None, holiday_mask=None):
+        """
+        คำนวณรหัสสถานะการลงเวลาแบบ vectorized สำหรับการคำนวณย้อนหลังจำนวนมาก
+
+        Args:
+            shift_indices (np.ndarray): index ของกะต่อเหตุการณ์ (จาก shift_indices)
+            check_in_seconds (np.ndarray): เวลาเข้างานเป็นวินาทีนับจากเที่ยงคืนตามเวลาท้องถิ่น
+            check_out_seconds (np.ndarray, optional): เวลาออกงานเป็นวินาทีตามเวลาท้องถิ่น (NaN หากยังไม่ออกงาน)
+            holiday_mask (np.ndarray, optional): True สำหรับเหตุการณ์ที่ตรงกับวันหยุด
+
+        Returns:
+            np.ndarray: รหัสสถานะ (int8) ต่อเหตุการณ์
+        """
+        import numpy as np
+
+        start = np.asarray(self.start_seconds)[shift_indices]
+        late_offset = np.mod(np.asarray(check_in_seconds, dtype=float) - start, SECONDS_PER_DAY)
+        codes = np.where((late_offset > 0) & (late_offset < STATUS_WINDOW_SECONDS), STATUS_LATE, STATUS_NORMAL)
+
+        if check_out_seconds is not None:
+            end = np.asarray(self.end_seconds)[shift_indices]
+            early_offset = np.mod(end - np.asarray(check_out_seconds, dtype=float), SECONDS_PER_DAY)
+            # NaN (ยังไม่ออกงาน) ทำให้การเปรียบเทียบเป็น False
+            early = (early_offset > 0) & (early_offset < STATUS_WINDOW_SECONDS)
+            codes = np.where(early, STATUS_EARLY_LEAVE, codes)
+
+        if holiday_mask is not None:
+            codes = np.where(holiday_mask, STATUS_NORMAL, codes)
+        return codes.astype(np.int8)
@@ -0,0 +1,156 @@
+from datetime import date, datetime
+
+import numpy as np
+import pytest
+
+from shift_schedule import (
+    STATUS_EARLY_LEAVE, STATUS_LATE, STATUS_NORMAL, ShiftSchedule, seconds_of_day
+)
+
+
+@pytest.fixture
+def schedule():
+    return ShiftSchedule.from_dict({
+        "shifts": {"day": {"start": "08:30", "end": "16:30"}, "night": {"start": "22:00", "end": "06:00"}},
+        "default_shift": "day",
+        "groups": {"security": "night"},
+        "employee_groups": {"EMP001": "security"},
+        "employee_shifts": {"EMP002": "night"},
+        "holidays": ["2024-12-31"]
+    })
+
+
+def at(hour, minute, second=0, day=2):
+    return datetime(2024, 12, day, hour, minute, second)
+
+
+def test_shift_lookup_order(schedule):
+    assert schedule.shift_for("EMP001").name == "night"
+    assert schedule.shift_for("EMP002").name == "night"
+    assert schedule.shift_for("EMP999").name == "day"
+    assert schedule.shift_for(None).name == "day"
+
+
+@pytest.mark.parametrize("check_in, late", [
+    (at(8, 30), False),        # ตรงเวลาเริ่มกะพอดี
+    (at(8, 30, 1), True),      # หลังเริ่มกะหนึ่งวินาที
+    (at(9, 0), True),
+    (at(20, 29, 59), True),    # ยังอยู่ในครึ่งวันหลังเริ่มกะ
+    (at(20, 30), False),       # ครบครึ่งวัน ถือว่ามาก่อนกะของวันถัดไป
+    (at(7, 0), False),         # มาก่อนเวลา
+    (at(0, 0), False),
+])
+def test_day_shift_late_boundaries(schedule, check_in, late):
+    assert schedule.is_late(schedule.shift_index(None), check_in) is late
+
+
+@pytest.mark.parametrize("check_out, early", [
+    (at(16, 30), False),       # ตรงเวลาเลิกกะพอดี
+    (at(16, 29, 59), True),    # ก่อนเลิกกะหนึ่งวินาที
+    (at(12, 0), True),
+    (at(4, 30, 1), True),      # ยังอยู่ในครึ่งวันก่อนเลิกกะ
+    (at(4, 30), False),
+    (at(17, 0), False),        # ออกหลังเวลาเลิกกะ
+])
+def test_day_shift_early_leave_boundaries(schedule, check_out, early):
+    assert schedule.is_early_leave(schedule.shift_index(None), check_out) is early
+
+
+@pytest.mark.parametrize("check_in, late", [
+    (at(21, 45), False),
+    (at(22, 0), False),
+    (at(22, 0, 1), True),
+    (at(1, 0, day=3), True),   # ข้ามเที่ยงคืนแล้ว
+    (at(9, 59, 59, day=3), True),
+    (at(10, 0, day=3), False),
+])
+def test_overnight_shift_late_across_midnight(schedule, check_in, late):
+    assert schedule.is_late(schedule.shift_index("EMP002"), check_in) is late
+
+
+@pytest.mark.parametrize("check_out, early", [
+    (at(6, 0, day=3), False),
+    (at(5, 59, 59, day=3), True),
+    (at(23, 0), True),         # ออกก่อนเที่ยงคืนของวันเริ่มกะ
+    (at(7, 0, day=3), False),
+])
+def test_overnight_shift_early_leave_across_midnight(schedule, check_out, early):
+    assert schedule.is_early_leave(schedule.shift_index("EMP002"), check_out) is early
+
+
+def test_status_code_precedence(schedule):
+    assert schedule.status_code("EMP999", at(8, 0)) == STATUS_NORMAL
+    assert schedule.status_code("EMP999", at(9, 0)) == STATUS_LATE
+    assert schedule.status_code("EMP999", at(9, 0), at(17, 0)) == STATUS_LATE
+    # ออกก่อนมีผลเหนือกว่ามาสาย
+    assert schedule.status_code("EMP999", at(9, 0), at(15, 0)) == STATUS_EARLY_LEAVE
+    assert schedule.status_code("EMP999", at(8, 0), at(16, 30)) == STATUS_NORMAL
+
+
+def test_holiday_is_always_normal(schedule):
+    holiday = date(2024, 12, 31)
+    assert schedule.is_holiday(holiday)
+    assert schedule.status_code("EMP999", at(10, 0, day=31), at(12, 0, day=31), holiday) == STATUS_NORMAL
+    assert schedule.status_code("EMP999", at(10, 0, day=31), work_date=date(2024, 12, 30)) == STATUS_LATE
+
+
+def test_status_codes_matches_status_code(schedule):
+    usernames = ["EMP999", "EMP001", "EMP002", "EMP999", "EMP999", "EMP002", "EMP999"]
+    check_ins = [at(8, 30), at(22, 0, 1), at(21, 0), at(9, 0), at(8, 0), at(22, 0), at(8, 31, day=31)]
+    check_outs = [at(16, 30), None, at(5, 0, day=3), None, at(16, 29), at(6, 0, day=3), at(12, 0, day=31)]
+    work_dates = [value.date() for value in check_ins]
+
+    expected = [
+        schedule.status_code(username, check_in, check_out, work_date)
+        for username, check_in, check_out, work_date in zip(usernames, check_ins, check_outs, work_dates)
+    ]
+    codes = schedule.status_codes(
+        schedule.shift_indices(usernames),
+        np.array([seconds_of_day(value) for value in check_ins]),
+        np.array([seconds_of_day(value) if value else np.nan for value in check_outs]),
+        np.array([schedule.is_holiday(value) for value in work_dates])
+    )
+    assert codes.tolist() == expected
+    assert expected == [
+        STATUS_NORMAL, STATUS_LATE, STATUS_EARLY_LEAVE, STATUS_LATE, STATUS_EARLY_LEAVE, STATUS_NORMAL, STATUS_NORMAL
+    ]
+
+
+@pytest.mark.parametrize("username, check_in, work_date", [
+    ("EMP002", at(22, 0), date(2024, 12, 2)),
+    ("EMP002", at(0, 10, day=3), date(2024, 12, 2)),     # มาสายหลังเที่ยงคืน ยังเป็นกะของวันก่อนหน้า
+    ("EMP002", at(21, 30), date(2024, 12, 2)),           # มาก่อนเวลาเริ่มกะ
+    ("EMP002", at(10, 0, day=3), date(2024, 12, 3)),     # เกินครึ่งวันหลังเริ่มกะ นับเป็นกะถัดไป
+    ("EMP999", at(7, 0), date(2024, 12, 2)),
+    ("EMP999", at(9, 0), date(2024, 12, 2)),
+    ("EMP999", at(0, 10), date(2024, 12, 2)),
+])
+def test_work_date_is_the_shift_start_date(schedule, username, check_in, work_date):
+    assert schedule.work_date(schedule.shift_index(username), check_in) == work_date
+
+
+def test_late_arrival_after_midnight_does_not_take_next_nights_work_date(schedule):
+    index = schedule.shift_index("EMP002")
+    late = schedule.work_date(index, at(0, 10, day=3))
+    next_night = schedule.work_date(index, at(22, 0, day=3))
+    assert late == date(2024, 12, 2)
+    assert next_night == date(2024, 12, 3)
+
+
+@pytest.mark.parametrize("username, check_out, work_date", [
+    ("EMP002", at(6, 0, day=3), date(2024, 12, 2)),
+    ("EMP002", at(23, 0), date(2024, 12, 2)),            # ออกก่อนเที่ยงคืน
+    ("EMP002", at(8, 0, day=3), date(2024, 12, 2)),      # ทำงานเกินเวลา
+    ("EMP999", at(17, 0), date(2024, 12, 2)),
+    ("EMP999", at(12, 0), date(2024, 12, 2)),
+])
+def test_check_out_work_date(schedule, username, check_out, work_date):
+    assert schedule.check_out_work_date(schedule.shift_index(username), check_out) == work_date
+
+
+def test_work_dates_matches_work_date(schedule):
+    usernames = ["EMP002", "EMP002", "EMP002", "EMP999", "EMP999", "EMP001"]
+    check_ins = [at(22, 0), at(0, 10, day=3), at(10, 0, day=3), at(7, 0), at(23, 59, 59), at(21, 59, 59, day=31)]
+    expected = [schedule.work_date(schedule.shift_index(u), t) for u, t in zip(usernames, check_ins)]
+    dates = schedule.work_dates(schedule.shift_indices(usernames), np.array(check_ins, dtype="datetime64[us]"))
+    assert dates.tolist() == expected
@@ -1,5 +1,14 @@
-from datetime import datetime, timedelta
+import csv
+from datetime import date, datetime, time, timedelta
 from enum import Enum
+from typing import Iterable, Iterator, Optional
+
+import pytz
+
+try:
+    import numpy as np  # ใช้เฉพาะโหมดเก็บข้อมูลแบบ columnar
+except ImportError:
+    np = None
 
 class AttendanceStatus(Enum):
     NORMAL = "ปกติ"
@@ -66,22 +75,278 @@ class TimeAttendanceSystem:
     def _approve_retroactive_entry(self):
         return True
 
-# ตัวอย่างการใช้งาน
-system = TimeAttendanceSystem()
-
-# กะกลางวัน (08:30 - 16:30)
-print("กะกลางวัน:")
-success, message = system.check_in("EMP001", datetime(2024, 9, 12, 8, 22))
-print(message)
-success, message = system.check_out("EMP001", datetime(2024, 9, 12, 16, 30))
-print(message)
-
-success, message = system.check_in("EMP002", datetime(2024, 9, 12, 9, 0))
-print(message)
-success, message = system.check_out("EMP002", datetime(2024, 9, 12, 16, 0))
-print(message)
-
-success, message = system.check_in("EMP002", datetime(2024, 9, 12, 9, 0))
-print(message)
-success, message = system.check_out("EMP002", datetime(2024, 9, 12, 17, 0))
-print(message)
\ No newline at end of file
+# เขตเวลาท้องถิ่นที่ main.py ใช้คำนวณวันทำงาน (ฐานข้อมูลเก็บเวลาเป็น UTC แบบ timezone-naive)
+LOCAL_TIMEZONE = pytz.timezone("Asia/Bangkok")
+
+# รหัสสถานะในอาร์เรย์ (ลำดับเดียวกับ AttendanceStatus และรหัสใน shift_schedule.py)
+STATUS_BY_CODE = list(AttendanceStatus)
+NO_RECORD = -1  # ไม่มีการลงเวลาในช่องนี้
+MIN_WORK_SECONDS = 8 * 3600  # ทำงานน้อยกว่านี้และออกก่อนเลิกกะถือว่าออกก่อน
+
+
+def _seconds_of_day(value: time) -> int:
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+class ColumnarTimeAttendanceSystem:
+    """
+    ระบบลงเวลาแบบเก็บข้อมูลเป็นอาร์เรย์ NumPy (พนักงาน × วัน) สำหรับจำลองข้อมูลจำนวนมาก
+
+    เวลาเข้าและออกงานเก็บเป็นจำนวนวินาทีนับจากเที่ยงคืนของวันทำงาน (int32, NO_RECORD หากไม่มี)
+    และสถานะเก็บเป็นรหัส int8 ใช้หน่วยความจำราว 9 ไบต์ต่อช่อง (50,000 คน × 365 วัน ≈ 165 MB)
+    เทียบกับ dict ของ datetime และ Enum ใน TimeAttendanceSystem ที่ใช้หลายร้อยไบต์ต่อรายการ
+
+    กฎการคำนวณสถานะเหมือน TimeAttendanceSystem: เข้างานหลังเวลาเริ่มกะถือว่าสาย
+    และเมื่อลงเวลาออก สถานะจะเป็นออกก่อน (ออกก่อนเลิกกะและทำงานไม่ถึง 8 ชั่วโมง) หรือปกติ
+
+    Attributes:
+        employee_ids (list): รหัสพนักงานตามลำดับแถว
+        start_date (date): วันแรกของตาราง
+        days (int): จำนวนวัน (คอลัมน์)
+        check_in (np.ndarray): เวลาเข้างาน (วินาที) ขนาด (พนักงาน, วัน)
+        check_out (np.ndarray): เวลาออกงาน (วินาที) ขนาด (พนักงาน, วัน)
+        status (np.ndarray): รหัสสถานะ ขนาด (พนักงาน, วัน)
+    """
+
+    def __init__(self, employee_ids: Iterable[str], start_date: date, days: int,
+                 day_shift_start="08:30", day_shift_end="16:30"):
+        if np is None:
+            raise ImportError("ColumnarTimeAttendanceSystem requires numpy")
+        self.employee_ids = list(employee_ids)
+        self._employee_index = {employee_id: i for i, employee_id in enumerate(self.employee_ids)}
+        self.start_date = start_date
+        self.days = days
+        self.shift_start_seconds = _seconds_of_day(datetime.strptime(day_shift_start, "%H:%M").time())
+        self.shift_end_seconds = _seconds_of_day(datetime.strptime(day_shift_end, "%H:%M").time())
+
+        shape = (len(self.employee_ids), days)
+        self.check_in = np.full(shape, NO_RECORD, dtype=np.int32)
+        self.check_out = np.full(shape, NO_RECORD, dtype=np.int32)
+        self.status = np.full(shape, NO_RECORD, dtype=np.int8)
+
+    def _cell(self, employee_id: str, value: datetime):
+        """คืนค่า (แถว, คอลัมน์, วินาทีนับจากเที่ยงคืน) ของการลงเวลา หรือ None หากอยู่นอกตาราง"""
+        row = self._employee_index.get(employee_id)
+        day = (value.date() - self.start_date).days
+        if row is None or not 0 <= day < self.days:
+            return None
+        return row, day, _seconds_of_day(value.time())
+
+    def check_in_one(self, employee_id: str, check_in_time: datetime):
+        """ลงเวลาเข้างานหนึ่งรายการ (คืนค่าและข้อความแบบเดียวกับ TimeAttendanceSystem.check_in)"""
+        cell = self._cell(employee_id, check_in_time)
+        if cell is None:
+            return False, "ไม่พบพนักงานหรือวันที่ในตาราง"
+        row, day, seconds = cell
+        if self.check_in[row, day] != NO_RECORD:
+            return False, "พนักงานได้ลงเวลาเข้างานในวันนี้แล้ว"
+        self.check_in[row, day] = seconds
+        status = AttendanceStatus.LATE if seconds > self.shift_start_seconds else AttendanceStatus.NORMAL
+        self.status[row, day] = STATUS_BY_CODE.index(status)
+        return True, f"ลงเวลาเข้างานสำเร็จ สถานะ: {status.value}"
+
+    def check_out_one(self, employee_id: str, check_out_time: datetime):
+        """ลงเวลาออกงานหนึ่งรายการ (คืนค่าและข้อความแบบเดียวกับ TimeAttendanceSystem.check_out)"""
+        cell = self._cell(employee_id, check_out_time)
+        if cell is None:
+            return False, "ไม่พบข้อมูลการลงเวลาเข้างานของพนักงาน"
+        row, day, seconds = cell
+        check_in_seconds = int(self.check_in[row, day])
+        if check_in_seconds == NO_RECORD:
+            return False, "ไม่พบข้อมูลการลงเวลาเข้างานของพนักงานสำหรับวันนี้"
+        if seconds <= check_in_seconds:
+            return False, "เวลาออกงานต้องมาหลังเวลาเข้างาน"
+        self.check_out[row, day] = seconds
+        early = seconds < self.shift_end_seconds and seconds - check_in_seconds < MIN_WORK_SECONDS
+        status = AttendanceStatus.EARLY_LEAVE if early else AttendanceStatus.NORMAL
+        self.status[row, day] = STATUS_BY_CODE.index(status)
+        return True, f"ลงเวลาออกงานสำเร็จ สถานะ: {status.value}"
+
+    def record_check_ins(self, rows, days, seconds) -> int:
+        """
+        ลงเวลาเข้างานจำนวนมากพร้อมกัน (ช่องที่มีเวลาเข้างานแล้วจะไม่ถูกเขียนทับ)
+
+        Args:
+            rows (np.ndarray): index แถวของพนักงาน
+            days (np.ndarray): index คอลัมน์ของวัน
+            seconds (np.ndarray): เวลาเข้างานเป็นวินาทีนับจากเที่ยงคืน
+
+        Returns:
+            int: จำนวนช่องที่ถูกบันทึก
+        """
+        rows, days, seconds = np.asarray(rows), np.asarray(days), np.asarray(seconds, dtype=np.int32)
+        flat = np.ravel_multi_index((rows, days), self.check_in.shape)
+        # เก็บรายการแรกของแต่ละช่อง และข้ามช่องที่ลงเวลาไว้แล้ว
+        flat, first = np.unique(flat, return_index=True)
+        seconds = seconds[first]
+        free = self.check_in.ravel()[flat] == NO_RECORD
+        self.check_in.ravel()[flat[free]] = seconds[free]
+        return int(free.sum())
+
+    def record_check_outs(self, rows, days, seconds) -> int:
+        """
+        ลงเวลาออกงานจำนวนมากพร้อมกัน (เฉพาะช่องที่มีเวลาเข้างาน และเวลาออกมาหลังเวลาเข้า)
+
+        Args:
+            rows (np.ndarray): index แถวของพนักงาน
+            days (np.ndarray): index คอลัมน์ของวัน
+            seconds (np.ndarray): เวลาออกงานเป็นวินาทีนับจากเที่ยงคืน
+
+        Returns:
+            int: จำนวนช่องที่ถูกบันทึก
+        """
+        rows, days, seconds = np.asarray(rows), np.asarray(days), np.asarray(seconds, dtype=np.int32)
+        check_in = self.check_in[rows, days]
+        valid = (check_in != NO_RECORD) & (seconds > check_in)
+        self.check_out[rows[valid], days[valid]] = seconds[valid]
+        return int(valid.sum())
+
+    def compute_statuses(self, start_day: int = 0, end_day: Optional[int] = None):
+        """
+        คำนวณรหัสสถานะของทุกพนักงานในช่วงวันแบบ vectorized แล้วเก็บลง self.status
+
+        Args:
+            start_day (int): index ของวันแรก
+            end_day (int, optional): index ถัดจากวันสุดท้าย (ไม่ระบุ = ถึงวันสุดท้ายของตาราง)
+
+        Returns:
+            np.ndarray: รหัสสถานะของช่วงวันที่คำนวณ (view ของ self.status)
+        """
+        window = slice(start_day, end_day)
+        check_in = self.check_in[:, window]
+        check_out = self.check_out[:, window]
+        has_check_in = check_in != NO_RECORD
+        has_check_out = check_out != NO_RECORD
+
+        late = check_in > self.shift_start_seconds
+        early = (check_out < self.shift_end_seconds) & (check_out - check_in < MIN_WORK_SECONDS)
+        codes = np.where(
+            has_check_out,
+            np.where(early, STATUS_BY_CODE.index(AttendanceStatus.EARLY_LEAVE), STATUS_BY_CODE.index(AttendanceStatus.NORMAL)),
+            np.where(late, STATUS_BY_CODE.index(AttendanceStatus.LATE), STATUS_BY_CODE.index(AttendanceStatus.NORMAL))
+        )
+        self.status[:, window] = np.where(has_check_in, codes, NO_RECORD)
+        return self.status[:, window]
+
+    def month_range(self, year: int, month: int):
+        """คืนค่า (index วันแรก, index ถัดจากวันสุดท้าย) ของเดือนที่กำหนดภายในตาราง"""
+        first = date(year, month, 1)
+        next_month = date(year + month // 12, month % 12 + 1, 1)
+        start_day = max(0, (first - self.start_date).days)
+        end_day = min(self.days, (next_month - self.start_date).days)
+        return start_day, max(start_day, end_day)
+
+    def compute_month(self, year: int, month: int):
+        """คำนวณสถานะของทั้งเดือนแบบ vectorized (ดู compute_statuses)"""
+        return self.compute_statuses(*self.month_range(year, month))
+
+    def status_counts(self, start_day: int = 0, end_day: Optional[int] = None) -> dict:
+        """คืนค่าจำนวนการลงเวลาแยกตามสถานะในช่วงวัน"""
+        codes = self.status[:, start_day:end_day]
+        counts = np.bincount(codes[codes != NO_RECORD].astype(np.intp), minlength=len(STATUS_BY_CODE))
+        return {status.value: int(counts[i]) for i, status in enumerate(STATUS_BY_CODE)}
+
+    def export_rows(self, start_day: int = 0, end_day: Optional[int] = None) -> Iterator[dict]:
+        """
+        คืนค่าแถวตาม schema ของตาราง attendance ใน main.py สำหรับช่องที่มีเวลาเข้างาน
+
+        เวลาในแต่ละแถวถูกแปลงจากเวลาท้องถิ่นเป็น UTC แบบ timezone-naive และสถานะเป็นค่าของ AttendanceStatus
+
+        Yields:
+            dict: {"username", "work_date", "check_in", "check_out", "status"}
+        """
+        end_day = self.days if end_day is None else end_day
+        rows, days = np.nonzero(self.check_in[:, start_day:end_day] != NO_RECORD)
+        days = days + start_day
+        # เวลาเที่ยงคืนท้องถิ่นของแต่ละวันในรูปแบบ UTC (คำนวณครั้งเดียวต่อวัน)
+        day_starts = {}
+        for day in np.unique(days):
+            work_date = self.start_date + timedelta(days=int(day))
+            local_midnight = LOCAL_TIMEZONE.localize(datetime.combine(work_date, time()))
+            day_starts[day] = (work_date, local_midnight.astimezone(pytz.utc).replace(tzinfo=None))
+
+        check_in = self.check_in[rows, days].tolist()
+        check_out = self.check_out[rows, days].tolist()
+        status = self.status[rows, days].tolist()
+        for row, day, check_in_seconds, check_out_seconds, code in zip(rows.tolist(), days, check_in, check_out, status):
+            work_date, utc_midnight = day_starts[day]
+            yield {
+                "username": self.employee_ids[row],
+                "work_date": work_date,
+                "check_in": utc_midnight + timedelta(seconds=check_in_seconds),
+                "check_out": utc_midnight + timedelta(seconds=check_out_seconds) if check_out_seconds != NO_RECORD else None,
+                "status": STATUS_BY_CODE[code].value if code != NO_RECORD else None
+            }
+
+    def export_csv(self, path: str, start_day: int = 0, end_day: Optional[int] = None) -> int:
+        """
+        เขียนข้อมูลการลงเวลาเป็นไฟล์ CSV ตามคอลัมน์ของตาราง attendance ใน main.py
+
+        Returns:
+            int: จำนวนแถวที่เขียน
+        """
+        count = 0
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["username", "work_date", "check_in", "check_out", "status"])
+            for record in self.export_rows(start_day, end_day):
+                writer.writerow([
+                    record["username"],
+                    record["work_date"].isoformat(),
+                    record["check_in"].isoformat(sep=" "),
+                    record["check_out"].isoformat(sep=" ") if record["check_out"] else "",
+                    record["status"] or ""
+                ])
+                count += 1
+        return count
+
+
+def simulate(system: ColumnarTimeAttendanceSystem, seed: int = 0, attendance_rate: float = 0.95):
+    """
+    สร้างข้อมูลการลงเวลาจำลองให้ทุกพนักงานทุกวันแบบ vectorized
+
+    เวลาเข้างานสุ่มรอบ 08:20 (ส่วนเบี่ยงเบน 15 นาที) และทำงานประมาณ 8 ชั่วโมง 30 นาที (ส่วนเบี่ยงเบน 30 นาที)
+    """
+    rng = np.random.default_rng(seed)
+    shape = system.check_in.shape
+    present = rng.random(shape) < attendance_rate
+    rows, days = np.nonzero(present)
+    check_in = rng.normal(8 * 3600 + 20 * 60, 15 * 60, rows.size).astype(np.int32)
+    check_out = check_in + rng.normal(8.5 * 3600, 30 * 60, rows.size).astype(np.int32)
+    system.record_check_ins(rows, days, check_in)
+    system.record_check_outs(rows, days, check_out)
+
+
+if __name__ == "__main__":
+    import time as timer
+
+    # ตัวอย่างการใช้งาน
+    system = TimeAttendanceSystem()
+
+    # กะกลางวัน (08:30 - 16:30)
+    print("กะกลางวัน:")
+    success, message = system.check_in("EMP001", datetime(2024, 9, 12, 8, 22))
+    print(message)
+    success, message = system.check_out("EMP001", datetime(2024, 9, 12, 16, 30))
+    print(message)
+
+    success, message = system.check_in("EMP002", datetime(2024, 9, 12, 9, 0))
+    print(message)
+    success, message = system.check_out("EMP002", datetime(2024, 9, 12, 16, 0))
+    print(message)
+
+    success, message = system.check_in("EMP002", datetime(2024, 9, 12, 9, 0))
+    print(message)
+    success, message = system.check_out("EMP002", datetime(2024, 9, 12, 17, 0))
+    print(message)
+
+    # โหมด columnar: จำลองพนักงาน 50,000 คนตลอดหนึ่งเดือน
+    if np is not None:
+        print("โหมด columnar:")
+        employees = [f"EMP{i:06d}" for i in range(50_000)]
+        columnar = ColumnarTimeAttendanceSystem(employees, date(2024, 9, 1), 30)
+        started = timer.perf_counter()
+        simulate(columnar)
+        columnar.compute_month(2024, 9)
+        print(f"จำลองและคำนวณสถานะ {columnar.check_in.size:,} ช่องใน {timer.perf_counter() - started:.2f} วินาที")
+        print(columnar.status_counts())